@@ -617,10 +617,12 @@ def _generate_libc_ninja():
       vars.get_cxxflags().append('-DBUILDING_LINKER')
     return True
 
-  make_to_ninja.MakefileNinjaTranslator('android/bionic/libc').generate(
-      lambda vars: _filter(vars, is_for_linker=False))
-  make_to_ninja.MakefileNinjaTranslator('android/bionic/libc').generate(
-      lambda vars: _filter(vars, is_for_linker=True))
+  # Both translators read the same makefile, so make runs only once.
+  make_to_ninja.MakefileNinjaTranslator.generate_all([
+      make_to_ninja.MakefileNinjaTranslator('android/bionic/libc').transform(
+          lambda vars: _filter(vars, is_for_linker=False)),
+      make_to_ninja.MakefileNinjaTranslator('android/bionic/libc').transform(
+          lambda vars: _filter(vars, is_for_linker=True))])
 
 
 def _generate_libm_ninja():
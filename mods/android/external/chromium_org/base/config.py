@@ -126,7 +126,8 @@ def _generate_chromium_base_ninja_common(module_name, instances, enable_libcxx):
                             'libchromium_base.a.defined')
     n.build([out_path], 'dump_defined_symbols',
             build_common.get_build_path_for_library('libchromium_base.a'),
-            implicit='src/build/symbol_tool.py')
+            implicit=['src/build/symbol_tool.py',
+                      'src/build/util/elf_symbols.py'])
 
 
 def _generate_chromium_base_libcxx_ninja():
@@ -5,13 +5,17 @@
 # found in the LICENSE file.
 
 import argparse
+import contextlib
 import hashlib
+import json
 import logging
 import multiprocessing
 import os
 import re
 import subprocess
 import sys
+import threading
+import time
 
 from src.build import build_common
 from src.build import toolchain
@@ -27,11 +31,153 @@ _MINIDUMP_STACKWALK_TOOL = toolchain.get_nacl_tool('minidump_stackwalk')
 _SYMBOL_OUT_DIR = 'out/symbols'
 
 
-def _get_symbol_marker(path):
+# The symbol store is evicted in LRU order once the symbol files in it grow
+# larger than this.
+_SYMBOL_STORE_MAX_SIZE = 4 * 1024 * 1024 * 1024
+# dump_syms needs memory roughly proportional to the size of the binary,
+# mostly for its DWARF parse. This is a rough upper bound of the ratio.
+_DUMP_SYMS_MEMORY_PER_BINARY_BYTE = 8
+
+
+def _get_content_hash(path):
   sha1 = hashlib.sha1()
-  with open(path) as f:
-    sha1.update(f.read())
-  return os.path.join(_SYMBOL_OUT_DIR, 'hash', sha1.hexdigest())
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1024 * 1024), ''):
+      sha1.update(chunk)
+  return sha1.hexdigest()
+
+
+def _get_physical_memory_size():
+  return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+class SymbolStore(object):
+  """Keeps the symbol files extracted by dump_syms, keyed by binary content.
+
+  The symbol files are laid out as minidump_stackwalk expects, i.e.
+  <out_dir>/<basename>/<module id>/<basename>.sym. A manifest next to them
+  maps the name and the content hash of each dumped binary to its symbol
+  file, so a binary is dumped again only when its content is changed. When
+  the symbol files in total exceed |max_size|, the least recently used
+  entries are evicted, except ones used by this process.
+  """
+
+  _MANIFEST_VERSION = 1
+
+  def __init__(self, out_dir=_SYMBOL_OUT_DIR, max_size=_SYMBOL_STORE_MAX_SIZE):
+    self._out_dir = out_dir
+    self._max_size = max_size
+    self._manifest_path = os.path.join(out_dir, 'manifest.json')
+    self._lock = threading.Lock()
+    self._entries = self._load_manifest()
+    self._used_keys = set()
+
+  def _load_manifest(self):
+    try:
+      with open(self._manifest_path) as f:
+        manifest = json.load(f)
+    except (IOError, ValueError):
+      return {}
+    if manifest.get('version') != SymbolStore._MANIFEST_VERSION:
+      return {}
+    # Drop the entries whose symbol files are gone, e.g. by a manual cleanup.
+    return dict((key, entry) for key, entry in manifest['entries'].iteritems()
+                if os.path.exists(entry['sympath']))
+
+  @staticmethod
+  def _get_key(binary, content_hash):
+    return '%s/%s' % (os.path.basename(binary), content_hash)
+
+  def lookup(self, binary, content_hash):
+    """Returns the symbol file path of |binary| if it is already dumped."""
+    key = SymbolStore._get_key(binary, content_hash)
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+      entry['atime'] = time.time()
+      self._used_keys.add(key)
+      return entry['sympath']
+
+  def add(self, binary, content_hash, syms):
+    """Stores the dump_syms output |syms| of |binary|."""
+    # The first line should look like:
+    # MODULE Linux arm 0222CE01F27D6870B1FA991F84B9E0460 libc.so
+    symhash = syms.splitlines()[0].split()[3]
+    base = os.path.basename(binary)
+    sympath = os.path.join(self._out_dir, base, symhash, base + '.sym')
+    file_util.makedirs_safely(os.path.dirname(sympath))
+    file_util.write_atomically(sympath, syms)
+
+    key = SymbolStore._get_key(binary, content_hash)
+    with self._lock:
+      self._entries[key] = {
+          'sympath': sympath, 'size': len(syms), 'atime': time.time()}
+      self._used_keys.add(key)
+    return sympath
+
+  def _get_total_size(self):
+    # Binaries with different content may share a module id, and so a symbol
+    # file. Count each file only once.
+    return sum(dict((entry['sympath'], entry['size'])
+                    for entry in self._entries.itervalues()).itervalues())
+
+  def _evict(self):
+    total_size = self._get_total_size()
+    candidates = sorted(
+        (key for key in self._entries if key not in self._used_keys),
+        key=lambda key: self._entries[key]['atime'])
+    for key in candidates:
+      if total_size <= self._max_size:
+        break
+      sympath = self._entries.pop(key)['sympath']
+      if any(entry['sympath'] == sympath
+             for entry in self._entries.itervalues()):
+        continue
+      logging.info('Evicting symbols: %s' % sympath)
+      file_util.remove_file_force(sympath)
+      # Remove the <module id> and <basename> directories if they are empty.
+      try:
+        os.rmdir(os.path.dirname(sympath))
+        os.rmdir(os.path.dirname(os.path.dirname(sympath)))
+      except OSError:
+        pass
+      total_size = self._get_total_size()
+
+  def save(self):
+    """Evicts the old entries, and writes the manifest."""
+    with self._lock:
+      self._evict()
+      file_util.makedirs_safely(self._out_dir)
+      file_util.write_atomically(self._manifest_path, json.dumps({
+          'version': SymbolStore._MANIFEST_VERSION,
+          'entries': self._entries}))
+
+
+class _MemoryBudget(object):
+  """Limits the total estimated memory usage of concurrent tasks.
+
+  A task whose cost alone exceeds the budget can still run, but only when no
+  other task is running.
+  """
+
+  def __init__(self, budget):
+    self._budget = budget
+    self._used = 0
+    self._cond = concurrent.Condition()
+
+  @contextlib.contextmanager
+  def reserve(self, cost):
+    with self._cond:
+      self._cond.wait_for(
+          lambda: self._used == 0 or self._used + cost <= self._budget)
+      self._used += cost
+    try:
+      yield
+    finally:
+      with self._cond:
+        self._used -= cost
+        self._cond.notify_all()
 
 
 class _DumpSymsFilter(concurrent_subprocess.OutputHandler):
@@ -82,37 +228,29 @@ class _DumpSymsFilter(concurrent_subprocess.OutputHandler):
       sys.stderr.write(line)
 
 
-def _extract_symbols_from_one_binary(binary):
-  # If the marker is already written, we should already have the
-  # extracted symbols.
-  marker_path = _get_symbol_marker(binary)
-  if os.path.exists(marker_path):
+def _extract_symbols_from_one_binary(binary, store, memory_budget):
+  content_hash = _get_content_hash(binary)
+  if store.lookup(binary, content_hash):
     logging.info('Skip extracting symbols from: %s' % binary)
     return
 
-  logging.info('Extracting symbols from: %s' % binary)
-  dump_syms_tool = build_common.get_build_path_for_executable(
-      'dump_syms', is_host=True)
-  p = concurrent_subprocess.Popen([dump_syms_tool, binary])
-  my_filter = _DumpSymsFilter()
-  p.handle_output(my_filter)
-  syms = ''.join(my_filter.stdout_result)
-  # The first line should look like:
-  # MODULE Linux arm 0222CE01F27D6870B1FA991F84B9E0460 libc.so
-  symhash = syms.splitlines()[0].split()[3]
-  base = os.path.basename(binary)
-  sympath = os.path.join(_SYMBOL_OUT_DIR, base, symhash, base + '.sym')
-  file_util.makedirs_safely(os.path.dirname(sympath))
-
-  with open(sympath, 'w') as f:
-    f.write(syms)
-
-  # Create the marker directory so we will not need to extract symbols
-  # in the next time.
-  file_util.makedirs_safely(marker_path)
+  with memory_budget.reserve(
+      os.path.getsize(binary) * _DUMP_SYMS_MEMORY_PER_BINARY_BYTE):
+    logging.info('Extracting symbols from: %s' % binary)
+    dump_syms_tool = build_common.get_build_path_for_executable(
+        'dump_syms', is_host=True)
+    p = concurrent_subprocess.Popen([dump_syms_tool, binary])
+    my_filter = _DumpSymsFilter()
+    p.handle_output(my_filter)
+  store.add(binary, content_hash, ''.join(my_filter.stdout_result))
 
 
 def _extract_symbols():
+  store = SymbolStore()
+  # dump_syms on the main nexe takes gigabytes of memory, so running it on
+  # every core at once could make the machine swap. Use up to half of the
+  # physical memory.
+  memory_budget = _MemoryBudget(_get_physical_memory_size() / 2)
   # Extract symbols in parallel.
   with concurrent.CheckedExecutor(concurrent.ThreadPoolExecutor(
       max_workers=multiprocessing.cpu_count(), daemon=True)) as executor:
@@ -120,7 +258,8 @@ def _extract_symbols():
       for filename in filenames:
         if os.path.splitext(filename)[1] in ['.so', '.nexe']:
           executor.submit(_extract_symbols_from_one_binary,
-                          os.path.join(root, filename))
+                          os.path.join(root, filename), store, memory_budget)
+  store.save()
 
 
 def _stackwalk(minidump):
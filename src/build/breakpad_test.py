@@ -0,0 +1,64 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unittests for breakpad.py."""
+
+import os
+import tempfile
+import unittest
+
+from src.build import breakpad
+from src.build.util import file_util
+
+
+def _make_syms(module_id, name):
+  return 'MODULE Linux arm %s %s\nFUNC 0 1 0 main\n' % (module_id, name)
+
+
+class SymbolStoreTest(unittest.TestCase):
+  def setUp(self):
+    self._tmpdir = tempfile.mkdtemp()
+    self._out_dir = os.path.join(self._tmpdir, 'symbols')
+
+  def tearDown(self):
+    file_util.rmtree(self._tmpdir)
+
+  def testLookup(self):
+    store = breakpad.SymbolStore(out_dir=self._out_dir)
+    self.assertIsNone(store.lookup('lib/libc.so', 'hash0'))
+    sympath = store.add('lib/libc.so', 'hash0', _make_syms('ID0', 'libc.so'))
+    self.assertEquals(
+        os.path.join(self._out_dir, 'libc.so', 'ID0', 'libc.so.sym'), sympath)
+    self.assertTrue(os.path.exists(sympath))
+    store.save()
+
+    store = breakpad.SymbolStore(out_dir=self._out_dir)
+    self.assertEquals(sympath, store.lookup('lib/libc.so', 'hash0'))
+    # A rebuilt binary is dumped again.
+    self.assertIsNone(store.lookup('lib/libc.so', 'hash1'))
+    self.assertIsNone(store.lookup('lib/libm.so', 'hash0'))
+
+  def testEvict(self):
+    syms = _make_syms('ID0', 'liba.so')
+    store = breakpad.SymbolStore(out_dir=self._out_dir,
+                                 max_size=len(syms) * 2)
+    old_path = store.add('liba.so', 'hash0', syms)
+    store.add('libb.so', 'hash0', _make_syms('ID0', 'libb.so'))
+    store.save()
+
+    store = breakpad.SymbolStore(out_dir=self._out_dir,
+                                 max_size=len(syms) * 2)
+    self.assertIsNotNone(store.lookup('libb.so', 'hash0'))
+    new_path = store.add('liba.so', 'hash1', _make_syms('ID1', 'liba.so'))
+    store.save()
+    # The least recently used entry is evicted.
+    self.assertFalse(os.path.exists(old_path))
+    self.assertFalse(os.path.exists(os.path.dirname(old_path)))
+    self.assertTrue(os.path.exists(new_path))
+    self.assertIsNone(store.lookup('liba.so', 'hash0'))
+    self.assertIsNotNone(store.lookup('libb.so', 'hash0'))
+
+
+if __name__ == '__main__':
+  unittest.main()
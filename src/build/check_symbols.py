@@ -7,29 +7,19 @@
 """Check if important symbols for NDKs are available."""
 
 import logging
-import subprocess
 import sys
 
-from src.build import toolchain
-from src.build.build_options import OPTIONS
+from src.build.util import elf_symbols
 
 
 def get_defined_symbols(filename):
-  output = subprocess.check_output([toolchain.get_tool(OPTIONS.target(), 'nm'),
-                                    '--defined-only', '-D', filename])
-  syms = set()
-  for line in output.splitlines():
-    toks = line.split()
-    # Empty lines or a filename line.
-    if len(toks) <= 1:
-      continue
-    addr, sym_type, name = line.split()
-    syms.add(name)
-  return syms
+  return set(symbol.name
+             for symbol in elf_symbols.read_symbols(
+                 filename, dynamic=True, use_cache=True)
+             if symbol.is_defined())
 
 
 def main():
-  OPTIONS.parse_configure_file()
   logging.getLogger().setLevel(logging.INFO)
 
   if len(sys.argv) != 3:
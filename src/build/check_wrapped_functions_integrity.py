@@ -7,24 +7,18 @@
 """Check consistency between --wrap for the linker and defined symbols."""
 
 import re
-import subprocess
 import sys
 
-from src.build import toolchain
 from src.build import wrapped_functions
 from src.build.build_options import OPTIONS
+from src.build.util import elf_symbols
 
 
 def _get_defined_functions(library):
-  nm = toolchain.get_tool(OPTIONS.target(), 'nm')
-  nm_output = subprocess.check_output([nm, '-D', '--defined-only', library])
-
-  functions = []
-  for line in nm_output.splitlines():
-    matched = re.search(r' [TW] (\w+)', line)
-    if matched:
-      functions.append(matched.group(1))
-  return functions
+  return [symbol.name
+          for symbol in elf_symbols.read_symbols(
+              library, dynamic=True, use_cache=True)
+          if symbol.type in 'TW' and re.match(r'\w+$', symbol.name)]
 
 
 def _check_wrapper_functions_are_defined(functions, libpt_so):
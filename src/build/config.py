@@ -311,7 +311,8 @@ def _generate_check_symbols_ninja():
     n.build(result_path, rule_name,
             build_common.get_build_path_for_library(lib_name),
             variables={'android_lib': staging.as_staging(so_file)},
-            implicit=[script, staging.as_staging(so_file)])
+            implicit=[script, staging.as_staging(so_file),
+                      'src/build/util/elf_symbols.py'])
 
 
 def generate_ninjas():
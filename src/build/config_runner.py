@@ -2,27 +2,33 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import array
 import cPickle
 import collections
 import errno
+import hashlib
+import itertools
 import logging
 import marshal
 import os
 import re
+import time
 
 from src.build import build_common
 from src.build import config_loader
 from src.build import dependency_inspection
 from src.build import file_list_cache
+from src.build import file_list_watcher
 from src.build import make_to_ninja
 from src.build import ninja_generator
 from src.build import ninja_generator_runner
 from src.build import open_source
+from src.build import tracking_path_cache
 from src.build.build_options import OPTIONS
 from src.build.util import file_util
 
 
-_CONFIG_CACHE_VERSION = 1
+_CONFIG_CACHE_VERSION = 4
 
 _config_loader = config_loader.ConfigLoader()
 
@@ -35,16 +41,20 @@ def _get_build_system_dependencies():
 class ConfigResult(object):
   """Represents a result of a task that ran in ninja_generator_runner.
 
-  The instance holds the output and dependencies of the task.
+  The instance holds the output and dependencies of the task. The output is
+  a list of NinjaGeneratorSummary, whose ninja files are already emitted.
+  |tracking_path_updates| is what the task added to the tracking path cache,
+  which is not cached with the result.
   """
 
   def __init__(self, config_name, entry_point, files, listing_queries,
-               ninja_list):
+               ninja_list, tracking_path_updates=None):
     self.config_name = config_name
     self.entry_point = entry_point
     self.files = files
     self.listing_queries = listing_queries
     self.generated_ninjas = ninja_list
+    self.tracking_path_updates = tracking_path_updates
 
   def merge(self, other):
     assert self.config_name == other.config_name
@@ -62,6 +72,51 @@ class FileEntry(object):
     self.mtime = mtime
 
 
+def _serialize_files(files):
+  """Serializes a dict from a path to FileEntry compactly.
+
+  The directories are stored only once, and the paths are stored as the pairs
+  of the index of the directory and the base name. All of them are packed into
+  a few strings, which marshal can load quickly.
+  """
+  dir_index_map = {}
+  dirs = []
+  dir_indices = array.array('i')
+  names = []
+  mtimes = array.array('d')
+  for path, entry in files.iteritems():
+    dir_path, name = os.path.split(path)
+    if dir_path and dir_path + os.sep + name == path:
+      dir_index = dir_index_map.get(dir_path)
+      if dir_index is None:
+        dir_index = dir_index_map[dir_path] = len(dirs)
+        dirs.append(dir_path)
+    else:
+      # The path is not normalized, or has no directory part.
+      dir_index, name = -1, path
+    dir_indices.append(dir_index)
+    names.append(name)
+    mtimes.append(entry.mtime)
+  return ('\0'.join(dirs), dir_indices.tostring(), '\0'.join(names),
+          mtimes.tostring())
+
+
+def _deserialize_files(data):
+  """Deserializes the data made by _serialize_files."""
+  dirs, dir_indices, names, mtimes = data
+  dirs = dirs.split('\0')
+  dir_index_array = array.array('i')
+  dir_index_array.fromstring(dir_indices)
+  mtime_array = array.array('d')
+  mtime_array.fromstring(mtimes)
+  files = {}
+  for dir_index, name, mtime in itertools.izip(
+      dir_index_array, names.split('\0'), mtime_array):
+    path = name if dir_index < 0 else dirs[dir_index] + os.sep + name
+    files[path] = FileEntry(mtime)
+  return files
+
+
 class CacheDependency(object):
   """Represents the dependency part of Config Cache. The instance holds
   informations to decide a cache is fresh.
@@ -112,8 +167,7 @@ class CacheDependency(object):
   def to_dict(self):
     return {
         'version': _CONFIG_CACHE_VERSION,
-        'files': [(path, entry.mtime)
-                  for path, entry in self.files.iteritems()],
+        'files': _serialize_files(self.files),
         'listings': [listing.to_dict() for listing in self.listings]}
 
   def save_to_file(self, cache_path):
@@ -121,27 +175,34 @@ class CacheDependency(object):
 
 
 class ConfigCache(object):
-  """Represents an on-disk cache entry to persist the cache."""
+  """Represents an on-disk cache entry to persist the cache.
+
+  |input_key| identifies the arguments passed to the generator, such as the
+  list of production shared libraries. The cache is used only when the
+  generator is invoked with the same arguments.
+  """
 
-  def __init__(self, config_name, entry_point,
+  def __init__(self, config_name, entry_point, input_key,
                files, listings, serialized_generated_ninjas):
     self.config_name = config_name
     self.entry_point = entry_point
+    self.input_key = input_key
     self.deps = CacheDependency(files, listings)
     self.serialized_generated_ninjas = serialized_generated_ninjas
 
-  def refresh_with_config_result(self, config_result):
+  def refresh_with_config_result(self, config_result, input_key):
     assert self.config_name == config_result.config_name
     assert self.entry_point == config_result.entry_point
+    self.input_key = input_key
     self.deps.refresh(config_result.get_file_dependency(),
                       config_result.listing_queries)
     self.serialized_generated_ninjas = cPickle.dumps(
         config_result.generated_ninjas)
 
-  def check_cache_freshness(self):
+  def check_cache_freshness(self, input_key):
     """Returns True if the cache is fresh."""
 
-    return self.deps.check_freshness()
+    return self.input_key == input_key and self.deps.check_freshness()
 
   def to_config_result(self):
     try:
@@ -160,8 +221,8 @@ class ConfigCache(object):
         'version': _CONFIG_CACHE_VERSION,
         'config_name': self.config_name,
         'entry_point': self.entry_point,
-        'files': [(path, entry.mtime)
-                  for path, entry in self.deps.files.iteritems()],
+        'input_key': self.input_key,
+        'files': _serialize_files(self.deps.files),
         'listings': [listing.to_dict() for listing in self.deps.listings],
         'generated_ninjas': self.serialized_generated_ninjas,
     }
@@ -194,7 +255,7 @@ def _load_global_deps_from_file(cache_path):
   if data is None or data['version'] != _CONFIG_CACHE_VERSION:
     return None
 
-  files = {path: FileEntry(mtime) for path, mtime in data['files']}
+  files = _deserialize_files(data['files'])
   listings = set()
   for dict in data['listings']:
     listing = file_list_cache.file_list_cache_from_dict(dict)
@@ -211,7 +272,8 @@ def _load_config_cache_from_file(path):
 
   config_name = data['config_name']
   entry_point = data['entry_point']
-  files = {path: FileEntry(mtime) for path, mtime in data['files']}
+  input_key = data['input_key']
+  files = _deserialize_files(data['files'])
   listings = set()
   for dict in data['listings']:
     listing = file_list_cache.file_list_cache_from_dict(dict)
@@ -220,11 +282,11 @@ def _load_config_cache_from_file(path):
     listings.add(listing)
 
   serialized_generated_ninjas = data['generated_ninjas']
-  return ConfigCache(config_name, entry_point, files, listings,
+  return ConfigCache(config_name, entry_point, input_key, files, listings,
                      serialized_generated_ninjas)
 
 
-def _config_cache_from_config_result(config_result):
+def _config_cache_from_config_result(config_result, input_key):
   files = {}
   for path in config_result.get_file_dependency():
     try:
@@ -242,7 +304,7 @@ def _config_cache_from_config_result(config_result):
   return ConfigCache(
       config_result.config_name,
       config_result.entry_point,
-      files, listings,
+      input_key, files, listings,
       cPickle.dumps(config_result.generated_ninjas))
 
 
@@ -258,6 +320,7 @@ class ConfigContext:
     self.entry_point = entry_point
     self.files = {config_file}
     self.listing_queries = set()
+    self.tracking_path_updates = None
 
   def set_up(self):
     dependency_inspection.start_inspection()
@@ -265,18 +328,31 @@ class ConfigContext:
   def tear_down(self):
     self.files.update(dependency_inspection.get_files())
     self.listing_queries.update(dependency_inspection.get_listings())
+    # The task may run in a worker process, so send the entries it added to
+    # the tracking path cache back to the main process.
+    self.tracking_path_updates = tracking_path_cache.get_cache().take_updates()
 
     dependency_inspection.stop_inspection()
 
   def make_result(self, ninja_list):
     return ConfigResult(self.config_name, self.entry_point,
-                        self.files, self.listing_queries, ninja_list)
+                        self.files, self.listing_queries, ninja_list,
+                        self.tracking_path_updates)
+
+
+def _get_tracking_path_cache_file_path():
+  return os.path.join(build_common.get_config_cache_dir(), 'tracking_paths')
 
 
 def _get_global_deps_file_path():
   return os.path.join(build_common.get_config_cache_dir(), 'global_deps')
 
 
+def _get_task_duration_file_path(phase_name):
+  return os.path.join(build_common.get_config_cache_dir(), 'task_durations',
+                      phase_name)
+
+
 def _get_cache_file_path(config_name, entry_point):
   return os.path.join(build_common.get_config_cache_dir(),
                       config_name, entry_point)
@@ -335,6 +411,17 @@ def _list_ninja_generators(config_loader, name):
            getattr(module, name))
 
 
+def _set_up_file_list_watcher():
+  """Skips checking the directories file_list_watcher knows are unchanged.
+
+  This does nothing unless file_list_watcher.py is running. This must be
+  called before any listing is checked, and before the workers are forked.
+  """
+  state = file_list_watcher.query()
+  if state is not None:
+    file_list_cache.set_watcher_state(*state)
+
+
 def _set_up_generate_ninja():
   # Create generated_ninja directory if necessary.
   ninja_dir = build_common.get_generated_ninja_dir()
@@ -347,6 +434,11 @@ def _set_up_generate_ninja():
   ninja_generator.JavaNinjaGenerator.add_default_resource_include(
       os.path.join(framework_resources_base_path, 'framework-res.apk'))
 
+  if OPTIONS.enable_config_cache():
+    _set_up_file_list_watcher()
+    # Load the cache before the workers are forked, so that they share it.
+    tracking_path_cache.load_from_file(_get_tracking_path_cache_file_path())
+
   # Set up global filter for makefile to ninja translator.
   make_to_ninja.MakefileNinjaTranslator.add_global_filter(
       _filter_all_make_to_ninja)
@@ -379,7 +471,98 @@ def _set_up_generate_ninja():
   return needs_clobbering, cache_to_save
 
 
-def _generate_independent_ninjas(needs_clobbering):
+def _get_input_key(args):
+  """Returns a string to identify the arguments passed to generators."""
+  return hashlib.sha1(repr(args)).hexdigest() if args else None
+
+
+class _GeneratorPhase(object):
+  """Runs a set of generators in config.py on the worker pool.
+
+  Each generator is called with |args|. If a generator was called with the
+  same arguments in the previous run and none of the files and listings it
+  depended on is changed, the generator is not run, and the cached result is
+  used instead.
+  """
+
+  def __init__(self, phase_name, generator_list, args, needs_clobbering):
+    self._phase_name = phase_name
+    self._generator_list = generator_list
+    self._args = args
+    self._input_key = _get_input_key(args)
+    self._needs_clobbering = needs_clobbering
+    self._batch = None
+    self._cached_result_list = []
+    self._cache_miss = {}
+    self._aggregated_result = {}
+
+  def start(self, runner):
+    """Starts running the generators whose cache is stale."""
+    task_list = []
+    for config_context, generator in self._generator_list:
+      cache_path = _get_cache_file_path(config_context.config_name,
+                                        config_context.entry_point)
+      config_cache = None
+      if OPTIONS.enable_config_cache() and not self._needs_clobbering:
+        config_cache = _load_config_cache_from_file(cache_path)
+
+      if (config_cache is not None and
+          config_cache.check_cache_freshness(self._input_key)):
+        cached_result = config_cache.to_config_result()
+        # The cache holds only the summaries of the generated ninjas, so the
+        # ninja files emitted in the previous run need to exist.
+        if cached_result is not None and all(
+            os.path.exists(ninja.get_ninja_path())
+            for ninja in cached_result.generated_ninjas):
+          self._cached_result_list.append(cached_result)
+          continue
+
+      task_list.append(ninja_generator_runner.GeneratorTask(
+          config_context, (generator,) + self._args))
+      self._cache_miss[cache_path] = config_cache
+
+    # The ninja files are emitted by the workers as soon as each task finishes.
+    self._batch = runner.start(
+        task_list, _get_task_duration_file_path(self._phase_name))
+
+  def wait(self):
+    """Waits for the generators, and returns the generated ninjas."""
+    ninja_list = []
+    for config_result in self._batch.wait():
+      cache_path = _get_cache_file_path(config_result.config_name,
+                                        config_result.entry_point)
+      ninja_list.extend(config_result.generated_ninjas)
+      tracking_path_cache.get_cache().merge_updates(
+          config_result.tracking_path_updates)
+      if cache_path in self._aggregated_result:
+        self._aggregated_result[cache_path].merge(config_result)
+      else:
+        self._aggregated_result[cache_path] = config_result
+
+    for cached_result in self._cached_result_list:
+      ninja_list.extend(cached_result.generated_ninjas)
+
+    ninja_list.sort(key=lambda ninja: ninja.get_module_name())
+    return ninja_list
+
+  def get_cache_to_save(self):
+    """Returns a list of ConfigCache to save for the generators run."""
+    cache_to_save = []
+    if OPTIONS.enable_config_cache():
+      for cache_path, config_result in self._aggregated_result.iteritems():
+        config_cache = self._cache_miss[cache_path]
+        if config_cache is None:
+          config_cache = _config_cache_from_config_result(
+              config_result, self._input_key)
+        else:
+          config_cache.refresh_with_config_result(
+              config_result, self._input_key)
+
+        cache_to_save.append((config_cache, cache_path))
+    return cache_to_save
+
+
+def _generate_independent_ninjas(runner, needs_clobbering):
   timer = build_common.SimpleTimer()
 
   # Invoke an unordered set of ninja-generators distributed across config
@@ -392,61 +575,20 @@ def _generate_independent_ninjas(needs_clobbering):
     generator_list.extend(_list_ninja_generators(
         _config_loader, 'generate_test_ninjas'))
 
-  task_list = []
-  cached_result_list = []
-  cache_miss = {}
-
-  for config_context, generator in generator_list:
-    cache_path = _get_cache_file_path(config_context.config_name,
-                                      config_context.entry_point)
-    config_cache = None
-    if OPTIONS.enable_config_cache() and not needs_clobbering:
-      config_cache = _load_config_cache_from_file(cache_path)
-
-    if config_cache is not None and config_cache.check_cache_freshness():
-      cached_result = config_cache.to_config_result()
-      if cached_result is not None:
-        cached_result_list.append(cached_result)
-        continue
-
-    task_list.append(ninja_generator_runner.GeneratorTask(
-        config_context, generator))
-    cache_miss[cache_path] = config_cache
-
-  result_list = ninja_generator_runner.run_in_parallel(
-      task_list, OPTIONS.configure_jobs())
-
-  aggregated_result = {}
-  ninja_list = []
-  for config_result in result_list:
-    cache_path = _get_cache_file_path(config_result.config_name,
-                                      config_result.entry_point)
-    ninja_list.extend(config_result.generated_ninjas)
-    if cache_path in aggregated_result:
-      aggregated_result[cache_path].merge(config_result)
-    else:
-      aggregated_result[cache_path] = config_result
-
-  for cached_result in cached_result_list:
-    ninja_list.extend(cached_result.generated_ninjas)
-
-  cache_to_save = []
-  if OPTIONS.enable_config_cache():
-    for cache_path, config_result in aggregated_result.iteritems():
-      config_cache = cache_miss[cache_path]
-      if config_cache is None:
-        config_cache = _config_cache_from_config_result(config_result)
-      else:
-        config_cache.refresh_with_config_result(config_result)
-
-      cache_to_save.append((config_cache, cache_path))
-
-  ninja_list.sort(key=lambda ninja: ninja.get_module_name())
+  phase = _GeneratorPhase('independent', generator_list, (), needs_clobbering)
+  phase.start(runner)
+  ninja_list = phase.wait()
   timer.done()
-  return ninja_list, cache_to_save
+  return ninja_list, phase
 
 
-def _generate_shared_lib_depending_ninjas(ninja_list):
+def _generate_shared_lib_depending_ninjas(runner, ninja_list, needs_clobbering,
+                                          previous_phase, cache_to_save):
+  """Generates the ninjas depending on the production shared libraries.
+
+  Returns the generated ninjas and the phase. The cache of |previous_phase| is
+  added to |cache_to_save| while the workers are running the tasks.
+  """
   timer = build_common.SimpleTimer()
 
   timer.start('Generating plugin and packaging ninjas', OPTIONS.verbose())
@@ -463,23 +605,54 @@ def _generate_shared_lib_depending_ninjas(ninja_list):
     generator_list.extend(_list_ninja_generators(
         _config_loader, 'generate_shared_lib_depending_test_ninjas'))
 
-  result_list = ninja_generator_runner.run_in_parallel(
-      [ninja_generator_runner.GeneratorTask(
-          config_context,
-          (generator, production_shared_libs))
-       for config_context, generator in generator_list],
-      OPTIONS.configure_jobs())
-  ninja_list = []
-  for config_result in result_list:
-    ninja_list.extend(config_result.generated_ninjas)
-  ninja_list.sort(key=lambda ninja: ninja.get_module_name())
+  phase = _GeneratorPhase('shared_lib_depending', generator_list,
+                          (production_shared_libs,), needs_clobbering)
+  phase.start(runner)
+  cache_to_save.extend(previous_phase.get_cache_to_save())
+  ninja_list = phase.wait()
 
   timer.done()
-  return ninja_list
+  return ninja_list, phase
+
 
+def _generate_list_ninja(ninja_name, build_function, ninja_list, input_list,
+                         needs_clobbering):
+  """Generates a ninja which is built in the main process from |ninja_list|.
 
-def _generate_dependent_ninjas(ninja_list):
-  """Generate the stage of ninjas coming after all executables."""
+  The summary of the generated ninja is cached with |input_list|, which must
+  be everything the ninja is generated from. Returns the ninja, and the cache
+  to save, or None if the cache is used.
+  """
+  cache_path = _get_cache_file_path('config_runner', ninja_name)
+  input_key = _get_input_key((input_list,))
+  if OPTIONS.enable_config_cache() and not needs_clobbering:
+    config_cache = _load_config_cache_from_file(cache_path)
+    if (config_cache is not None and
+        config_cache.check_cache_freshness(input_key)):
+      cached_result = config_cache.to_config_result()
+      if cached_result is not None and all(
+          os.path.exists(ninja.get_ninja_path())
+          for ninja in cached_result.generated_ninjas):
+        return cached_result.generated_ninjas[0], None
+
+  ninja = ninja_generator.NinjaGenerator(ninja_name)
+  build_function(ninja, ninja_list)
+  if not OPTIONS.enable_config_cache():
+    return ninja, None
+  # The ninja is emitted in generate_ninjas(), so save its summary.
+  config_result = ConfigResult('config_runner', ninja_name, set(), set(),
+                               [ninja.get_summary()])
+  return ninja, (_config_cache_from_config_result(config_result, input_key),
+                 cache_path)
+
+
+def _generate_dependent_ninjas(runner, ninja_list, needs_clobbering,
+                               previous_phase, cache_to_save):
+  """Generate the stage of ninjas coming after all executables.
+
+  The caches of |previous_phase| and of this phase are added to
+  |cache_to_save|.
+  """
   timer = build_common.SimpleTimer()
 
   timer.start('Generating dependent ninjas', OPTIONS.verbose())
@@ -491,27 +664,36 @@ def _generate_dependent_ninjas(ninja_list):
 
   generator_list = _list_ninja_generators(_config_loader,
                                           'generate_binaries_depending_ninjas')
-  result_list = ninja_generator_runner.run_in_parallel(
-      [ninja_generator_runner.GeneratorTask(
-          config_context,
-          (generator, root_dir_install_all_targets))
-          for config_context, generator in generator_list],
-      OPTIONS.configure_jobs())
-  dependent_ninjas = []
-  for config_result in result_list:
-    dependent_ninjas.extend(config_result.generated_ninjas)
-
+  phase = _GeneratorPhase('dependent', generator_list,
+                          (root_dir_install_all_targets,), needs_clobbering)
+  phase.start(runner)
+
+  # These do not depend on the results of the tasks above, so build them in
+  # the main process while the workers are running the tasks.
+  cache_to_save.extend(previous_phase.get_cache_to_save())
+  list_ninjas = []
+  for ninja_name, build_function, input_list in (
+      ('all_test_lists',
+       ninja_generator.NinjaGenerator.build_all_test_lists,
+       sorted(path for n in ninja_list for path in n._test_lists)),
+      ('all_unittest_info',
+       ninja_generator.NinjaGenerator.build_all_unittest_info,
+       [path for n in ninja_list for path in n._test_info_list])):
+    ninja, cache = _generate_list_ninja(
+        ninja_name, build_function, ninja_list, input_list, needs_clobbering)
+    list_ninjas.append(ninja)
+    if cache:
+      cache_to_save.append(cache)
+
+  dependent_ninjas = phase.wait()
+  cache_to_save.extend(phase.get_cache_to_save())
+
+  # The notices ninja is not cached, as the open sourcing verification in it
+  # depends on the OPEN_SOURCE files, which are not tracked as dependencies.
   notice_ninja = ninja_generator.NoticeNinjaGenerator('notices')
   notice_ninja.build_notices(ninja_list + dependent_ninjas)
   dependent_ninjas.append(notice_ninja)
-
-  all_test_lists_ninja = ninja_generator.NinjaGenerator('all_test_lists')
-  all_test_lists_ninja.build_all_test_lists(ninja_list)
-  dependent_ninjas.append(all_test_lists_ninja)
-
-  all_unittest_info_ninja = ninja_generator.NinjaGenerator('all_unittest_info')
-  all_unittest_info_ninja.build_all_unittest_info(ninja_list)
-  dependent_ninjas.append(all_unittest_info_ninja)
+  dependent_ninjas.extend(list_ninjas)
 
   timer.done()
   return dependent_ninjas
@@ -538,12 +720,13 @@ def _verify_ninja_generator_list(ninja_list):
     key = (ninja.get_module_name(), ninja.is_host())
     module_name_count_dict[key] += 1
     output_path_name_count_dict[ninja.get_ninja_path()] += 1
-    if isinstance(ninja, ninja_generator.ArchiveNinjaGenerator):
+    generator_class = ninja.get_generator_class()
+    if issubclass(generator_class, ninja_generator.ArchiveNinjaGenerator):
       archive_ninja_list.append(ninja)
-    if isinstance(ninja, ninja_generator.SharedObjectNinjaGenerator):
+    if issubclass(generator_class, ninja_generator.SharedObjectNinjaGenerator):
       shared_ninja_list.append(ninja)
-    if isinstance(ninja, ninja_generator.ExecNinjaGenerator):
-      if isinstance(ninja, ninja_generator.TestNinjaGenerator):
+    if issubclass(generator_class, ninja_generator.ExecNinjaGenerator):
+      if issubclass(generator_class, ninja_generator.TestNinjaGenerator):
         test_ninja_list.append(ninja)
       else:
         exec_ninja_list.append(ninja)
@@ -578,14 +761,43 @@ def _verify_ninja_generator_list(ninja_list):
         archive_ninja_list, shared_ninja_list, exec_ninja_list, test_ninja_list)
 
 
+def _log_changed_ninjas(ninja_list, start_time):
+  """Logs how many ninja files are written since |start_time|.
+
+  The ninja files are not rewritten if their contents are unchanged, either by
+  the workers of ninja_generator_runner or here, so their mtimes tell which
+  ones are changed in this run.
+  """
+  changed_count = 0
+  for ninja in ninja_list:
+    try:
+      if os.stat(ninja.get_ninja_path()).st_mtime >= start_time:
+        changed_count += 1
+    except OSError:
+      pass
+  logging.info('Changed ninja files: %d of %d', changed_count, len(ninja_list))
+
+
 def generate_ninjas():
+  # Truncate to the second, as some file systems record mtime in seconds.
+  start_time = int(time.time())
   needs_clobbering, cache_to_save = _set_up_generate_ninja()
-  ninja_list, independent_ninja_cache = _generate_independent_ninjas(
-      needs_clobbering)
-  cache_to_save.extend(independent_ninja_cache)
-  ninja_list.extend(
-      _generate_shared_lib_depending_ninjas(ninja_list))
-  ninja_list.extend(_generate_dependent_ninjas(ninja_list))
+
+  # Use one pool of workers for all the phases, so that they are forked only
+  # once. The pool must be created after the config modules are loaded in
+  # _set_up_generate_ninja().
+  with ninja_generator_runner.GeneratorTaskRunner(
+      OPTIONS.configure_jobs()) as runner:
+    ninja_list, independent_phase = _generate_independent_ninjas(
+        runner, needs_clobbering)
+    shared_lib_depending_ninjas, shared_lib_depending_phase = (
+        _generate_shared_lib_depending_ninjas(
+            runner, ninja_list, needs_clobbering, independent_phase,
+            cache_to_save))
+    ninja_list.extend(shared_lib_depending_ninjas)
+    ninja_list.extend(_generate_dependent_ninjas(
+        runner, ninja_list, needs_clobbering, shared_lib_depending_phase,
+        cache_to_save))
 
   top_level_ninja = _generate_top_level_ninja(ninja_list)
   ninja_list.append(top_level_ninja)
@@ -593,15 +805,25 @@ def generate_ninjas():
   # Run verification before emitting to files.
   _verify_ninja_generator_list(ninja_list)
 
-  # Emit each ninja script to a file.
+  # Emit each ninja script to a file. The ninja scripts generated in
+  # ninja_generator_runner are already emitted, and only their summaries are
+  # in |ninja_list|.
   timer = build_common.SimpleTimer()
   timer.start('Emitting ninja scripts', OPTIONS.verbose())
   for ninja in ninja_list:
-    ninja.emit()
+    if isinstance(ninja, ninja_generator.NinjaGenerator):
+      ninja.emit()
   top_level_ninja.emit_depfile()
   top_level_ninja.cleanup_out_directories(ninja_list)
   timer.done()
+  _log_changed_ninjas(ninja_list, start_time)
+
+  cache = tracking_path_cache.get_cache()
+  if OPTIONS.verbose():
+    print 'Tracking path cache: %d hits, %d misses' % (
+        cache.hit_count, cache.miss_count)
 
   if OPTIONS.enable_config_cache():
+    cache_to_save.append((cache, _get_tracking_path_cache_file_path()))
     for cache_object, cache_path in cache_to_save:
       cache_object.save_to_file(cache_path)
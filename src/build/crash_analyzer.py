@@ -14,24 +14,144 @@ Note that this is also integrated in launch_chrome.py.
 """
 
 import argparse
+import atexit
 import os
 import re
 import subprocess
 import sys
+import threading
 
 from src.build import build_common
 from src.build import toolchain
 from src.build.build_options import OPTIONS
 
 
-class CrashAnalyzer(object):
-  def __init__(self, is_annotating=False):
-    self._text_segments = []
-    self._crash_addr = None
+class Symbolizer(object):
+  """Resolves addresses in the binaries, reusing the tools across crashes.
+
+  An addr2line process is kept running for each binary, and the results of
+  addr2line and objdump are cached, so analyzing many crashes in a process
+  does not launch the tools for every address. This is thread-safe.
+  """
+
+  def __init__(self, addr2line=None, objdump=None):
+    # The tools are looked up lazily, as OPTIONS may not be parsed yet.
+    self._addr2line = addr2line
+    self._objdump = objdump
+    self._lock = threading.Lock()
     # A map from basename to path of binaries. Loaded lazily when
     # crash is found.
     self._binary_map = None
+    self._addr2line_process_map = {}
+    self._addr2line_cache = {}
+    self._objdump_cache = {}
+
+  def get_binary_path(self, binary_name):
+    """Returns the path of the binary with |binary_name|, or None."""
+    with self._lock:
+      if self._binary_map is None:
+        self._binary_map = self._build_binary_map()
+      return self._binary_map.get(binary_name)
+
+  @staticmethod
+  def _build_binary_map():
+    binary_map = {}
+    for dirpath, dirnames, filenames in (
+        os.walk(build_common.get_load_library_path())):
+      for filename in filenames:
+        if re.match(r'arc_[^/]*\.nexe$', filename):
+          name = '/lib/main.nexe'
+          print 'Used %s as main.nexe' % filename
+        else:
+          name = os.path.basename(filename)
+        if name in binary_map:
+          raise Exception('Duplicated binary: ' + name)
+        binary_map[name] = os.path.join(dirpath, filename)
+    return binary_map
+
+  def addr2line(self, binary_filename, addr_list):
+    """Returns a list of the addr2line results for each in |addr_list|.
+
+    The addresses not in the cache are sent to addr2line at once.
+    """
+    with self._lock:
+      new_addr_list = sorted(set(
+          addr for addr in addr_list
+          if (binary_filename, addr) not in self._addr2line_cache))
+      if new_addr_list:
+        for addr, result in zip(new_addr_list, self._run_addr2line_locked(
+            binary_filename, new_addr_list)):
+          self._addr2line_cache[(binary_filename, addr)] = result
+      return [self._addr2line_cache[(binary_filename, addr)]
+              for addr in addr_list]
+
+  def _run_addr2line_locked(self, binary_filename, addr_list):
+    process = self._addr2line_process_map.get(binary_filename)
+    if process is None:
+      if self._addr2line is None:
+        self._addr2line = toolchain.get_tool(OPTIONS.target(), 'addr2line')
+      with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen([self._addr2line, '-e', binary_filename],
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=devnull)
+      self._addr2line_process_map[binary_filename] = process
+
+    # addr2line outputs a line for each address, and flushes it.
+    try:
+      process.stdin.write(''.join('%x\n' % addr for addr in addr_list))
+      process.stdin.flush()
+      result = [process.stdout.readline() for _ in addr_list]
+    except IOError:
+      # addr2line has exited.
+      result = []
+    result += [''] * (len(addr_list) - len(result))
+    return [line or '(addr2line failed)\n' for line in result]
+
+  def objdump(self, binary_filename, start_addr, end_addr):
+    """Returns the disassembly with the source between the addresses."""
+    key = (binary_filename, start_addr, end_addr)
+    with self._lock:
+      if key in self._objdump_cache:
+        return self._objdump_cache[key]
+      if self._objdump is None:
+        self._objdump = toolchain.get_tool(OPTIONS.target(), 'objdump')
+    pipe = subprocess.Popen([self._objdump, '-SC', binary_filename,
+                             '--start-address', '0x%x' % start_addr,
+                             '--stop-address', '0x%x' % end_addr],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    result = pipe.communicate()[0]
+    with self._lock:
+      self._objdump_cache[key] = result
+    return result
+
+  def close(self):
+    with self._lock:
+      for process in self._addr2line_process_map.itervalues():
+        process.stdin.close()
+        process.wait()
+      self._addr2line_process_map.clear()
+
+
+_symbolizer = None
+_symbolizer_lock = threading.Lock()
+
+
+def get_symbolizer():
+  """Returns the Symbolizer shared in this process."""
+  global _symbolizer
+  with _symbolizer_lock:
+    if _symbolizer is None:
+      _symbolizer = Symbolizer()
+      atexit.register(_symbolizer.close)
+    return _symbolizer
+
+
+class CrashAnalyzer(object):
+  def __init__(self, is_annotating=False, symbolizer=None):
+    self._text_segments = []
+    self._crash_addr = None
     self._is_annotating = is_annotating
+    self._symbolizer = symbolizer or get_symbolizer()
 
   def handle_line(self, line):
     if self._is_annotating:
@@ -61,23 +181,6 @@ class CrashAnalyzer(object):
 
     return False
 
-  def init_binary_map(self):
-    if self._binary_map:
-      return
-
-    self._binary_map = {}
-    for dirpath, dirnames, filenames in (
-        os.walk(build_common.get_load_library_path())):
-      for filename in filenames:
-        if re.match(r'arc_[^/]*\.nexe$', filename):
-          name = '/lib/main.nexe'
-          print 'Used %s as main.nexe' % filename
-        else:
-          name = os.path.basename(filename)
-        if name in self._binary_map:
-          raise Exception('Duplicated binary: ' + name)
-        self._binary_map[name] = os.path.join(dirpath, filename)
-
   def get_crash_report(self):
     assert self._crash_addr is not None
     for binary_name, start_addr, end_addr in self._text_segments:
@@ -92,39 +195,22 @@ class CrashAnalyzer(object):
       if os.path.exists(binary_name):
         binary_filename = binary_name
       else:
-        self.init_binary_map()
-        if binary_name not in self._binary_map:
+        binary_filename = self._symbolizer.get_binary_path(binary_name)
+        if binary_filename is None:
           return '%s %x (binary file not found)\n' % (binary_name, addr)
-        binary_filename = self._binary_map[binary_name]
-
-      pipe = subprocess.Popen([toolchain.get_tool(OPTIONS.target(),
-                                                  'addr2line'),
-                               '-e', binary_filename],
-                              stdin=subprocess.PIPE,
-                              stdout=subprocess.PIPE,
-                              stderr=subprocess.STDOUT)
-      addr2line_result = pipe.communicate('%x\n' % addr)[0]
-
-      # We can always get clean result using 32 byte aligned start
-      # address as NaCl binary does never overlap 32 byte boundary.
-      objdump_start_addr = (addr & ~31) - 32
-      objdump_end_addr = addr + 64
-      pipe = subprocess.Popen([toolchain.get_tool(OPTIONS.target(),
-                                                  'objdump'),
-                               '-SC', binary_filename,
-                               '--start-address', '0x%x' % objdump_start_addr,
-                               '--stop-address', '0x%x' % objdump_end_addr],
-                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-      objdump_result = pipe.communicate('%x\n' % addr)[0]
 
+      addr2line_result = self._symbolizer.addr2line(binary_filename, [addr])[0]
       if self._is_annotating:
         report = ('[[ %s 0x%x %s ]]' %
                   (binary_filename, addr, addr2line_result.strip()))
         # The result of objdump is too verbose for annotation.
       else:
+        # We can always get clean result using 32 byte aligned start
+        # address as NaCl binary does never overlap 32 byte boundary.
         report = '%s 0x%x\n' % (binary_filename, addr)
         report += addr2line_result
-        report += objdump_result
+        report += self._symbolizer.objdump(
+            binary_filename, (addr & ~31) - 32, addr + 64)
 
       return report
     return 'Failed to retrieve a crash report\n'
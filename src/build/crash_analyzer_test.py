@@ -0,0 +1,66 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unittests for crash_analyzer.py."""
+
+import os
+import stat
+import tempfile
+import unittest
+
+from src.build import crash_analyzer
+from src.build.util import file_util
+
+# A fake addr2line which outputs a line for each address, and records the
+# number of the processes launched.
+_FAKE_ADDR2LINE = '''#!/bin/sh
+echo started >> %(log)s
+while read addr; do
+  echo "$2:$addr"
+done
+'''
+
+
+class SymbolizerTest(unittest.TestCase):
+  def setUp(self):
+    self._tmpdir = tempfile.mkdtemp()
+    self._log = os.path.join(self._tmpdir, 'log')
+    addr2line = os.path.join(self._tmpdir, 'addr2line')
+    with open(addr2line, 'w') as f:
+      f.write(_FAKE_ADDR2LINE % {'log': self._log})
+    os.chmod(addr2line, stat.S_IRWXU)
+    self._symbolizer = crash_analyzer.Symbolizer(addr2line=addr2line,
+                                                 objdump='true')
+
+  def tearDown(self):
+    self._symbolizer.close()
+    file_util.rmtree(self._tmpdir)
+
+  def _get_num_launched(self):
+    with open(self._log) as f:
+      return len(f.readlines())
+
+  def testAddr2line(self):
+    self.assertEquals(['a.so:10\n', 'a.so:2f\n'],
+                      self._symbolizer.addr2line('a.so', [0x10, 0x2f]))
+    self.assertEquals(['a.so:2f\n', 'a.so:30\n'],
+                      self._symbolizer.addr2line('a.so', [0x2f, 0x30]))
+    self.assertEquals(['b.so:10\n'], self._symbolizer.addr2line('b.so', [0x10]))
+    # A process is kept running for each binary.
+    self.assertEquals(2, self._get_num_launched())
+
+  def testCrashReport(self):
+    analyzer = crash_analyzer.CrashAnalyzer(symbolizer=self._symbolizer)
+    binary = os.path.join(self._tmpdir, 'libfoo.so')
+    open(binary, 'w').close()
+    self.assertFalse(analyzer.handle_line(
+        'linker: Loaded text: 0x1000-0x2000 %s\n' % binary))
+    self.assertTrue(analyzer.handle_line(
+        '** Signal 11 from untrusted code: pc=1234\n'))
+    self.assertEquals('%s 0x234\n%s:234\n' % (binary, binary),
+                      analyzer.get_crash_report())
+
+
+if __name__ == '__main__':
+  unittest.main()
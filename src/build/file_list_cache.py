@@ -2,8 +2,11 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import array
+import binascii
 import errno
 import hashlib
+import itertools
 import logging
 import marshal
 import os
@@ -11,18 +14,59 @@ import pickle
 import stat
 
 
-_CACHE_FILE_VERSION = 0
+_CACHE_FILE_VERSION = 2
+
+# The changes reported by file_list_watcher. See set_watcher_state().
+_watcher_instance = None
+_watcher_seq = None
+_watched_roots = None
+_changed_dirs = None
+
+
+def set_watcher_state(instance, seq, roots, changed_dirs):
+  """Sets the changes reported by file_list_watcher.query().
+
+  A cached directory under |roots| is considered fresh without checking its
+  mtime, if it is not changed since the listing was refreshed last time.
+  |changed_dirs| is a dict from an absolute path of a changed directory to the
+  sequence number it was changed at. Pass None to |instance| to check all the
+  directories.
+  """
+  global _watcher_instance, _watcher_seq, _watched_roots, _changed_dirs
+  _watcher_instance = instance
+  _watcher_seq = seq
+  _watched_roots = tuple(os.path.join(root, '') for root in roots or [])
+  _changed_dirs = changed_dirs
+
+
+def _get_watcher_token():
+  if _watcher_instance is None:
+    return None
+  return (_watcher_instance, _watcher_seq)
+
+
+def _is_known_unchanged(path, watcher_token):
+  if (_watcher_instance is None or watcher_token is None or
+      watcher_token[0] != _watcher_instance):
+    return False
+  path = os.path.abspath(path)
+  return (os.path.join(path, '').startswith(_watched_roots) and
+          _changed_dirs.get(path, -1) <= watcher_token[1])
 
 
 # Splits given |cache_entries| into |cache_hit|, |cache_miss| and removed
 # entries, and returns |cache_hit| and |cache_miss|.
 # |cache_entries|, |cache_hit| and |cache_miss| are dictionaries from a file
-# path to a CacheEntry.
-def _check_cache_freshness(cache_entries):
+# path to a CacheEntry. |watcher_token| is the state of file_list_watcher when
+# the entries were checked last time.
+def _check_cache_freshness(cache_entries, watcher_token):
   cache_hit = {}
   cache_miss = {}
 
   for path, cached in cache_entries.iteritems():
+    if _is_known_unchanged(path, watcher_token):
+      cache_hit[path] = cached
+      continue
     try:
       st = os.stat(path)
       if not stat.S_ISDIR(st.st_mode):
@@ -53,29 +97,94 @@ class Query:
     self.root = root
     self.include_subdirectories = include_subdirectories
 
+  def __setattr__(self, name, value):
+    self.__dict__[name] = value
+    # Invalidate the key computed by _get_key().
+    self.__dict__.pop('_key', None)
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state.pop('_key', None)
+    return state
+
+  def _get_key(self):
+    # Queries are compared many times, e.g. as members of a set, so pickle
+    # each query only once.
+    key = self.__dict__.get('_key')
+    if key is None:
+      key = pickle.dumps(self)
+      self.__dict__['_key'] = key
+    return key
+
   def __eq__(self, other):
-    return pickle.dumps(self) == pickle.dumps(other)
+    return self._get_key() == other._get_key()
 
   def __hash__(self):
-    return pickle.dumps(self).__hash__()
+    return self._get_key().__hash__()
 
 
 # Represents a result of a file listing in a specific directory.
-class CacheEntry:
+# |contents| can be given as a tuple of the directory path and the
+# NUL-separated base names of the files in it, to build the paths lazily, as
+# they are not used to check the freshness.
+class CacheEntry(object):
   def __init__(self, mtime, content_hash, contents):
     self.mtime = mtime
     self.content_hash = content_hash
-    self.contents = contents
-
-
-class FileListCache:
-  def __init__(self, query, entries=None):
+    self._contents = contents
+
+  @property
+  def contents(self):
+    if isinstance(self._contents, tuple):
+      dir_path, names = self._contents
+      # The root of a query may end with a separator, which is kept in the
+      # paths of the files.
+      prefix = os.path.join(dir_path, '')
+      self._contents = (
+          [prefix + name for name in names.split('\0')] if names else [])
+    return self._contents
+
+  @contents.setter
+  def contents(self, contents):
+    self._contents = contents
+
+
+class FileListCache(object):
+  def __init__(self, query, entries=None, watcher_token=None,
+               serialized_entries=None):
     self.query = query
-    self.cache_entries = {} if entries is None else entries
+    self._cache_entries = {} if entries is None else entries
+    self._serialized_entries = serialized_entries
+    self.watcher_token = watcher_token
+
+  @property
+  def cache_entries(self):
+    if self._serialized_entries is not None:
+      # Decode the entries loaded by file_list_cache_from_dict() lazily.
+      dirs, mtimes, content_hashes, contents = self._serialized_entries
+      mtime_array = array.array('d')
+      mtime_array.fromstring(mtimes)
+      hash_size = hashlib.sha1().digest_size
+      for i, (path, mtime, names) in enumerate(
+          itertools.izip(dirs.split('\0'), mtime_array, contents)):
+        content_hash = content_hashes[i * hash_size:(i + 1) * hash_size]
+        self._cache_entries[path] = CacheEntry(
+            mtime, binascii.hexlify(content_hash), (path, names))
+      self._serialized_entries = None
+    return self._cache_entries
+
+  @cache_entries.setter
+  def cache_entries(self, cache_entries):
+    self._cache_entries = cache_entries
+    self._serialized_entries = None
 
   # Searches cached entries and refreshes them if needed.
   def refresh_cache(self):
-    cache_hit, cache_miss = _check_cache_freshness(self.cache_entries)
+    # The token is taken when file_list_watcher was queried before any check,
+    # so the changes made while checking are checked again next time.
+    watcher_token = _get_watcher_token()
+    cache_hit, cache_miss = _check_cache_freshness(self.cache_entries,
+                                                   self.watcher_token)
 
     for base_path in self.query.base_paths:
       if base_path not in cache_hit and base_path not in cache_miss:
@@ -129,22 +238,36 @@ class FileListCache:
 
       self.cache_entries = new_cache_entries
 
+    self.watcher_token = watcher_token
     return cache_is_fresh
 
   def enumerate_files(self):
-    for cached_dir_path in self.cache_entries:
-      for path in self.cache_entries[cached_dir_path].contents:
+    for cache in self.cache_entries.itervalues():
+      for path in cache.contents:
         yield path
 
-  def _enumerate_entries(self):
-    for path, cache in self.cache_entries.iteritems():
-      yield (path, cache.mtime, cache.content_hash, cache.contents)
-
   def to_dict(self):
+    # The entries are stored in a few strings rather than a list of tuples, so
+    # that marshal does not need to create an object for each of them. The
+    # paths of the files are stored as the base names, as each of them is
+    # under the directory of the entry.
+    dirs = []
+    mtimes = array.array('d')
+    content_hashes = []
+    contents = []
+    for path, cache in self.cache_entries.iteritems():
+      dirs.append(path)
+      mtimes.append(cache.mtime)
+      content_hashes.append(binascii.unhexlify(cache.content_hash))
+      prefix_length = len(os.path.join(path, ''))
+      contents.append('\0'.join(
+          content[prefix_length:] for content in cache.contents))
     return {
         'version': _CACHE_FILE_VERSION,
-        'query': pickle.dumps(self.query),
-        'cache_entries': list(self._enumerate_entries()),
+        'query': self.query._get_key(),
+        'cache_entries': ('\0'.join(dirs), mtimes.tostring(),
+                          ''.join(content_hashes), contents),
+        'watcher_token': self.watcher_token,
     }
 
   def save_to_file(self, file_path):
@@ -152,11 +275,6 @@ class FileListCache:
       marshal.dump(self.to_dict(), f)
 
 
-def _entries_from_list(list):
-  for (path, mtime, content_hash, contents) in list:
-    yield [path, CacheEntry(mtime, content_hash, contents)]
-
-
 def file_list_cache_from_dict(data):
   if data['version'] != _CACHE_FILE_VERSION:
     return None
@@ -166,8 +284,9 @@ def file_list_cache_from_dict(data):
   except StandardError:
     return None
 
-  entries = dict(_entries_from_list(data['cache_entries']))
-  return FileListCache(query, entries)
+  return FileListCache(
+      query, watcher_token=data['watcher_token'],
+      serialized_entries=data['cache_entries'])
 
 
 def load_from_file(file_path):
@@ -120,7 +120,49 @@ class FileListCacheUnittest(unittest.TestCase):
       os.remove(path)
 
     self.assertEquals(query, cache2.query)
+    self.assertEquals(sorted(cache.enumerate_files()),
+                      sorted(cache2.enumerate_files()))
+    self.assertEquals(sorted(cache.cache_entries),
+                      sorted(cache2.cache_entries))
     self.assertTrue(cache.refresh_cache())
+    self.assertTrue(cache2.refresh_cache())
+
+  def testSaveAndLoadWithTrailingSeparator(self):
+    _touch('foo/abc.cc')
+    query = file_list_cache.Query(['foo/'], re.compile('.*\.cc'), None, True)
+    cache = file_list_cache.FileListCache(query)
+    cache.refresh_cache()
+    expected = ['foo/abc.cc', 'foo/bar/baz/hoge.cc']
+    self.assertEquals(expected, sorted(cache.enumerate_files()))
+
+    cache2 = file_list_cache.file_list_cache_from_dict(cache.to_dict())
+    self.assertEquals(expected, sorted(cache2.enumerate_files()))
+
+  def testWatcherState(self):
+    query = file_list_cache.Query(['foo'], re.compile('.*\.cc'), None, True)
+    cache = file_list_cache.FileListCache(query)
+    root = os.getcwd()
+    try:
+      file_list_cache.set_watcher_state('instance', 1, [root], {})
+      self.assertFalse(cache.refresh_cache())
+      self.assertEquals(('instance', 1), cache.watcher_token)
+
+      # The directory is not checked unless the watcher reports the change.
+      _touch('foo/bar/baz/piyo.cc')
+      file_list_cache.set_watcher_state('instance', 2, [root], {})
+      self.assertTrue(cache.refresh_cache())
+
+      file_list_cache.set_watcher_state(
+          'instance', 3, [root], {os.path.join(root, 'foo/bar/baz'): 3})
+      self.assertFalse(cache.refresh_cache())
+
+      # The token of another watcher instance is not trusted.
+      _reset_timestamp()
+      _touch('foo/bar/baz/hogera.cc')
+      file_list_cache.set_watcher_state('instance2', 0, [root], {})
+      self.assertFalse(cache.refresh_cache())
+    finally:
+      file_list_cache.set_watcher_state(None, None, None, None)
 
 if __name__ == '__main__':
   unittest.main()
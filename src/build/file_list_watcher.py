@@ -0,0 +1,416 @@
+#!src/build/run_python
+
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Watches the source tree with inotify to speed up file listing checks.
+
+Checking the freshness of FileListCache needs os.stat() on every cached
+directory, which takes seconds on the whole tree. This script runs a daemon
+which watches out/staging, src and mods with Linux inotify, and remembers
+when each directory is changed. configure asks the daemon for the changes, and
+skips os.stat() for the directories not changed since their listings were
+last checked. See also file_list_cache.set_watcher_state().
+
+The daemon is optional. If it is not running, configure checks every directory
+as before.
+
+Usage:
+  src/build/file_list_watcher.py start
+  src/build/file_list_watcher.py status
+  src/build/file_list_watcher.py stop
+"""
+
+import argparse
+import collections
+import ctypes
+import ctypes.util
+import errno
+import logging
+import marshal
+import os
+import select
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+from src.build import build_common
+from src.build.util import file_util
+
+_VERSION = 1
+
+# Flags for inotify. See /usr/include/sys/inotify.h.
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x1000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0x80000
+
+# The events which update the mtime of the watched directory, or remove the
+# directory itself.
+_WATCH_MASK = (_IN_CREATE | _IN_DELETE | _IN_MOVED_FROM | _IN_MOVED_TO |
+               _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct('iIII')
+_READ_SIZE = 65536
+
+# Seconds to wait for the daemon to finish setting up the watches on start.
+_START_TIMEOUT = 300
+
+# Seconds to wait before setting up the watches again after some changes are
+# missed. The interval is doubled while the new watches also miss changes, as
+# it happens on every attempt when the limit of the watches is exceeded.
+_MIN_RESTART_INTERVAL = 60
+_MAX_RESTART_INTERVAL = 3600
+
+
+def _get_socket_path():
+  return os.path.join(build_common.get_arc_root(), build_common.OUT_DIR,
+                      'file_list_watcher.sock')
+
+
+def _get_log_path():
+  return os.path.join(build_common.get_arc_root(), build_common.OUT_DIR,
+                      'file_list_watcher.log')
+
+
+def _get_default_roots():
+  return [os.path.join(build_common.get_arc_root(), path) for path in
+          (build_common.get_staging_root(), 'src', 'mods')]
+
+
+class _Inotify(object):
+  """A thin wrapper of the inotify system calls."""
+
+  def __init__(self):
+    self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    self.fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+    if self.fd < 0:
+      raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+  def add_watch(self, path, mask):
+    wd = self._libc.inotify_add_watch(self.fd, path, mask)
+    if wd < 0:
+      error = ctypes.get_errno()
+      raise OSError(error, os.strerror(error), path)
+    return wd
+
+  def rm_watch(self, wd):
+    self._libc.inotify_rm_watch(self.fd, wd)
+
+  def read_events(self):
+    """Returns a list of (wd, mask, name) which are available now."""
+    events = []
+    while True:
+      try:
+        data = os.read(self.fd, _READ_SIZE)
+      except OSError as e:
+        if e.errno == errno.EAGAIN:
+          return events
+        raise
+      offset = 0
+      while offset < len(data):
+        wd, mask, _, name_length = _EVENT_HEADER.unpack_from(data, offset)
+        offset += _EVENT_HEADER.size
+        name = data[offset:offset + name_length].rstrip('\0')
+        offset += name_length
+        events.append((wd, mask, name))
+
+
+class _Watcher(object):
+  """Keeps track of the directories changed under |roots|.
+
+  Each change is recorded with the sequence number of the next query, so a
+  client which checked a directory after the query with sequence number N
+  knows the directory is not changed since then if the directory is recorded
+  with N or less. The sequence numbers are valid only in the same instance.
+  """
+
+  def __init__(self, roots):
+    self._roots = [root for root in roots if os.path.isdir(root)]
+    self._inotify = _Inotify()
+    # A directory can be watched via multiple paths, as out/staging is a tree
+    # of symlinks.
+    self._wd_paths = collections.defaultdict(set)
+    self._path_wd = {}
+    self._children = collections.defaultdict(set)
+    self._changed = {}
+    self._seq = 0
+    self._instance = '%d.%f' % (os.getpid(), time.time())
+    self._is_complete = True
+    for root in self._roots:
+      self._add_tree(root, mark_changed=False)
+
+  @property
+  def fileno(self):
+    return self._inotify.fd
+
+  @property
+  def is_complete(self):
+    """Returns False if some changes may have been missed."""
+    return self._is_complete
+
+  def close(self):
+    os.close(self._inotify.fd)
+
+  def _mark_changed(self, path):
+    self._changed[path] = self._seq
+
+  def _add_tree(self, path, mark_changed=True):
+    for root, dirs, _ in os.walk(path, followlinks=True):
+      if not self._is_complete:
+        return
+      if root in self._path_wd:
+        # Already watched.
+        continue
+      try:
+        wd = self._inotify.add_watch(root, _WATCH_MASK)
+      except OSError as e:
+        if e.errno == errno.ENOSPC:
+          logging.error('Exceeded the limit of inotify watches. See '
+                        '/proc/sys/fs/inotify/max_user_watches.')
+          self._is_complete = False
+          return
+        if e.errno in (errno.ENOENT, errno.ENOTDIR):
+          # Removed while walking.
+          dirs[:] = []
+          continue
+        raise
+      self._wd_paths[wd].add(root)
+      self._path_wd[root] = wd
+      self._children[os.path.dirname(root)].add(root)
+      if mark_changed:
+        # Files may be added before the watch is set up, so the directory
+        # needs to be checked by the client.
+        self._mark_changed(root)
+
+  def _remove_tree(self, path):
+    wd = self._path_wd.pop(path, None)
+    if wd is None:
+      # Not a watched directory.
+      return
+    self._mark_changed(path)
+    for child in self._children.pop(path, set()):
+      self._remove_tree(child)
+    self._children[os.path.dirname(path)].discard(path)
+    paths = self._wd_paths[wd]
+    paths.discard(path)
+    if not paths:
+      del self._wd_paths[wd]
+      self._inotify.rm_watch(wd)
+
+  def _handle_event(self, wd, mask, name):
+    if mask & _IN_Q_OVERFLOW:
+      logging.error('inotify event queue overflowed.')
+      self._is_complete = False
+      return
+    for path in list(self._wd_paths.get(wd, ())):
+      if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF | _IN_IGNORED):
+        self._remove_tree(path)
+        if path in self._roots:
+          logging.error('Watched root is removed: %s', path)
+          self._is_complete = False
+        continue
+      self._mark_changed(path)
+      child = os.path.join(path, name)
+      if mask & (_IN_DELETE | _IN_MOVED_FROM):
+        self._remove_tree(child)
+      elif mask & (_IN_CREATE | _IN_MOVED_TO):
+        # The mask does not tell if |child| is a symlink to a directory.
+        if os.path.isdir(child):
+          self._add_tree(child)
+
+  def process_events(self):
+    for wd, mask, name in self._inotify.read_events():
+      self._handle_event(wd, mask, name)
+
+  def query(self):
+    """Returns the changes recorded so far.
+
+    The directories changed after this query are recorded with a larger
+    sequence number than the one returned.
+    """
+    # Events for the file operations done before the query are already queued
+    # in the kernel, so process them before answering.
+    self.process_events()
+    response = {
+        'version': _VERSION,
+        'instance': self._instance,
+        'seq': self._seq,
+        'roots': self._roots,
+        'changed': self._changed,
+        'watched': len(self._path_wd),
+        'is_complete': self._is_complete,
+    }
+    self._seq += 1
+    return response
+
+
+def _serve(roots):
+  logging.info('Setting up watches: %s', ', '.join(roots))
+  watcher = _Watcher(roots)
+  logging.info('Watching directories')
+
+  socket_path = _get_socket_path()
+  server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    os.unlink(socket_path)
+  except OSError as e:
+    if e.errno != errno.ENOENT:
+      raise
+  server.bind(socket_path)
+  server.listen(5)
+  restart_interval = _MIN_RESTART_INTERVAL
+  next_restart_time = time.time() + restart_interval
+  try:
+    while True:
+      readable, _, _ = select.select([watcher.fileno, server], [], [])
+      if watcher.fileno in readable:
+        watcher.process_events()
+      if server not in readable:
+        continue
+      connection, _ = server.accept()
+      try:
+        request = marshal.loads(_receive_all(connection))
+        if request['command'] == 'stop':
+          connection.sendall(marshal.dumps({'version': _VERSION}))
+          return
+        watcher.process_events()
+        if watcher.is_complete:
+          restart_interval = _MIN_RESTART_INTERVAL
+        elif time.time() >= next_restart_time:
+          # Some changes may have been missed. Start over with a new instance,
+          # so that the clients do not trust the older sequence numbers.
+          # Until then, the clients check the directories by themselves.
+          logging.info('Setting up watches again')
+          watcher.close()
+          watcher = _Watcher(roots)
+          if not watcher.is_complete:
+            restart_interval = min(restart_interval * 2, _MAX_RESTART_INTERVAL)
+          next_restart_time = time.time() + restart_interval
+        connection.sendall(marshal.dumps(watcher.query()))
+      finally:
+        connection.close()
+  finally:
+    server.close()
+    os.unlink(socket_path)
+
+
+def _receive_all(connection):
+  data = []
+  while True:
+    chunk = connection.recv(_READ_SIZE)
+    if not chunk:
+      return ''.join(data)
+    data.append(chunk)
+
+
+def _send_request(command):
+  """Sends a request to the daemon, and returns the response.
+
+  Returns None if the daemon is not running.
+  """
+  client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    try:
+      client.connect(_get_socket_path())
+    except socket.error as e:
+      if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+        return None
+      raise
+    client.sendall(marshal.dumps({'command': command}))
+    client.shutdown(socket.SHUT_WR)
+    response = marshal.loads(_receive_all(client))
+  finally:
+    client.close()
+  if response.get('version') != _VERSION:
+    return None
+  return response
+
+
+def query():
+  """Asks the daemon for the changes recorded so far.
+
+  Returns a tuple of the daemon instance ID, the sequence number of the query,
+  the list of the watched roots, and a dict from each changed directory to the
+  sequence number it was changed at. Returns None if the daemon is not
+  running, or if it may have missed some changes.
+  """
+  try:
+    response = _send_request('query')
+  except (socket.error, EOFError, ValueError):
+    logging.warning('Failed to query file_list_watcher', exc_info=True)
+    return None
+  if response is None:
+    return None
+  if not response['is_complete']:
+    logging.warning('file_list_watcher may have missed some changes. See %s',
+                    _get_log_path())
+    return None
+  return (response['instance'], response['seq'], response['roots'],
+          response['changed'])
+
+
+def _start(roots):
+  if _send_request('status') is not None:
+    print 'file_list_watcher is already running.'
+    return 0
+  file_util.makedirs_safely(os.path.dirname(_get_log_path()))
+  with open(_get_log_path(), 'a') as log:
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'serve'] + roots,
+        cwd=build_common.get_arc_root(), stdin=open(os.devnull),
+        stdout=log, stderr=subprocess.STDOUT, close_fds=True,
+        preexec_fn=os.setsid)
+  deadline = time.time() + _START_TIMEOUT
+  while time.time() < deadline:
+    response = _send_request('status')
+    if response is not None:
+      print 'file_list_watcher is watching %d directories.' % (
+          response['watched'])
+      return 0
+    time.sleep(0.5)
+  print 'file_list_watcher failed to start. See %s' % _get_log_path()
+  return 1
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+  parser.add_argument('command', choices=('start', 'stop', 'status', 'serve'))
+  parser.add_argument('roots', nargs='*', metavar='ROOT',
+                      help='Directories to watch. out/staging, src and mods '
+                      'are watched by default.')
+  args = parser.parse_args()
+  roots = [os.path.abspath(root) for root in args.roots] or _get_default_roots()
+
+  if args.command == 'serve':
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
+    _serve(roots)
+    return 0
+  if args.command == 'start':
+    return _start(roots)
+
+  response = _send_request(args.command)
+  if response is None:
+    print 'file_list_watcher is not running.'
+    return 1 if args.command == 'status' else 0
+  if args.command == 'status':
+    print 'file_list_watcher is watching %d directories.' % (
+        response['watched'])
+    if not response['is_complete']:
+      print 'Some changes may have been missed. See %s' % _get_log_path()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
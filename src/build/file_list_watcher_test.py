@@ -0,0 +1,87 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unittest for file_list_watcher.py."""
+
+import os
+import tempfile
+import unittest
+
+from src.build import file_list_watcher
+from src.build.util import file_util
+
+
+class FileListWatcherTest(unittest.TestCase):
+  def setUp(self):
+    self._root = tempfile.mkdtemp()
+    os.makedirs(os.path.join(self._root, 'foo', 'bar'))
+    self._watcher = file_list_watcher._Watcher([self._root])
+
+  def tearDown(self):
+    self._watcher.close()
+    file_util.rmtree(self._root, ignore_errors=True)
+
+  def _get_changed(self, seq):
+    """Returns the directories changed after the query |seq|."""
+    response = self._watcher.query()
+    return sorted(os.path.relpath(path, self._root)
+                  for path, changed_seq in response['changed'].iteritems()
+                  if changed_seq > seq)
+
+  def testChanges(self):
+    seq = self._watcher.query()['seq']
+    self.assertEquals([], self._get_changed(seq))
+
+    open(os.path.join(self._root, 'foo', 'bar', 'baz.cc'), 'w').close()
+    self.assertEquals(['foo/bar'], self._get_changed(seq))
+
+    # A new directory is watched, and reported as changed.
+    seq = self._watcher.query()['seq']
+    os.makedirs(os.path.join(self._root, 'foo', 'new'))
+    self.assertEquals(['foo', 'foo/new'], self._get_changed(seq))
+    seq = self._watcher.query()['seq']
+    open(os.path.join(self._root, 'foo', 'new', 'qux.cc'), 'w').close()
+    self.assertEquals(['foo/new'], self._get_changed(seq))
+
+    # Removing a directory reports its parent and itself.
+    seq = self._watcher.query()['seq']
+    file_util.rmtree(os.path.join(self._root, 'foo', 'new'))
+    self.assertEquals(['foo', 'foo/new'], self._get_changed(seq))
+
+  def testSymlinkedDirectory(self):
+    target = os.path.join(self._root, 'foo', 'bar')
+    link = os.path.join(self._root, 'link')
+    seq = self._watcher.query()['seq']
+    os.symlink(target, link)
+    self.assertEquals(['.', 'link'], self._get_changed(seq))
+
+    # The change is reported for both of the paths.
+    seq = self._watcher.query()['seq']
+    open(os.path.join(target, 'baz.cc'), 'w').close()
+    self.assertEquals(['foo/bar', 'link'], self._get_changed(seq))
+
+    # Retargeting the symlink reports the paths under it.
+    seq = self._watcher.query()['seq']
+    os.remove(link)
+    os.symlink(os.path.join(self._root, 'foo'), link)
+    self.assertEquals(['.', 'link', 'link/bar'], self._get_changed(seq))
+
+  def testIncomplete(self):
+    self.assertTrue(self._watcher.query()['is_complete'])
+    # Simulate an overflow of the event queue.
+    self._watcher._handle_event(-1, file_list_watcher._IN_Q_OVERFLOW, '')
+    response = self._watcher.query()
+    self.assertFalse(response['is_complete'])
+
+    # The client does not use the changes from the incomplete watcher.
+    original_send_request = file_list_watcher._send_request
+    file_list_watcher._send_request = lambda command: response
+    try:
+      self.assertIsNone(file_list_watcher.query())
+    finally:
+      file_list_watcher._send_request = original_send_request
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -8,9 +8,11 @@ import argparse
 import cPickle
 import collections
 import glob
+import hashlib
 import itertools
 import json
 import logging
+import multiprocessing
 import os
 import re
 import shlex
@@ -21,6 +23,7 @@ import tempfile
 from src.build import analyze_diffs
 from src.build import build_common
 from src.build import open_source
+from src.build.util import concurrent
 from src.build.util import file_util
 from src.build.util import logging_util
 
@@ -57,6 +60,31 @@ _DEFAULT_LINT_TARGET_DIR_LIST = [
     'third_party/examples',
 ]
 
+# The directory to store the markers of the files which passed a linter.
+_LINT_CACHE_DIR = os.path.join(build_common.OUT_DIR, 'lint_cache')
+
+# Increment this when the format of the lint cache key is changed.
+_LINT_CACHE_VERSION = 0
+
+# The maximum number of files to pass to a single linter invocation.
+_MAX_BATCH_SIZE = 50
+
+
+def _get_file_hash(path):
+  with open(path, 'rb') as f:
+    return hashlib.sha1(f.read()).hexdigest()
+
+
+_module_hash = None
+
+
+def _get_module_hash():
+  """Returns the hash of this script, which defines the linter rules."""
+  global _module_hash
+  if _module_hash is None:
+    _module_hash = _get_file_hash(os.path.splitext(__file__)[0] + '.py')
+  return _module_hash
+
 
 class FileStatistics:
   def __init__(self, filename=None):
@@ -80,7 +108,8 @@ class Linter(object):
   """
 
   def __init__(self, name, target_groups=None,
-               ignore_mods=False, ignore_upstream_tracking_file=True):
+               ignore_mods=False, ignore_upstream_tracking_file=True,
+               is_cacheable=False):
     """Initializes the basic linter instance.
 
     - name: Name of the linter. Used for the name based ignoring check whose
@@ -91,6 +120,9 @@ class Linter(object):
       mods/. By default: False.
     - ignore_upstream_tracking_file: If True, the linter will not be applied
       to files tracking an upstream file. By default: True.
+    - is_cacheable: If True, the result of the linter depends only on the
+      path and the content of the file, so a file which passed the linter
+      is not checked again until it is changed. By default: False.
 
     Please see also LinterRunner for the common ignoring rule implementation.
     """
@@ -99,6 +131,7 @@ class Linter(object):
     self._target_groups = tuple(target_groups) if target_groups else None
     self._ignore_mods = ignore_mods
     self._ignore_upstream_tracking_file = ignore_upstream_tracking_file
+    self._is_cacheable = is_cacheable
 
   @property
   def name(self):
@@ -116,6 +149,14 @@ class Linter(object):
   def ignore_upstream_tracking_file(self):
     return self._ignore_upstream_tracking_file
 
+  @property
+  def is_cacheable(self):
+    return self._is_cacheable
+
+  def get_version(self):
+    """Returns a string which changes when the linter rules are changed."""
+    return '%s:%s' % (self._name, _get_module_hash())
+
   def should_run(self, path):
     """Returns True if this linter should be applied to the file at |path|."""
     # Returns True, by default, which means this linter will be applied to
@@ -127,6 +168,15 @@ class Linter(object):
     # All subclasses must override this function.
     raise NotImplementedError()
 
+  def run_batch(self, path_list):
+    """Applies the linter to the files in |path_list|.
+
+    Returns a dict from each path to the result of run(). By default, run()
+    is called for each file. Subclasses can override this to check multiple
+    files at once.
+    """
+    return dict((path, self.run(path)) for path in path_list)
+
 
 class CommandLineLinterBase(Linter):
   """Abstract Linter implementation to run a linter child process."""
@@ -143,8 +193,47 @@ class CommandLineLinterBase(Linter):
     self._error_line_filter = (
         re.compile(error_line_filter, re.M) if error_line_filter else None)
 
+  def get_version(self):
+    # The command line (for a placeholder path) and the linter script also
+    # define the rules.
+    command = self._build_command('')
+    version = [super(CommandLineLinterBase, self).get_version()] + command
+    if os.path.isfile(command[0]):
+      version.append(_get_file_hash(command[0]))
+    return '\0'.join(version)
+
   def run(self, path):
-    command = self._build_command(path)
+    return self._run_command(self._build_command(path))
+
+  def run_batch(self, path_list):
+    if len(path_list) == 1:
+      return {path_list[0]: self.run(path_list[0])}
+    command = self._build_batch_command(path_list)
+    if command is None:
+      return super(CommandLineLinterBase, self).run_batch(path_list)
+
+    output = self._run_command(command, log_output=False)
+    if output is True:
+      return dict.fromkeys(path_list, True)
+
+    # Find the files with errors, from the prefix of each error line.
+    error_path_set = set()
+    for line in output.splitlines():
+      path = line.split(':', 1)[0]
+      if path in path_list:
+        error_path_set.add(path)
+    if not error_path_set:
+      # The error cannot be attributed to any file. Check each file separately.
+      return super(CommandLineLinterBase, self).run_batch(path_list)
+    logging.error('Lint output errors:\n%s', self._filter_output(output))
+    return dict((path, path not in error_path_set) for path in path_list)
+
+  def _run_command(self, command, log_output=True):
+    """Runs the linter |command|.
+
+    Returns True on success. On lint errors, returns the output if
+    |log_output| is False, otherwise logs it and returns False.
+    """
     env = self._build_env()
     try:
       subprocess.check_output(command, stderr=subprocess.STDOUT, env=env)
@@ -153,18 +242,31 @@ class CommandLineLinterBase(Linter):
       logging.exception('Unable to invoke %s', command)
       return False
     except subprocess.CalledProcessError as e:
-      if self._error_line_filter:
-        output = '\n'.join(self._error_line_filter.findall(e.output))
-      else:
-        output = e.output
-      logging.error('Lint output errors:\n%s', output)
+      if not log_output:
+        return e.output
+      logging.error('Lint output errors:\n%s', self._filter_output(e.output))
       return False
 
+  def _filter_output(self, output):
+    if self._error_line_filter:
+      return '\n'.join(self._error_line_filter.findall(output))
+    return output
+
   def _build_command(self, path):
     """Builds the commandline to run a subprocess, and returns it."""
     # All subclasses must implement this.
     raise NotImplementedError()
 
+  def _build_batch_command(self, path_list):
+    """Builds the commandline to check all the files in |path_list|.
+
+    The linter must output each error in a line starting with the path and
+    a colon. By default returns None, which means the linter checks only one
+    file at once.
+    """
+    # Subclass can override this if the linter supports multiple files.
+    return None
+
   def _build_env(self):
     """Builds the env dict for a subprocess, and returns it.
 
@@ -182,11 +284,16 @@ class CppLinter(CommandLineLinterBase):
   def __init__(self):
     super(CppLinter, self).__init__(
         'cpplint', target_groups=[_GROUP_CPP], ignore_mods=True,
+        is_cacheable=True,
         # Strip less information lines.
         error_line_filter='^(?:(?!Done processing|Total errors found:))(.*)')
 
   def _build_command(self, path):
-    return ['third_party/tools/depot_tools/cpplint.py', '--root=src', path]
+    return self._build_batch_command([path])
+
+  def _build_batch_command(self, path_list):
+    return (['third_party/tools/depot_tools/cpplint.py', '--root=src'] +
+            path_list)
 
 
 class JsLinter(CommandLineLinterBase):
@@ -194,7 +301,7 @@ class JsLinter(CommandLineLinterBase):
 
   def __init__(self):
     super(JsLinter, self).__init__(
-        'gjslint', target_groups=[_GROUP_JS],
+        'gjslint', target_groups=[_GROUP_JS], is_cacheable=True,
         # Strip the path to the arc root directory.
         error_line_filter=(
             '^' + re.escape(build_common.get_arc_root()) + '/(.*)'))
@@ -248,7 +355,8 @@ class PyLinter(CommandLineLinterBase):
   ]
 
   def __init__(self):
-    super(PyLinter, self).__init__('flake8', target_groups=[_GROUP_PY])
+    super(PyLinter, self).__init__(
+        'flake8', target_groups=[_GROUP_PY], is_cacheable=True)
 
   def should_run(self, path):
     # Do not run Python linter for the third_party library, which is not managed
@@ -256,10 +364,12 @@ class PyLinter(CommandLineLinterBase):
     return not path.startswith('third_party/')
 
   def _build_command(self, path):
+    return self._build_batch_command([path])
+
+  def _build_batch_command(self, path_list):
     return ['src/build/flake8',
             '--ignore=' + ','.join(PyLinter._DISABLED_LINT_LIST),
-            '--max-line-length=80',
-            path]
+            '--max-line-length=80'] + path_list
 
 
 class TestConfigLinter(CommandLineLinterBase):
@@ -286,17 +396,20 @@ class TestConfigLinter(CommandLineLinterBase):
   _META_FILE_LIST = ['OPEN_SOURCE', 'OWNERS']
 
   def __init__(self):
-    super(TestConfigLinter, self).__init__('testconfig')
+    super(TestConfigLinter, self).__init__('testconfig', is_cacheable=True)
 
   def should_run(self, path):
     return (path.startswith('src/integration_tests/expectations/') and
             os.path.basename(path) not in TestConfigLinter._META_FILE_LIST)
 
   def _build_command(self, path):
+    return self._build_batch_command([path])
+
+  def _build_batch_command(self, path_list):
     # E501: line too long.
     # We do not limit the line length, considering some test names are very
     # long.
-    return ['src/build/flake8', '--ignore=E501', path]
+    return ['src/build/flake8', '--ignore=E501'] + path_list
 
   def _build_env(self):
     env = os.environ.copy()
@@ -311,7 +424,8 @@ class CopyrightLinter(CommandLineLinterBase):
     super(CopyrightLinter, self).__init__(
         'copyright',
         target_groups=[_GROUP_ASM, _GROUP_CPP, _GROUP_CSS, _GROUP_HTML,
-                       _GROUP_JAVA, _GROUP_JS, _GROUP_PY])
+                       _GROUP_JAVA, _GROUP_JS, _GROUP_PY],
+        is_cacheable=True)
 
   def should_run(self, path):
     # TODO(crbug.com/411195): Clean up all copyrights so we can turn this on
@@ -329,7 +443,7 @@ class UpstreamLinter(Linter):
   _VAR_PATTERN = re.compile(r'^\s*([A-Z_]+)\s*=(.*)$')
 
   def __init__(self):
-    super(UpstreamLinter, self).__init__('upstreamlint')
+    super(UpstreamLinter, self).__init__('upstreamlint', is_cacheable=True)
 
   def should_run(self, path):
     # mods/upstream directory is not yet included in open source so we cannot
@@ -379,7 +493,7 @@ class LicenseLinter(Linter):
   """Linter to check MODULE_LICENSE_TODO files."""
 
   def __init__(self):
-    super(LicenseLinter, self).__init__('licenselint')
+    super(LicenseLinter, self).__init__('licenselint', is_cacheable=True)
 
   def should_run(self, path):
     # Accept only MODULE_LICENSE_TODO file.
@@ -453,6 +567,36 @@ class DiffLinter(CommandLineLinterBase):
     return command
 
 
+class LintCache(object):
+  """Remembers the files which passed each cacheable linter.
+
+  A marker file is created for each pair of a linter and a file which passed
+  it. The marker name is the hash of the linter version, and the path and
+  content of the file, so the marker is not found once either is changed.
+  """
+
+  def __init__(self, cache_dir=_LINT_CACHE_DIR):
+    self._cache_dir = cache_dir
+    self._version_map = {}
+
+  def _get_marker_path(self, linter, path, file_hash):
+    version = self._version_map.get(linter.name)
+    if version is None:
+      version = linter.get_version()
+      self._version_map[linter.name] = version
+    key = hashlib.sha1('\0'.join(
+        [str(_LINT_CACHE_VERSION), version, path, file_hash])).hexdigest()
+    return os.path.join(self._cache_dir, key[:2], key)
+
+  def has_passed(self, linter, path, file_hash):
+    return os.path.exists(self._get_marker_path(linter, path, file_hash))
+
+  def set_passed(self, linter, path, file_hash):
+    marker_path = self._get_marker_path(linter, path, file_hash)
+    file_util.makedirs_safely(os.path.dirname(marker_path))
+    open(marker_path, 'w').close()
+
+
 class LinterRunner(object):
   """Takes a list of Linters, and runs them."""
 
@@ -471,18 +615,20 @@ class LinterRunner(object):
       '.s': _GROUP_ASM,
   }
 
-  def __init__(self, linter_list, ignore_rule=None):
+  def __init__(self, linter_list, ignore_rule=None, cache=None):
     self._linter_list = linter_list
     self._ignore_rule = ignore_rule or {}
+    self._cache = cache
 
-  def run(self, path):
+  def get_linters_to_run(self, path):
+    """Returns the list of the linters which should be applied to |path|."""
     # In is_tracking_an_upstream_file, the path is opened.
     # To avoid invoking it many times for a file, we cache the result, and
     # pass it to Linter.should_run() method via an argument.
     is_tracking_upstream = analyze_diffs.is_tracking_an_upstream_file(path)
     group = LinterRunner._EXTENSION_GROUP_MAP.get(
         os.path.splitext(path)[1].lower())
-    result = True
+    result = []
     for linter in self._linter_list:
       # Common rule to check if linter should be applied to the file.
       if (linter.name in self._ignore_rule.get(path, []) or
@@ -493,16 +639,60 @@ class LinterRunner(object):
       # Also, check each linter specific rule.
       if not linter.should_run(path):
         continue
-
-      logging.info('%- 10s: %s', linter.name, path)
-      result &= linter.run(path)
-
-    if not result:
-      logging.error('%s: has lint errors', path)
+      result.append(linter)
     return result
 
+  def run(self, path):
+    return self.run_all([path], 1)
+
+  def run_all(self, path_list, jobs):
+    """Applies the linters to all the files in |path_list|.
 
-def _run_lint(target_file_list, ignore_rule, output_dir):
+    The files are split into batches for each linter, and the batches run on
+    |jobs| threads in parallel. Returns True if all the files pass.
+    """
+    batch_map = collections.OrderedDict()
+    file_hash_map = {}
+    for path in path_list:
+      for linter in self.get_linters_to_run(path):
+        if self._cache and linter.is_cacheable:
+          if path not in file_hash_map:
+            file_hash_map[path] = _get_file_hash(path)
+          if self._cache.has_passed(linter, path, file_hash_map[path]):
+            logging.info('%- 10s: %s (cached)', linter.name, path)
+            continue
+        logging.info('%- 10s: %s', linter.name, path)
+        batch_map.setdefault(linter, []).append(path)
+
+    if jobs > 1:
+      executor = concurrent.ThreadPoolExecutor(max_workers=jobs, daemon=True)
+    else:
+      executor = concurrent.SynchronousExecutor()
+    error_path_set = set()
+    with executor:
+      future_map = {}
+      for linter, linter_path_list in batch_map.iteritems():
+        # Split the files so that all the threads have some work to do.
+        batch_size = min(_MAX_BATCH_SIZE, -(-len(linter_path_list) // jobs))
+        for i in xrange(0, len(linter_path_list), batch_size):
+          future = executor.submit(
+              linter.run_batch, linter_path_list[i:i + batch_size])
+          future_map[future] = linter
+      for future, linter in future_map.iteritems():
+        for path, result in future.result().iteritems():
+          if not result:
+            error_path_set.add(path)
+          elif path in file_hash_map and linter.is_cacheable:
+            self._cache.set_passed(linter, path, file_hash_map[path])
+
+    for path in path_list:
+      if path in error_path_set:
+        logging.error('%s: has lint errors', path)
+    return not error_path_set
+
+
+def _run_lint(target_file_list, ignore_rule, output_dir, jobs=1,
+              use_cache=False):
   """Applies all linters to the target_file_list.
 
   - target_file_list: List of the target files' paths.
@@ -510,16 +700,16 @@ def _run_lint(target_file_list, ignore_rule, output_dir):
   - output_dir: Directory to store the analyze_diffs.py's output data.
     If specified, it is callers' responsibility to remove the generated
     files, if necessary.
+  - jobs: The number of linters to run in parallel.
+  - use_cache: If True, skips the cacheable linters for the files which
+    passed them before.
   """
   runner = LinterRunner(
       [CppLinter(), JsLinter(), PyLinter(), TestConfigLinter(),
        CopyrightLinter(), UpstreamLinter(), LicenseLinter(),
        OpenSourceLinter(), DiffLinter(output_dir)],
-      ignore_rule)
-  result = True
-  for path in target_file_list:
-    result &= runner.run(path)
-  return result
+      ignore_rule, cache=LintCache() if use_cache else None)
+  return runner.run_all(target_file_list, jobs)
 
 
 def _process_analyze_diffs_output(output_dir):
@@ -624,7 +814,8 @@ def _read_ignore_rule(path):
   return result
 
 
-def process(target_path_list, ignore_file=None, output_file=None):
+def process(target_path_list, ignore_file=None, output_file=None, jobs=None,
+            use_cache=True):
   target_file_list = _expand_path_list(target_path_list)
   ignore_rule = _read_ignore_rule(ignore_file)
   target_file_list = _filter_files(target_file_list)
@@ -633,7 +824,8 @@ def process(target_path_list, ignore_file=None, output_file=None):
   # iff |output_file| is specified.
   output_dir = tempfile.mkdtemp(dir='out') if output_file else None
   try:
-    if not _run_lint(target_file_list, ignore_rule, output_dir):
+    if not _run_lint(target_file_list, ignore_rule, output_dir,
+                     jobs or multiprocessing.cpu_count(), use_cache):
       return 1
 
     if output_file:
@@ -715,7 +907,12 @@ def main():
                       'will lint all files.')
   parser.add_argument('--ignore', '-i', dest='ignore_file',
                       help='A text file containting list of files to ignore.')
+  parser.add_argument('--jobs', '-j', type=int,
+                      help='The number of linters to run in parallel. By '
+                      'default, the number of CPUs.')
   parser.add_argument('--merge', action='store_true', help='Merge results.')
+  parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                      help='Check all the files, even if they passed before.')
   parser.add_argument('--output', '-o', help='Output file for storing results.')
   parser.add_argument('--verbose', '-v', action='store_true',
                       help='Prints additional output.')
@@ -729,7 +926,8 @@ def main():
   if args.merge:
     return merge_results(args.files, args.output)
   else:
-    return process(args.files, args.ignore_file, args.output)
+    return process(args.files, args.ignore_file, args.output, args.jobs,
+                   args.use_cache)
 
 if __name__ == '__main__':
   sys.exit(main())
@@ -0,0 +1,74 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unittests for lint_source.py."""
+
+import os
+import tempfile
+import unittest
+
+from src.build import lint_source
+from src.build.util import file_util
+
+
+class _FakeLinter(lint_source.Linter):
+  """Fails the files containing 'BAD', and records the checked files."""
+
+  def __init__(self):
+    super(_FakeLinter, self).__init__('fakelint', is_cacheable=True)
+    self.checked_path_list = []
+
+  def run(self, path):
+    self.checked_path_list.append(path)
+    with open(path) as f:
+      return 'BAD' not in f.read()
+
+
+class LinterRunnerTest(unittest.TestCase):
+  def setUp(self):
+    self._tmpdir = tempfile.mkdtemp()
+    self._linter = _FakeLinter()
+    self._runner = lint_source.LinterRunner(
+        [self._linter],
+        cache=lint_source.LintCache(os.path.join(self._tmpdir, 'cache')))
+
+  def tearDown(self):
+    file_util.rmtree(self._tmpdir)
+
+  def _write_files(self, content_list):
+    path_list = []
+    for i, content in enumerate(content_list):
+      path = os.path.join(self._tmpdir, 'file%d.py' % i)
+      with open(path, 'w') as f:
+        f.write(content)
+      path_list.append(path)
+    return path_list
+
+  def testRunAllInParallel(self):
+    path_list = self._write_files(['ok'] * 5 + ['BAD'])
+    self.assertFalse(self._runner.run_all(path_list, 3))
+    self.assertItemsEqual(path_list, self._linter.checked_path_list)
+
+  def testCache(self):
+    path_list = self._write_files(['ok', 'BAD'])
+    self.assertFalse(self._runner.run_all(path_list, 2))
+
+    # Only the file with errors is checked again.
+    self._linter.checked_path_list = []
+    self.assertFalse(self._runner.run_all(path_list, 2))
+    self.assertEquals([path_list[1]], self._linter.checked_path_list)
+
+    # The changed file is checked again.
+    self._linter.checked_path_list = []
+    self._write_files(['ok', 'fixed'])
+    self.assertTrue(self._runner.run_all(path_list, 2))
+    self.assertEquals([path_list[1]], self._linter.checked_path_list)
+
+    self._linter.checked_path_list = []
+    self.assertTrue(self._runner.run(path_list[1]))
+    self.assertEquals([], self._linter.checked_path_list)
+
+
+if __name__ == '__main__':
+  unittest.main()
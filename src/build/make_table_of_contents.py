@@ -16,31 +16,21 @@ dynamically linked to the shared library.
 """
 
 import errno
-import subprocess
 import sys
 
-from src.build import toolchain
-from src.build.build_options import OPTIONS
+from src.build.util import elf_symbols
 from src.build.util import file_util
 
 
-def make_table_of_contents(target, input_so_path):
-  # List only external dynamic symbol as implied by '-g' and '-D'.
-  # Use posix format of output that implied by '-f','p' as it is easiest to
-  # parse for our usage.
-  external_symbols = subprocess.check_output([
-      toolchain.get_tool(target, 'nm'), '-gD', '-f', 'p', input_so_path
-  ])
-  symbols = []
-  for line in external_symbols.splitlines():
-    # |line| should contain:
-    # <symbol name> <symbol type> <address>
-    # Put symbol names and symbol types into the TOC file.
-    # Drop address part since its modification does not require relinking for
-    # binaries that are dynamically linked agaist |input_so_path|.
-    symbols.append(' '.join(line.split(' ')[:2]))
-
-  return '\n'.join(symbols)
+def make_table_of_contents(input_so_path):
+  # List only external dynamic symbols, as 'nm -gD' does, sorted by name.
+  # Put symbol names and symbol types into the TOC file. Addresses are not
+  # put since their modification does not require relinking for binaries
+  # that are dynamically linked against |input_so_path|.
+  symbols = sorted(
+      symbol for symbol in elf_symbols.read_symbols(input_so_path, dynamic=True)
+      if symbol.is_external())
+  return '\n'.join('%s %s' % symbol[:2] for symbol in symbols)
 
 
 def should_update_toc_file(toc, output_toc_path):
@@ -60,15 +50,12 @@ def should_update_toc_file(toc, output_toc_path):
 
 
 def main(args):
-  OPTIONS.parse_configure_file()
-
-  if len(args) != 3:
+  if len(args) != 2:
     return -1
 
-  target = args[0]
-  input_so_path = args[1]
-  output_toc_path = args[2]
-  toc = make_table_of_contents(target, input_so_path)
+  input_so_path = args[0]
+  output_toc_path = args[1]
+  toc = make_table_of_contents(input_so_path)
 
   if should_update_toc_file(toc, output_toc_path):
     file_util.write_atomically(output_toc_path, toc)
@@ -7,6 +7,10 @@
 # TODO(igorc): Support codegen rules. Perhaps needs a rework to parse resulting
 # commands rather than dumping variable names.
 
+import collections
+import errno
+import hashlib
+import marshal
 import os
 import re
 import shlex
@@ -17,10 +21,12 @@ import tarfile
 
 from src.build import build_common
 from src.build import dependency_inspection
+from src.build import file_list_cache
 from src.build import ninja_generator
 from src.build import staging
 from src.build import toolchain
 from src.build.build_options import OPTIONS
+from src.build.util import concurrent
 from src.build.util import file_util
 
 
@@ -65,6 +71,12 @@ _READING_MAKEFILE_RE = re.compile('Reading makefile `([^\']+)\'')
 
 _TARGET_MAKEFILE = 'TARGET_MAKEFILE'
 
+_MAKE_CACHE_VERSION = 0
+
+# The default number of make processes MakefileNinjaTranslator.prefetch() runs
+# at once.
+_DEFAULT_PARALLEL_MAKE_JOBS = 4
+
 # Android build system (make) will use default behavior (empty values)
 # when variables are not set. We are enabling those as warnings and turning
 # them into script errors. This allows us to produce warnings when new unknown
@@ -796,7 +808,7 @@ def prepare_make_to_ninja():
   file_util.makedirs_safely(_MAKE_BUILD_DIR)
 
 
-def _filter_make_output(workdir, stdout, stderr, in_file):
+def _filter_make_output(workdir, stdout, stderr, in_file, submakes):
   # Check if stderr from make contains any error info.
   errors = []
   for line in stderr.split('\n'):
@@ -808,6 +820,7 @@ def _filter_make_output(workdir, stdout, stderr, in_file):
                       '\n'.join(errors))
 
   # Print and filter out "Reading makefile" lines from stdout if necessary.
+  # All makefiles read are appended to |submakes|.
   result = []
   has_logging = OPTIONS.is_make_to_ninja_logging()
   for line in stdout.split('\n'):
@@ -816,6 +829,7 @@ def _filter_make_output(workdir, stdout, stderr, in_file):
       if has_logging:
         print line
       submake = os.path.join(workdir, match.group(1))
+      submakes.append(submake)
       if not submake.startswith(_MAKE_TO_NINJA_DIR):
         dependency_inspection.add_files(submake)
     elif line:
@@ -824,12 +838,9 @@ def _filter_make_output(workdir, stdout, stderr, in_file):
   return result
 
 
-def _run_make(workdir, in_file, extra_env_vars):
-  dependency_inspection.add_file_listing([workdir], None, None, True)
-
+def _get_make_env():
   target = OPTIONS.target()
-  main_makefile = _create_main_makefile(in_file, extra_env_vars)
-  env = {
+  return {
       'CXX': toolchain.get_tool(target, 'cxx'),
       'CC': toolchain.get_tool(target, 'cc'),
       'LD': toolchain.get_tool(target, 'ld'),
@@ -845,6 +856,9 @@ def _run_make(workdir, in_file, extra_env_vars):
       'PATH': ':'.join([_MAKE_TO_NINJA_BIN_DIR, os.environ['PATH']])
   }
 
+
+def _invoke_make(main_makefile, env):
+  """Runs make with |main_makefile|, and returns its stdout and stderr."""
   # "--debug=v" indicates when Make reads makefiles.
   make_cmd = [
       'make', '-f', '-', '-I', _MAKE_BUILD_DIR, '--always-make',
@@ -859,12 +873,213 @@ def _run_make(workdir, in_file, extra_env_vars):
             ' '.join('%s=%s' % item for item in env.iteritems()),
             ' '.join(make_cmd)))
 
-  # Run make command, and process its output.
+  # Run make command.
   p = subprocess.Popen(
       make_cmd, cwd=_MAKE_TO_NINJA_DIR, env=env,
       stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-  return _filter_make_output(workdir, *p.communicate(main_makefile),
-                             in_file=in_file)
+  return p.communicate(main_makefile)
+
+
+def _split_make_output(make_output_lines):
+  """Splits the output of make into (build_type, build_file, raw_vars)."""
+  sections = []
+  build_type = ''
+  build_file = ''
+  build_lines = []
+  for line in make_output_lines:
+    if line.startswith(_VARS_PREFIX):
+      if build_type:
+        # Parse the previous lines
+        sections.append((build_type, build_file, _parse_vars(build_lines)))
+      line = line[len(_VARS_PREFIX):]
+      build_type, build_file = line.split(' ')
+      build_lines = []
+      continue
+    build_lines.append(line)
+  if build_type:
+    # Parse the previous lines
+    sections.append((build_type, build_file, _parse_vars(build_lines)))
+  return sections
+
+
+# Holds sha1 of the files hashed in this process, as the same sub-makefiles
+# (e.g. build/core/*.mk) are read for every Android.mk.
+_file_hash_cache = {}
+
+
+def _get_file_hash(path):
+  """Returns sha1 of the content of |path|, or None if it does not exist."""
+  if path not in _file_hash_cache:
+    try:
+      with open(path) as f:
+        _file_hash_cache[path] = hashlib.sha1(f.read()).hexdigest()
+    except IOError as e:
+      if e.errno != errno.ENOENT:
+        raise
+      _file_hash_cache[path] = None
+  return _file_hash_cache[path]
+
+
+def _get_make_cache_path(workdir, in_file, main_makefile, env):
+  key = hashlib.sha1()
+  for value in [workdir, in_file, main_makefile] + sorted(
+      '%s=%s' % item for item in env.iteritems()):
+    key.update(value)
+    key.update('\0')
+  return os.path.join(build_common.get_config_cache_dir(), 'make_to_ninja',
+                      key.hexdigest())
+
+
+class MakeOutputCache(object):
+  """Represents an on-disk cache of the parsed output of make.
+
+  The cache is looked up by the hash of the main makefile and the environment
+  variables passed to make. It is fresh if all the sub-makefiles read by make
+  have the same content, and the files in the working directory are unchanged.
+  """
+
+  def __init__(self, submake_hashes, listing, sections):
+    self.submake_hashes = submake_hashes
+    self.listing = listing
+    self.sections = sections
+
+  def check_freshness(self):
+    for path, content_hash in self.submake_hashes:
+      if _get_file_hash(path) != content_hash:
+        return False
+    return self.listing.refresh_cache()
+
+  def to_dict(self):
+    return {
+        'version': _MAKE_CACHE_VERSION,
+        'submake_hashes': self.submake_hashes,
+        'listing': self.listing.to_dict(),
+        'sections': self.sections,
+    }
+
+  def save_to_file(self, path):
+    file_util.makedirs_safely(os.path.dirname(path))
+    file_util.generate_file_atomically(
+        path, lambda f: marshal.dump(self.to_dict(), f))
+
+
+def _load_make_output_cache(path):
+  try:
+    with open(path) as f:
+      data = marshal.load(f)
+  except (EOFError, ValueError):
+    return None
+  except IOError as e:
+    if e.errno == errno.ENOENT:
+      return None
+    raise
+  if data['version'] != _MAKE_CACHE_VERSION:
+    return None
+  listing = file_list_cache.file_list_cache_from_dict(data['listing'])
+  if listing is None:
+    return None
+  return MakeOutputCache(data['submake_hashes'], listing, data['sections'])
+
+
+class _MakeJob(object):
+  """Reads the output of make for |in_file|, using the cache if possible.
+
+  On creation, the cache is looked up. If it is fresh, |sections| is set to
+  the cached result. Otherwise, the caller needs to run make via
+  _invoke_make(), and pass its output to finish().
+  The sections are a list of (build_type, build_file, raw_vars) for each
+  module.
+  """
+
+  def __init__(self, workdir, in_file, extra_env_vars):
+    dependency_inspection.add_file_listing([workdir], None, None, True)
+    self.workdir = workdir
+    self.in_file = in_file
+    self.main_makefile = _create_main_makefile(in_file, extra_env_vars)
+    self.env = _get_make_env()
+    self.sections = None
+    self._cache_path = None
+    if not OPTIONS.enable_config_cache():
+      return
+
+    self._cache_path = _get_make_cache_path(
+        workdir, in_file, self.main_makefile, self.env)
+    cache = _load_make_output_cache(self._cache_path)
+    if cache is not None and cache.check_freshness():
+      if OPTIONS.is_make_to_ninja_logging():
+        print 'Using cached make output for ' + in_file
+      dependency_inspection.add_files(*[
+          path for path, _ in cache.submake_hashes
+          if not path.startswith(_MAKE_TO_NINJA_DIR)])
+      self.sections = cache.sections
+
+  def get_make_key(self):
+    """Returns a key to identify the make invocation of this job."""
+    return (self.workdir, self.in_file, self.main_makefile)
+
+  def finish(self, stdout, stderr):
+    """Parses the output of make, and saves it to the cache."""
+    submakes = []
+    self.sections = _split_make_output(_filter_make_output(
+        self.workdir, stdout, stderr, in_file=self.in_file, submakes=submakes))
+    if self._cache_path is None:
+      return
+    listing = file_list_cache.FileListCache(
+        file_list_cache.Query([self.workdir], None, None, True))
+    listing.refresh_cache()
+    submake_hashes = [(path, _get_file_hash(path)) for path in submakes]
+    MakeOutputCache(submake_hashes, listing, self.sections).save_to_file(
+        self._cache_path)
+
+
+def _read_make_sections(workdir, in_file, extra_env_vars):
+  """Runs make for |in_file| and returns its parsed output.
+
+  The result is a list of (build_type, build_file, raw_vars) for each module.
+  If the config cache is enabled, the result is cached on disk, so make does
+  not run again as long as the makefiles it reads are unchanged.
+  """
+  job = _MakeJob(workdir, in_file, extra_env_vars)
+  if job.sections is None:
+    job.finish(*_invoke_make(job.main_makefile, job.env))
+  return job.sections
+
+
+def _read_make_sections_in_parallel(args_list, max_jobs):
+  """Runs _read_make_sections for each in |args_list| in parallel.
+
+  At most |max_jobs| make processes run at once, and their outputs are parsed
+  in the order they complete. make runs only once for the same makefile and
+  variables. Returns the list of the results in the order of |args_list|.
+  """
+  job_list = [_MakeJob(*args) for args in args_list]
+  pending_jobs = collections.OrderedDict()
+  for job in job_list:
+    if job.sections is None:
+      pending_jobs.setdefault(job.get_make_key(), []).append(job)
+  if not pending_jobs:
+    return [job.sections for job in job_list]
+
+  with concurrent.ThreadPoolExecutor(
+      max_workers=min(max_jobs, len(pending_jobs)), daemon=True) as executor:
+    future_map = {}
+    for same_jobs in pending_jobs.itervalues():
+      future = executor.submit(
+          _invoke_make, same_jobs[0].main_makefile, same_jobs[0].env)
+      future_map[future] = same_jobs
+    not_done = set(future_map)
+    while not_done:
+      done, not_done = concurrent.wait(
+          not_done, return_when=concurrent.FIRST_COMPLETED)
+      for future in done:
+        # This re-raises the exception in _invoke_make, if any.
+        stdout, stderr = future.result()
+        same_jobs = future_map[future]
+        same_jobs[0].finish(stdout, stderr)
+        for job in same_jobs[1:]:
+          # The filters modify the variables, so give each job its own copy.
+          job.sections = marshal.loads(marshal.dumps(same_jobs[0].sections))
+  return [job.sections for job in job_list]
 
 
 def _filter_var_name(name):
@@ -2601,6 +2816,35 @@ class MakefileNinjaTranslator:
     self._generate()
     return self
 
+  @staticmethod
+  def prefetch(translators, max_jobs=_DEFAULT_PARALLEL_MAKE_JOBS):
+    """Runs make for |translators| in parallel, ahead of generate().
+
+    make for each translator is run in a separate process, so a config.py
+    with many translators can overlap them. At most |max_jobs| make processes
+    run at once.
+    """
+    translators = [translator for translator in translators
+                   if translator._vars_list is None]
+    if OPTIONS.verbose():
+      for translator in translators:
+        print 'Converting ' + translator._in_file
+    sections_list = _read_make_sections_in_parallel(
+        [(translator._workdir, translator._in_file, translator._extra_env_vars)
+         for translator in translators], max_jobs)
+    for translator, sections in zip(translators, sections_list):
+      translator._vars_list = [MakeVars(*section) for section in sections]
+
+  @staticmethod
+  def generate_all(translators, max_jobs=_DEFAULT_PARALLEL_MAKE_JOBS):
+    """Runs make for |translators| in parallel, and generates them in order.
+
+    The filters need to be set up with transform() in advance.
+    """
+    MakefileNinjaTranslator.prefetch(translators, max_jobs)
+    for translator in translators:
+      translator.generate()
+
   def _build_vars_list(self):
     if self._vars_list is None:
       if OPTIONS.verbose():
@@ -2701,28 +2945,9 @@ class MakefileNinjaTranslator:
 
   @staticmethod
   def _read_modules(workdir, file_name, extra_env_vars):
-    make_output_lines = _run_make(workdir, file_name, extra_env_vars)
-
-    vars_list = []
-    build_type = ''
-    build_file = ''
-    build_lines = []
-    for line in make_output_lines:
-      if line.startswith(_VARS_PREFIX):
-        if build_type:
-          # Generate ninja for the previous lines
-          raw_vars = _parse_vars(build_lines)
-          vars_list += [MakeVars(build_type, build_file, raw_vars)]
-        line = line[len(_VARS_PREFIX):]
-        build_type, build_file = line.split(' ')
-        build_lines = []
-        continue
-      build_lines.append(line)
-    if build_type:
-      # Generate ninja for the previous lines
-      raw_vars = _parse_vars(build_lines)
-      vars_list += [MakeVars(build_type, build_file, raw_vars)]
-    return vars_list
+    return [MakeVars(build_type, build_file, raw_vars)
+            for build_type, build_file, raw_vars
+            in _read_make_sections(workdir, file_name, extra_env_vars)]
 
 
 def run(path):
@@ -4,9 +4,15 @@
 
 """Unittests for make_to_ninja.py."""
 
+import os
+import tempfile
 import unittest
 
+import mock
+
+from src.build import file_list_cache
 from src.build import make_to_ninja
+from src.build.util import file_util
 
 
 class MakeToNinjaUnittest(unittest.TestCase):
@@ -38,5 +44,87 @@ class MakeToNinjaUnittest(unittest.TestCase):
     self.assertFalse(flags.has_flag('cba'))
 
 
+class MakeOutputCacheUnittest(unittest.TestCase):
+  def setUp(self):
+    self._tmpdir = tempfile.mkdtemp()
+    self._workdir = os.path.join(self._tmpdir, 'workdir')
+    self._makefile = os.path.join(self._workdir, 'Android.mk')
+    os.mkdir(self._workdir)
+    self._write_makefile('include $(BUILD_SHARED_LIBRARY)')
+
+  def tearDown(self):
+    file_util.rmtree(self._tmpdir, ignore_errors=True)
+    make_to_ninja._file_hash_cache.clear()
+
+  def _write_makefile(self, content):
+    with open(self._makefile, 'w') as f:
+      f.write(content)
+    make_to_ninja._file_hash_cache.clear()
+
+  def _create_cache(self):
+    listing = file_list_cache.FileListCache(
+        file_list_cache.Query([self._workdir], None, None, True))
+    listing.refresh_cache()
+    sections = [('shared_library', self._makefile, {'LOCAL_MODULE': 'libfoo'})]
+    return make_to_ninja.MakeOutputCache(
+        [(self._makefile, make_to_ninja._get_file_hash(self._makefile))],
+        listing, sections)
+
+  def testSaveAndLoad(self):
+    cache_path = os.path.join(self._tmpdir, 'cache', 'entry')
+    self._create_cache().save_to_file(cache_path)
+    cache = make_to_ninja._load_make_output_cache(cache_path)
+    self.assertTrue(cache.check_freshness())
+    self.assertEquals(
+        [('shared_library', self._makefile, {'LOCAL_MODULE': 'libfoo'})],
+        cache.sections)
+    self.assertIsNone(make_to_ninja._load_make_output_cache(
+        os.path.join(self._tmpdir, 'cache', 'nonexistent')))
+
+  def testFreshness(self):
+    cache = self._create_cache()
+    self.assertTrue(cache.check_freshness())
+
+    # Updating the content of the makefile makes the cache stale.
+    self._write_makefile('include $(BUILD_STATIC_LIBRARY)')
+    self.assertFalse(cache.check_freshness())
+
+    # Adding a file in the working directory makes the cache stale.
+    cache = self._create_cache()
+    open(os.path.join(self._workdir, 'foo.c'), 'w').close()
+    os.utime(self._workdir, (0, 0xffffffff))
+    self.assertFalse(cache.check_freshness())
+
+
+def _fake_invoke_make(main_makefile, env):
+  return 'output of ' + main_makefile, ''
+
+
+class ParallelMakeUnittest(unittest.TestCase):
+  @mock.patch('src.build.make_to_ninja.OPTIONS',
+              mock.Mock(**{'enable_config_cache.return_value': False}))
+  @mock.patch('src.build.make_to_ninja._get_make_env', dict)
+  @mock.patch('src.build.make_to_ninja._split_make_output',
+              lambda lines: [('shared_library', lines[0], {})])
+  @mock.patch('src.build.make_to_ninja._filter_make_output',
+              lambda workdir, stdout, stderr, in_file, submakes: [stdout])
+  @mock.patch('src.build.make_to_ninja._invoke_make',
+              side_effect=_fake_invoke_make)
+  @mock.patch('src.build.make_to_ninja._create_main_makefile',
+              lambda in_file, extra_env_vars: in_file)
+  def testReadMakeSectionsInParallel(self, invoke_make):
+    args_list = [('a', 'a/Android.mk', None),
+                 ('b', 'b/Android.mk', None),
+                 ('a', 'a/Android.mk', None)]
+    result = make_to_ninja._read_make_sections_in_parallel(args_list, 2)
+    self.assertEquals(
+        [[('shared_library', 'output of a/Android.mk', {})],
+         [('shared_library', 'output of b/Android.mk', {})],
+         [('shared_library', 'output of a/Android.mk', {})]], result)
+    # make runs only once for the same makefile, but each result is a copy.
+    self.assertEquals(2, invoke_make.call_count)
+    self.assertIsNot(result[0][0][2], result[2][0][2])
+
+
 if __name__ == '__main__':
   unittest.main()
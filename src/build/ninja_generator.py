@@ -20,13 +20,13 @@ import traceback
 
 import ninja_syntax
 
-from src.build import analyze_diffs
 from src.build import build_common
 from src.build import ninja_generator_runner
 from src.build import notices
 from src.build import open_source
 from src.build import staging
 from src.build import toolchain
+from src.build import tracking_path_cache
 from src.build import wrapped_functions
 from src.build.build_options import OPTIONS
 from src.build.util import file_util
@@ -408,7 +408,7 @@ class NinjaGenerator(ninja_syntax.Writer):
     # Setting restat to True so that ninja can stop building its dependents
     # when the content is not modified.
     n.rule('mktoc',
-           'src/build/make_table_of_contents.py $target $in $out',
+           'src/build/make_table_of_contents.py $in $out',
            description='make_table_of_contents $in',
            restat=True)
 
@@ -454,9 +454,21 @@ class NinjaGenerator(ninja_syntax.Writer):
     return canon
 
   def emit(self):
-    """Emits the contents of ninja script to the file."""
-    with open(self._ninja_path, 'w') as f:
-      f.write(self.output.getvalue())
+    """Emits the contents of ninja script to the file.
+
+    The file is not rewritten if it already has the same content, so that its
+    mtime shows when it was actually changed. Returns True if the file is
+    written.
+    """
+    return file_util.write_atomically_if_changed(
+        self._ninja_path, self.output.getvalue())
+
+  def get_summary(self):
+    """Returns a compact record of this generator. See NinjaGeneratorSummary."""
+    return NinjaGeneratorSummary(self)
+
+  def get_generator_class(self):
+    return type(self)
 
   def add_flags(self, key, *values):
     values = [pipes.quote(x) for x in values]
@@ -624,12 +636,9 @@ class NinjaGenerator(ninja_syntax.Writer):
       if (s.startswith(build_common.OUT_DIR) and
           not s.startswith(build_common.get_staging_root())):
         continue
-      if not os.path.exists(s):
-        continue
-      with open_dependency(s, 'r', ignore_dependency=True) as f:
-        tracking_file = analyze_diffs.compute_tracking_path(None, s, f)
-        if tracking_file:
-          sources_including_tracking.append(tracking_file)
+      tracking_file = tracking_path_cache.get_cache().get_tracking_path(s)
+      if tracking_file:
+        sources_including_tracking.append(tracking_file)
     if OPTIONS.is_notices_logging():
       print 'Adding notice sources to %s: %s' % (self.get_module_name(),
                                                  sources_including_tracking)
@@ -850,7 +859,8 @@ class NinjaGenerator(ninja_syntax.Writer):
       undefined_symbol_file = os.path.join(
           self.get_symbols_path(), os.path.basename(object_file) + '.undefined')
       self.build([undefined_symbol_file], 'dump_undefined_symbols', object_file,
-                 implicit='src/build/symbol_tool.py')
+                 implicit=['src/build/symbol_tool.py',
+                           'src/build/util/elf_symbols.py'])
       for disallowed_symbol_file in disallowed_symbol_files:
         # Check the content of the |undefined_symbol_file|.
         disallowed_symbol_file_full = os.path.join(
@@ -868,7 +878,8 @@ class NinjaGenerator(ninja_syntax.Writer):
     """Returns production shared libs in the given ninja_list."""
     production_shared_libs = []
     for ninja in ninja_list:
-      if not isinstance(ninja, SharedObjectNinjaGenerator):
+      if not issubclass(ninja.get_generator_class(),
+                        SharedObjectNinjaGenerator):
         continue
       for path in ninja.production_shared_library_list:
         production_shared_libs.append(build_common.get_build_dir() + path)
@@ -957,6 +968,90 @@ class NinjaGenerator(ninja_syntax.Writer):
               'native_client/src/trusted/validator/driver/ncval_annotate.py'))
 
 
+class NinjaGeneratorSummary(object):
+  """Represents a NinjaGenerator whose ninja file is already emitted.
+
+  A task in ninja_generator_runner emits the ninja files by itself, and returns
+  this instead of the NinjaGenerator, which holds the whole content of the
+  ninja file. This holds only what is needed to verify the generated ninjas,
+  and to generate the ninjas depending on them (such as notices, test lists and
+  the top level build.ninja). The attribute names follow NinjaGenerator, as
+  they are referred to by the methods which take a list of generators.
+  """
+
+  def __init__(self, ninja):
+    self._module_name = ninja.get_module_name()
+    self._ninja_name = ninja._ninja_name
+    self._ninja_path = ninja.get_ninja_path()
+    self._is_host = ninja.is_host()
+    self._use_global_scope = ninja._use_global_scope
+    self._generator_class = ninja.get_generator_class()
+    self._output_path_list = ninja.get_output_path_list()
+    self._root_dir_install_targets = ninja._root_dir_install_targets
+    self._is_installed = bool(ninja.is_installed())
+    self._notices_install_path = ninja.get_notices_install_path()
+    self._notices = ninja._notices
+    self._notice_archive = ninja.get_notice_archive()
+    self._included_module_names = ninja.get_included_module_names()
+    self._test_lists = ninja._test_lists
+    self._test_info_list = ninja._test_info_list
+    self._build_rule_list = NinjaGeneratorSummary._merge_build_rules(
+        ninja._build_rule_list)
+    self.production_shared_library_list = getattr(
+        ninja, 'production_shared_library_list', [])
+    # For ArchiveNinjaGenerator.verify_usage().
+    self._shared_deps = getattr(ninja, '_shared_deps', [])
+    self._enable_libcxx = getattr(ninja, '_enable_libcxx', False)
+    self._instances = getattr(ninja, '_instances', None)
+
+  @staticmethod
+  def _merge_build_rules(build_rule_list):
+    """Merges build rules having the same target groups.
+
+    This does not change the target group rules, as _TargetGroups just takes
+    the union of the outputs and the inputs for each target group.
+    """
+    merged = {}
+    for target_groups, outputs, inputs in build_rule_list:
+      key = frozenset(target_groups)
+      if key not in merged:
+        merged[key] = (set(), set())
+      merged[key][0].update(outputs)
+      merged[key][1].update(inputs)
+    return [(set(target_groups), outputs, inputs)
+            for target_groups, (outputs, inputs) in merged.iteritems()]
+
+  def get_summary(self):
+    return self
+
+  def get_generator_class(self):
+    return self._generator_class
+
+  def is_host(self):
+    return self._is_host
+
+  def get_module_name(self):
+    return self._module_name
+
+  def get_ninja_path(self):
+    return self._ninja_path
+
+  def get_output_path_list(self):
+    return self._output_path_list
+
+  def is_installed(self):
+    return self._is_installed
+
+  def get_notices_install_path(self):
+    return self._notices_install_path
+
+  def get_notice_archive(self):
+    return self._notice_archive
+
+  def get_included_module_names(self):
+    return self._included_module_names
+
+
 class CNinjaGenerator(NinjaGenerator):
   """Encapsulates ninja file generation for C and C++ files.
 
@@ -1911,6 +2006,13 @@ class TopLevelNinjaGenerator(NinjaGenerator):
   def _get_depfile_path(self):
     return self._ninja_path + '.dep'
 
+  def emit(self):
+    # build.ninja is the output of the regen_ninja rule, which is not restat.
+    # Always write it, so that ninja does not find it older than the inputs of
+    # the rule and regenerate it again.
+    file_util.write_atomically(self._ninja_path, self.output.getvalue())
+    return True
+
   # TODO(crbug.com/177699): Improve ninja regeneration rule generation.
   def _emit_ninja_regeneration_rules(self):
     # Add rule/target to regenerate all ninja files we built this time
@@ -2253,12 +2355,8 @@ class SharedObjectNinjaGenerator(CNinjaGenerator):
     # TODO(crbug.com/364344): Once Renderscript is built from source, remove.
     if self._notices_only:
       return intermediate_so
-    if self._is_host and OPTIONS.is_arm():
-      # nm for ARM can't dump host binary, ignore building a TOC file then.
-      return intermediate_so
     if OPTIONS.is_nacl_build() and not self._is_host:
       self.ncval_test(intermediate_so)
-    mktoc_target = 'host' if self._is_host else OPTIONS.target()
     if self._install_path is not None:
       install_so = os.path.join(self._install_path, basename_so)
       self.install_to_build_dir(install_so, intermediate_so)
@@ -2268,15 +2366,15 @@ class SharedObjectNinjaGenerator(CNinjaGenerator):
       # Create TOC file next to the installed shared library.
       self.build(self._get_toc_file_for_so(install_so),
                  'mktoc', self._rebase_to_build_dir(install_so),
-                 implicit='src/build/make_table_of_contents.py',
-                 variables={'target': mktoc_target})
+                 implicit=['src/build/make_table_of_contents.py',
+                           'src/build/util/elf_symbols.py'])
     else:
       # Create TOC file next to the intermediate shared library if the shared
       # library is not to be installed. E.g. host binaries are not installed.
       self.build(self.get_build_path(basename_so + '.TOC'),
                  'mktoc', intermediate_so,
-                 implicit='src/build/make_table_of_contents.py',
-                 variables={'target': mktoc_target})
+                 implicit=['src/build/make_table_of_contents.py',
+                           'src/build/util/elf_symbols.py'])
 
     # Make sure |intermediate_so| contain neither 'disallowed_symbols.defined'
     # symbols nor libchromium_base.a symbols, but the check is unnecessary for
@@ -4135,14 +4233,20 @@ class PythonTestNinjaGenerator(NinjaGenerator):
   # ARC has its main package of Python code here.
   _ARC_PYTHON_PATH = 'src/build'
 
+  _TEST_SERVER_PATH = 'src/build/python_test_server.py'
+
   @staticmethod
   def emit_common_rules(n):
-    # We run the test using the -m option to get consistent behavior with
+    # The test is run as "python -m unittest" to get consistent behavior with
     # imports. If we ran it with "python $in", the path to the file would be
     # automatically added to sys.path, when normally that path may not be in it.
+    # python_test_server.py forks the process from a server which has the
+    # common modules preloaded, or runs the test by itself if the server is not
+    # running.
     n.rule('run_python_test',
-           ('$pythonpath python src/build/run_python -m unittest '
-            'discover --verbose $test_path $test_name $base_run_path ' +
+           ('$pythonpath python src/build/run_python %s run '
+            'discover --verbose $test_path $test_name $base_run_path ' %
+            PythonTestNinjaGenerator._TEST_SERVER_PATH +
             build_common.get_test_output_handler()),
            description='run_python_test $in')
 
@@ -4172,7 +4276,8 @@ class PythonTestNinjaGenerator(NinjaGenerator):
 
     # Add the discovered python dependencies to the list of dependencies.
     implicit = (build_common.as_list(implicit) + python_dependencies +
-                ['src/build/run_python'])
+                ['src/build/run_python',
+                 PythonTestNinjaGenerator._TEST_SERVER_PATH])
 
     # Generate an output file that holds the results (and so it can be updated
     # by the build system when dirty).
@@ -2,12 +2,19 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import errno
 import logging
+import marshal
 import multiprocessing
+import os
 import time
 import traceback
 
 from src.build.util import concurrent
+from src.build.util import file_util
+
+
+_TASK_DURATION_VERSION = 0
 
 
 # Represents an individual task to run on |ninja_generator_runner|.
@@ -30,6 +37,74 @@ class GeneratorTask:
       self.function = generator_task
       self.args = []
 
+  def get_key(self):
+    """Returns a string to identify the task across configure runs.
+
+    Only the arguments which are stable among runs (strings, numbers and None)
+    are taken into the key. Other arguments, such as a list of production
+    shared libraries, are replaced with '...'.
+    """
+    args = [repr(arg) if arg is None or isinstance(arg, (basestring, int))
+            else '...' for arg in self.args]
+    return '%s.%s(%s)' % (self.function.__module__, self.function.__name__,
+                          ', '.join(args))
+
+
+class TaskDurationHistory(object):
+  """Records the duration of each GeneratorTask across configure runs.
+
+  The durations are used to run the longest tasks first (so-called LPT
+  scheduling), so that a few slow tasks are not left running alone at the end
+  of the phase, and to estimate the critical path of the phase.
+  """
+
+  def __init__(self, durations=None):
+    self._durations = durations or {}
+
+  def get_duration(self, key):
+    """Returns the recorded duration of the task, or None if unknown."""
+    return self._durations.get(key)
+
+  def set_duration(self, key, duration):
+    self._durations[key] = duration
+
+  def sort_task_list(self, task_list):
+    """Returns |task_list| sorted in the order of the expected duration.
+
+    Tasks which have never been run are placed at first, as they may be slow.
+    """
+    def _get_sort_key(generator_task):
+      duration = self.get_duration(generator_task.get_key())
+      return (duration is not None, -(duration or 0))
+    return sorted(task_list, key=_get_sort_key)
+
+  def to_dict(self):
+    return {'version': _TASK_DURATION_VERSION, 'durations': self._durations}
+
+  def save_to_file(self, path):
+    file_util.makedirs_safely(os.path.dirname(path))
+    file_util.generate_file_atomically(
+        path, lambda f: marshal.dump(self.to_dict(), f))
+
+
+def load_task_duration_history(path):
+  """Loads TaskDurationHistory from |path|.
+
+  Returns an empty history if the file does not exist or is stale.
+  """
+  try:
+    with open(path) as f:
+      data = marshal.load(f)
+  except (EOFError, ValueError, TypeError):
+    data = None
+  except IOError as e:
+    if e.errno != errno.ENOENT:
+      raise
+    data = None
+  if not data or data.get('version') != _TASK_DURATION_VERSION:
+    return TaskDurationHistory()
+  return TaskDurationHistory(data['durations'])
+
 
 # This is used to request back from a sub process to the parent process
 # to request to run tasks in parallel. Available only under _run_task.
@@ -69,7 +144,8 @@ def _run_task(generator_task):
 
   At the beginning of the task, |_ninja_list| and |__request_task_list| must be
   None. In NinjaGenerator's ctor, the instance will be stored in the
-  |_ninja_list| via register_ninja(), and this function returns it (to parent
+  |_ninja_list| via register_ninja(). At the end of the task, this function
+  emits their ninja files, and returns their NinjaGeneratorSummary (to parent
   process) as a result.
   Instead of creating NinjaGenerator, generate_ninja() and
   generate_test_ninja() can call request_run_in_parallel(). Then, this function
@@ -96,16 +172,23 @@ def _run_task(generator_task):
       logging.info('Slow task: %s.%s %0.3fs',
                    function.__module__, function.__name__, elapsed_time)
 
+    # Emit the ninja files here, and return only their summaries, to avoid
+    # sending the whole NinjaGenerator instances to the parent process.
+    for ninja in _ninja_list:
+      ninja.emit()
+    ninja_summary_list = [ninja.get_summary() for ninja in _ninja_list]
+
     # Extract the result from global variables.
     task_list = [GeneratorTask(context, requested_task)
                  for requested_task in __request_task_list]
-    result = context.make_result(_ninja_list) if _ninja_list else None
+    result = (context.make_result(ninja_summary_list)
+              if ninja_summary_list else None)
 
     # At the moment, it is prohibited 1) to return NinjaGenerator and
     # 2) to request to run ninja generators back to the parent process, at the
     # same time.
     assert (not result or not task_list)
-    return (result, task_list)
+    return (result, task_list, elapsed_time)
   except BaseException:
     if multiprocessing.current_process().name == 'MainProcess':
       # Just raise the exception up the single process, single thread
@@ -126,54 +209,167 @@ def _run_task(generator_task):
     __request_task_list = None
 
 
-def run_in_parallel(task_list, maximum_jobs):
-  """Runs task_list in parallel on multiprocess.
+def _get_critical_path(task_key, duration_map, children_map):
+  """Returns the longest chain of the durations from |task_key|."""
+  children = children_map.get(task_key, [])
+  return duration_map.get(task_key, 0) + max(
+      [_get_critical_path(child, duration_map, children_map)
+       for child in children] or [0])
+
+
+def _log_schedule_estimate(root_key_list, duration_map, children_map,
+                           maximum_jobs, elapsed_time):
+  """Logs the critical path estimate of the tasks run by run_in_parallel."""
+  if not duration_map:
+    return
+  critical_path = max(
+      _get_critical_path(key, duration_map, children_map)
+      for key in root_key_list)
+  total_time = sum(duration_map.itervalues())
+  lower_bound = max(critical_path, total_time / max(maximum_jobs, 1))
+  logging.info('Generator tasks: %d tasks, total %0.3fs, critical path '
+               '%0.3fs, lower bound %0.3fs, actual %0.3fs',
+               len(duration_map), total_time, critical_path, lower_bound,
+               elapsed_time)
+
+
+class _TaskBatch(object):
+  """A set of tasks started by GeneratorTaskRunner.start().
 
-  Returns a list of NinjaGenerator created in subprocesses.
-  If |maximum_jobs| is set to 0, this function runs the ninja generation
-  synchronously in process.
+  The tasks requested back by running tasks via request_run_in_parallel() are
+  submitted to the same executor, and belong to the same batch.
   """
-  if maximum_jobs == 0:
-    executor = concurrent.SynchronousExecutor()
-  else:
-    executor = concurrent.ProcessPoolExecutor(max_workers=maximum_jobs)
-
-  result_list = []
-  with executor:
-    try:
-      # Submit initial tasks.
-      not_done = {executor.submit(_run_task, generator_task)
-                  for generator_task in task_list}
-      while not_done:
-        # Wait any task is completed.
-        done, not_done = concurrent.wait(
-            not_done, return_when=concurrent.FIRST_COMPLETED)
-
-        for completed_future in done:
-          if completed_future.exception():
-            # An exception is raised in a task. Cancel remaining tasks and
-            # re-raise the exception.
-            for future in not_done:
-              future.cancel()
-            not_done = []
-            raise completed_future.exception()
-
-          # The task is completed successfully. Process the result.
-          result, request_task_list = completed_future.result()
-          if request_task_list:
-            # If sub tasks are requested, submit them.
-            assert not result
-            not_done.update(
-                executor.submit(_run_task, generator_task)
-                for generator_task in request_task_list)
-            continue
-
-          if result:
-            result_list.append(result)
-    except:
+
+  def __init__(self, executor, maximum_jobs, task_list, duration_history_path):
+    self._executor = executor
+    self._maximum_jobs = maximum_jobs
+    self._duration_history_path = duration_history_path
+    if duration_history_path:
+      self._history = load_task_duration_history(duration_history_path)
+    else:
+      self._history = TaskDurationHistory()
+    self._future_key_map = {}
+    self._duration_map = {}
+    self._children_map = {}
+    self._start_time = time.time()
+    # Submit initial tasks.
+    self._not_done = set(self._submit_task_list(task_list))
+    self._root_key_list = [self._future_key_map[future]
+                           for future in self._not_done]
+
+  def _submit_task_list(self, generator_task_list):
+    # The workers take the tasks from a shared queue in the submission order,
+    # so submitting the longest tasks first is enough to balance the load.
+    future_list = []
+    for generator_task in self._history.sort_task_list(generator_task_list):
+      future = self._executor.submit(_run_task, generator_task)
+      self._future_key_map[future] = generator_task.get_key()
+      future_list.append(future)
+    return future_list
+
+  def cancel(self):
+    for future in self._not_done:
+      future.cancel()
+    self._not_done = set()
+
+  def wait(self):
+    """Waits for all the tasks in the batch, and returns their results."""
+    result_list = []
+    while self._not_done:
+      # Wait any task is completed.
+      done, self._not_done = concurrent.wait(
+          self._not_done, return_when=concurrent.FIRST_COMPLETED)
+
+      for completed_future in done:
+        if completed_future.exception():
+          # An exception is raised in a task. Cancel remaining tasks and
+          # re-raise the exception.
+          self.cancel()
+          raise completed_future.exception()
+
+        # The task is completed successfully. Process the result.
+        result, request_task_list, elapsed_time = completed_future.result()
+        key = self._future_key_map.pop(completed_future)
+        self._duration_map[key] = elapsed_time
+        self._history.set_duration(key, elapsed_time)
+        if request_task_list:
+          # If sub tasks are requested, submit them.
+          assert not result
+          future_list = self._submit_task_list(request_task_list)
+          self._children_map[key] = [self._future_key_map[future]
+                                     for future in future_list]
+          self._not_done.update(future_list)
+          continue
+
+        if result:
+          result_list.append(result)
+
+    _log_schedule_estimate(self._root_key_list, self._duration_map,
+                           self._children_map, self._maximum_jobs,
+                           time.time() - self._start_time)
+    if self._duration_history_path:
+      self._history.save_to_file(self._duration_history_path)
+    return result_list
+
+
+class GeneratorTaskRunner(object):
+  """Runs GeneratorTasks on a pool of worker processes.
+
+  The pool is created once and reused for all the batches of tasks started
+  with the runner, so that the worker processes are forked only once during
+  configure. Note that the workers are forked when the runner is created, so
+  the state the tasks rely on (such as loaded config modules) must be set up
+  in advance.
+  If |maximum_jobs| is set to 0, the tasks are run synchronously in process.
+
+  The runner must be used in a with-statement. If an exception is raised in
+  the statement, the running workers are terminated.
+  """
+
+  def __init__(self, maximum_jobs):
+    self._maximum_jobs = maximum_jobs
+    if maximum_jobs == 0:
+      self._executor = concurrent.SynchronousExecutor()
+    else:
+      self._executor = concurrent.ProcessPoolExecutor(max_workers=maximum_jobs)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is not None and isinstance(
+        self._executor, concurrent.ProcessPoolExecutor):
       # An exception is raised. Terminate the running workers.
-      if isinstance(executor, concurrent.ProcessPoolExecutor):
-        executor.terminate()
-      raise
+      self._executor.terminate()
+    self._executor.shutdown(wait=True)
+
+  def start(self, task_list, duration_history_path=None):
+    """Starts running |task_list| on the workers.
 
-  return result_list
+    Returns a batch object, whose wait() returns the list of the results made
+    by the tasks' contexts. The caller can do other work in the main process
+    until it calls wait().
+    If |duration_history_path| is given, the duration of each task recorded in
+    the previous runs is loaded from the file, and the tasks are submitted in
+    the order of the longest first. The durations of this run are saved back
+    to the file.
+    """
+    return _TaskBatch(self._executor, self._maximum_jobs, task_list,
+                      duration_history_path)
+
+  def run(self, task_list, duration_history_path=None):
+    """Runs |task_list| and returns the list of the results."""
+    return self.start(task_list, duration_history_path).wait()
+
+
+def run_in_parallel(task_list, maximum_jobs, duration_history_path=None):
+  """Runs task_list in parallel on multiprocess.
+
+  Returns a list of the results made by the tasks' contexts, each of which
+  holds NinjaGeneratorSummary of NinjaGenerator created in subprocesses. The
+  ninja files are already emitted.
+  This creates a new pool of workers. Use GeneratorTaskRunner to run multiple
+  sets of tasks on the same pool. See GeneratorTaskRunner for the arguments.
+  """
+  with GeneratorTaskRunner(maximum_jobs) as runner:
+    return runner.run(task_list, duration_history_path)
@@ -0,0 +1,111 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unittests for ninja_generator_runner.py."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.build import ninja_generator_runner
+
+
+class _FakeContext(object):
+  def set_up(self):
+    pass
+
+  def tear_down(self):
+    pass
+
+  def make_result(self, ninja_list):
+    return ninja_list
+
+
+def _fast_task(name):
+  pass
+
+
+def _slow_task(name):
+  pass
+
+
+def _parent_task():
+  ninja_generator_runner.request_run_in_parallel(
+      (_fast_task, 'child1'), (_slow_task, 'child2'))
+
+
+def _ninja_task(name):
+  ninja_generator_runner.register_ninja(_FakeNinja(name))
+
+
+class _FakeNinja(object):
+  def __init__(self, name):
+    self._name = name
+
+  def emit(self):
+    pass
+
+  def get_summary(self):
+    return self._name
+
+
+def _make_task(function, *args):
+  return ninja_generator_runner.GeneratorTask(
+      _FakeContext(), (function,) + args)
+
+
+class TaskDurationHistoryTest(unittest.TestCase):
+  def setUp(self):
+    self._tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self._tmpdir)
+
+  def testGetKey(self):
+    self.assertEquals(
+        __name__ + '._fast_task(\'a\', 1, None, ...)',
+        _make_task(_fast_task, 'a', 1, None, ['lib.so']).get_key())
+
+  def testSortTaskList(self):
+    fast = _make_task(_fast_task, 'x')
+    slow = _make_task(_slow_task, 'x')
+    unknown = _make_task(_fast_task, 'y')
+    history = ninja_generator_runner.TaskDurationHistory()
+    history.set_duration(fast.get_key(), 0.1)
+    history.set_duration(slow.get_key(), 5.0)
+    self.assertEquals([unknown, slow, fast],
+                      history.sort_task_list([fast, unknown, slow]))
+
+  def testSaveAndLoad(self):
+    path = os.path.join(self._tmpdir, 'durations')
+    history = ninja_generator_runner.load_task_duration_history(path)
+    self.assertIsNone(history.get_duration('key'))
+    history.set_duration('key', 1.5)
+    history.save_to_file(path)
+    history = ninja_generator_runner.load_task_duration_history(path)
+    self.assertEquals(1.5, history.get_duration('key'))
+
+  def testRunInParallelRecordsDurations(self):
+    path = os.path.join(self._tmpdir, 'durations')
+    ninja_generator_runner.run_in_parallel(
+        [_make_task(_parent_task)], 0, path)
+    history = ninja_generator_runner.load_task_duration_history(path)
+    for task in (_make_task(_parent_task),
+                 _make_task(_fast_task, 'child1'),
+                 _make_task(_slow_task, 'child2')):
+      self.assertIsNotNone(history.get_duration(task.get_key()))
+
+
+class GeneratorTaskRunnerTest(unittest.TestCase):
+  def testRunMultipleBatches(self):
+    with ninja_generator_runner.GeneratorTaskRunner(0) as runner:
+      batch = runner.start([_make_task(_ninja_task, 'a'),
+                            _make_task(_ninja_task, 'b')])
+      self.assertEquals([['a'], ['b']], sorted(batch.wait()))
+      self.assertEquals([['c']], runner.run([_make_task(_ninja_task, 'c')]))
+
+
+if __name__ == '__main__':
+  unittest.main()
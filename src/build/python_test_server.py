@@ -0,0 +1,375 @@
+#!src/build/run_python
+
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Runs Python unittests in processes forked from a preloaded server.
+
+Each run_python_test step used to start a fresh interpreter, which spends most
+of its time importing src.build modules before running a few tests. This
+script runs a daemon which imports the common modules once, and forks a child
+for each test run requested. The child sets up the cwd, environment and
+sys.path of the requester, and runs 'python -m unittest' as a fresh process
+would, so each test still runs in its own process.
+
+The run_python_test rule runs this script with 'run', which is a thin client
+of the daemon. If the daemon is not running, or cannot serve the request as
+a fresh process would, e.g. the request has a different PYTHONPATH or a
+preloaded module has been modified, the client runs the tests by itself.
+The daemon restarts itself when it finds a preloaded module modified.
+
+Usage:
+  src/build/python_test_server.py start
+  src/build/python_test_server.py status
+  src/build/python_test_server.py stop
+  src/build/python_test_server.py run <unittest discover args>
+"""
+
+# Only the standard modules light to import are imported here, so that the
+# client starts quickly. The modules of the project are imported in _serve().
+import errno
+import marshal
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+_VERSION = 0
+
+_READ_SIZE = 65536
+
+# Seconds to wait for the daemon to start.
+_START_TIMEOUT = 30
+
+# The modules imported by most of the tests. They must not depend on the cwd
+# or the environment when imported, as the ones of the request are set up after
+# the modules are imported.
+_PRELOAD_MODULES = [
+    'src.build.build_common',
+    'src.build.build_options',
+    'src.build.ninja_generator',
+    'src.build.util.file_util',
+    'mock',
+    'unittest',
+]
+
+_ARC_ROOT = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), '..', '..'))
+
+
+def _get_socket_path():
+  return os.path.join(_ARC_ROOT, 'out', 'python_test_server.sock')
+
+
+def _get_log_path():
+  return os.path.join(_ARC_ROOT, 'out', 'python_test_server.log')
+
+
+def _get_source_path(path):
+  """Returns the path of the source file of a module loaded from |path|."""
+  base, ext = os.path.splitext(path)
+  if ext in ('.pyc', '.pyo'):
+    return base + '.py'
+  return path
+
+
+def _get_module_mtimes():
+  """Returns a dict from the source file of each loaded module to its mtime.
+
+  Only the modules in the project are returned, as the others are not expected
+  to be modified while building.
+  """
+  mtimes = {}
+  for module in sys.modules.values():
+    path = getattr(module, '__file__', None)
+    if not path:
+      continue
+    path = _get_source_path(os.path.abspath(path))
+    if not path.startswith(_ARC_ROOT + '/') or path in mtimes:
+      continue
+    try:
+      mtimes[path] = os.stat(path).st_mtime
+    except OSError:
+      mtimes[path] = None
+  return mtimes
+
+
+def _receive_all(connection):
+  data = []
+  while True:
+    chunk = connection.recv(_READ_SIZE)
+    if not chunk:
+      return ''.join(data)
+    data.append(chunk)
+
+
+def _run_unittest(request):
+  """Runs 'python -m unittest' for |request| in this process.
+
+  Returns the exit status.
+  """
+  os.chdir(request['cwd'])
+  os.environ.clear()
+  os.environ.update(request['env'])
+  # 'python -m' puts the current directory at the head of sys.path, instead of
+  # the directory of the script.
+  sys.path[:] = [''] + request['sys_path'][1:]
+  sys.argv = ['python -m unittest'] + request['args']
+  # Children forked from the same parent share the state of the generator.
+  random.seed()
+
+  output = os.open(request['output_path'], os.O_WRONLY | os.O_TRUNC)
+  os.dup2(output, sys.stdout.fileno())
+  os.dup2(output, sys.stderr.fileno())
+  os.close(output)
+  null = os.open(os.devnull, os.O_RDONLY)
+  os.dup2(null, sys.stdin.fileno())
+  os.close(null)
+
+  import unittest
+  try:
+    unittest.main(module=None)
+  except SystemExit as e:
+    if e.code is None:
+      return 0
+    if isinstance(e.code, int):
+      return e.code
+    sys.stderr.write('%s\n' % e.code)
+    return 1
+  except BaseException:
+    import traceback
+    traceback.print_exc()
+    return 1
+  finally:
+    sys.stdout.flush()
+    sys.stderr.flush()
+  return 0
+
+
+class _Server(object):
+  """Forks a child to run the tests for each request.
+
+  |module_mtimes| is the mtime of each module loaded in this process, which is
+  checked to see if the modules preloaded are still fresh. |sys_path| is the
+  sys.path the clients need to have to be served.
+  """
+
+  def __init__(self, module_mtimes, sys_path):
+    self._module_mtimes = module_mtimes
+    self._sys_path = sys_path
+    self._pythonpath = os.environ.get('PYTHONPATH')
+    self._cwd = os.getcwd()
+
+  def is_stale(self):
+    """Returns True if a module loaded in this process has been modified."""
+    for path, mtime in self._module_mtimes.iteritems():
+      try:
+        if os.stat(path).st_mtime != mtime:
+          return True
+      except OSError:
+        if mtime is not None:
+          return True
+    return False
+
+  def can_serve(self, request):
+    """Returns True if a fresh process would import the same modules."""
+    return (request['cwd'] == self._cwd and
+            request['sys_path'] == self._sys_path and
+            request['env'].get('PYTHONPATH') == self._pythonpath)
+
+  def fork_child(self, connection, request, listener=None):
+    """Forks a child which runs the tests, and sends the exit status back."""
+    pid = os.fork()
+    if pid:
+      return pid
+    status = 1
+    try:
+      if listener:
+        listener.close()
+      signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+      signal.signal(signal.SIGTERM, signal.SIG_DFL)
+      status = _run_unittest(request)
+      connection.sendall(marshal.dumps({'version': _VERSION,
+                                        'status': status}))
+    finally:
+      os._exit(status)
+
+
+def _preload_modules():
+  # Import the modules as 'python -m unittest' does, i.e. with the current
+  # directory at the head of sys.path.
+  sys.path[0] = ''
+  for name in _PRELOAD_MODULES:
+    try:
+      __import__(name)
+    except ImportError as e:
+      print 'Failed to preload %s: %s' % (name, e)
+  sys.stdout.flush()
+
+
+def _restart(server_socket):
+  server_socket.close()
+  os.unlink(_get_socket_path())
+  os.execv(sys.executable, [sys.executable, os.path.abspath(__file__),
+                            'serve'])
+
+
+def _serve():
+  # The sys.path before preloading is the one the clients have, as they are
+  # started in the same way.
+  sys_path = sys.path[:]
+  _preload_modules()
+  server = _Server(_get_module_mtimes(), sys_path)
+  # The children are not waited for.
+  signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+  socket_path = _get_socket_path()
+  server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    os.unlink(socket_path)
+  except OSError as e:
+    if e.errno != errno.ENOENT:
+      raise
+  server_socket.bind(socket_path)
+  server_socket.listen(64)
+  print 'Serving with %d modules preloaded' % len(sys.modules)
+  sys.stdout.flush()
+  try:
+    while True:
+      connection, _ = server_socket.accept()
+      try:
+        request = marshal.loads(_receive_all(connection))
+        if request['command'] == 'stop':
+          connection.sendall(marshal.dumps({'version': _VERSION}))
+          return
+        if request['command'] == 'status':
+          connection.sendall(marshal.dumps({'version': _VERSION,
+                                            'pid': os.getpid()}))
+          continue
+        if server.is_stale():
+          # Let the client run the tests by itself, and reload the modules.
+          print 'Restarting as preloaded modules are modified'
+          sys.stdout.flush()
+          connection.sendall(marshal.dumps({'version': _VERSION,
+                                            'status': None}))
+          connection.close()
+          _restart(server_socket)
+        if not server.can_serve(request):
+          connection.sendall(marshal.dumps({'version': _VERSION,
+                                            'status': None}))
+          continue
+        server.fork_child(connection, request, listener=server_socket)
+      finally:
+        connection.close()
+  finally:
+    server_socket.close()
+    os.unlink(socket_path)
+
+
+def _send_request(request):
+  """Sends a request to the daemon, and returns the response.
+
+  Returns None if the daemon is not running.
+  """
+  client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    try:
+      client.connect(_get_socket_path())
+    except socket.error as e:
+      if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+        return None
+      raise
+    request['version'] = _VERSION
+    client.sendall(marshal.dumps(request))
+    client.shutdown(socket.SHUT_WR)
+    data = _receive_all(client)
+  finally:
+    client.close()
+  if not data:
+    # The child exited without sending the status, e.g. by a signal.
+    return {'version': _VERSION, 'status': 1}
+  response = marshal.loads(data)
+  if response.get('version') != _VERSION:
+    return None
+  return response
+
+
+def _run_locally(args):
+  os.execv(sys.executable, [sys.executable, '-m', 'unittest'] + args)
+
+
+def _run(args):
+  """Runs the tests in a child of the daemon, or in this process."""
+  fd, output_path = tempfile.mkstemp(prefix='python_test_server-')
+  os.close(fd)
+  try:
+    response = _send_request({
+        'command': 'run',
+        'cwd': os.getcwd(),
+        'env': dict(os.environ),
+        'sys_path': sys.path,
+        'args': args,
+        'output_path': output_path,
+    })
+    if response is not None and response['status'] is not None:
+      with open(output_path) as f:
+        sys.stdout.write(f.read())
+      return response['status']
+  finally:
+    os.remove(output_path)
+  _run_locally(args)
+
+
+def _start():
+  if _send_request({'command': 'status'}) is not None:
+    print 'python_test_server is already running.'
+    return 0
+  if not os.path.isdir(os.path.dirname(_get_log_path())):
+    os.makedirs(os.path.dirname(_get_log_path()))
+  with open(_get_log_path(), 'a') as log:
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'serve'],
+        cwd=_ARC_ROOT, stdin=open(os.devnull), stdout=log,
+        stderr=subprocess.STDOUT, close_fds=True, preexec_fn=os.setsid)
+  deadline = time.time() + _START_TIMEOUT
+  while time.time() < deadline:
+    response = _send_request({'command': 'status'})
+    if response is not None:
+      print 'python_test_server is running as pid %d.' % response['pid']
+      return 0
+    time.sleep(0.1)
+  print 'python_test_server failed to start. See %s' % _get_log_path()
+  return 1
+
+
+def main():
+  # argparse is not used, as the arguments for 'run' are passed to unittest
+  # as they are.
+  command = sys.argv[1] if len(sys.argv) > 1 else None
+  if command == 'run':
+    return _run(sys.argv[2:])
+  if command == 'serve':
+    _serve()
+    return 0
+  if command == 'start':
+    return _start()
+  if command not in ('stop', 'status'):
+    print __doc__
+    return 1
+
+  response = _send_request({'command': command})
+  if response is None:
+    print 'python_test_server is not running.'
+    return 1 if command == 'status' else 0
+  if command == 'status':
+    print 'python_test_server is running as pid %d.' % response['pid']
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
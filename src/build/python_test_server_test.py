@@ -0,0 +1,94 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unittest for python_test_server.py."""
+
+import marshal
+import os
+import socket
+import sys
+import tempfile
+import unittest
+
+from src.build import python_test_server
+from src.build.util import file_util
+
+_PASSING_TEST = '''
+import unittest
+
+class FooTest(unittest.TestCase):
+  def test_foo(self):
+    self.assertEquals('bar', __import__('os').environ['FOO'])
+'''
+
+
+class PythonTestServerTest(unittest.TestCase):
+  def setUp(self):
+    self._root = tempfile.mkdtemp()
+
+  def tearDown(self):
+    file_util.rmtree(self._root, ignore_errors=True)
+
+  def _write_file(self, name, content):
+    path = os.path.join(self._root, name)
+    with open(path, 'w') as f:
+      f.write(content)
+    return path
+
+  def _run_in_child(self, server, test_name):
+    output_path = self._write_file('output.txt', '')
+    env = dict(os.environ)
+    env['FOO'] = 'bar'
+    request = {
+        'cwd': os.getcwd(),
+        'env': env,
+        'sys_path': sys.path,
+        'args': ['discover', self._root, test_name, self._root],
+        'output_path': output_path,
+    }
+    self.assertTrue(server.can_serve(request))
+    parent, child = socket.socketpair()
+    try:
+      pid = server.fork_child(child, request)
+      child.close()
+      response = marshal.loads(python_test_server._receive_all(parent))
+      os.waitpid(pid, 0)
+    finally:
+      parent.close()
+    with open(output_path) as f:
+      return response['status'], f.read()
+
+  def test_fork_child(self):
+    server = python_test_server._Server({}, sys.path)
+    self._write_file('foo_test.py', _PASSING_TEST)
+    status, output = self._run_in_child(server, 'foo_test.py')
+    self.assertEquals(0, status)
+    self.assertIn('Ran 1 test', output)
+    # The environment of the request is not leaked to this process.
+    self.assertNotEquals('bar', os.environ.get('FOO'))
+
+    self._write_file('bar_test.py', _PASSING_TEST.replace("'bar'", "'baz'"))
+    status, output = self._run_in_child(server, 'bar_test.py')
+    self.assertEquals(1, status)
+    self.assertIn('FAILED (failures=1)', output)
+
+  def test_can_serve(self):
+    server = python_test_server._Server({}, sys.path)
+    request = {'cwd': os.getcwd(), 'env': dict(os.environ),
+               'sys_path': sys.path[:]}
+    self.assertTrue(server.can_serve(request))
+    request['env']['PYTHONPATH'] = self._root
+    self.assertFalse(server.can_serve(request))
+
+  def test_is_stale(self):
+    path = self._write_file('foo.py', '')
+    server = python_test_server._Server(
+        {path: os.stat(path).st_mtime}, sys.path)
+    self.assertFalse(server.is_stale())
+    os.utime(path, (0, 0))
+    self.assertTrue(server.is_stale())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -14,9 +14,12 @@ Code to create out/staging of properly overlaid files.  All files are created
 as symlinks.
 """
 
+import argparse
 import os
+import stat
 import subprocess
 import sys
+import time
 
 from src.build import build_common
 from src.build import build_options
@@ -116,19 +119,12 @@ def third_party_to_staging(path):
   return path
 
 
-def _create_symlink(src_path, dest_dir):
-  """Creates a symlink pointing to src_path in dest_dir with the same name."""
-  os.symlink(os.path.relpath(src_path, dest_dir),
-             os.path.join(dest_dir, os.path.basename(src_path)))
+def _get_overlay_base_names(base_dir, overlays):
+  """Returns names in base_dir that should be symlinked into staging.
 
-
-def _create_overlay_base(base_dir, overlays, dest_dir):
-  """Creates symlinks to files and directories in base_dir.
-
-  This is a helper of _create_symlink_tree(). it creates symlinks to files and
-  directories in base_dir, except ones in overlays, into dest_dir.
-  "overlays" is a list of file and directory basenames in the overlay directory
-  corresponding to the given base_dir.
+  This is a helper of _plan_symlink_tree(). It returns files and directories in
+  base_dir, except ones in overlays. "overlays" is a list of file and directory
+  basenames in the overlay directory corresponding to the given base_dir.
   """
   def relevant(name):
     if base_dir != 'third_party/chromium-ppapi':
@@ -151,87 +147,179 @@ def _create_overlay_base(base_dir, overlays, dest_dir):
 
   # If there is no directory at base_dir, it means a new directory is
   # introduced under the corresponding path in mods_root of
-  # _create_symlink_tree(). Skip it.
+  # _plan_symlink_tree(). Skip it.
   if not os.path.lexists(base_dir):
-    return
+    return []
 
-  for name in os.listdir(base_dir):
-    if not relevant(name):
-      continue
-    if name == _GIT_DIR or name in overlays:
-      continue
-    _create_symlink(os.path.join(base_dir, name), dest_dir)
+  return [name for name in os.listdir(base_dir)
+          if relevant(name) and name != _GIT_DIR and name not in overlays]
 
 
-def _create_symlink_tree(mods_root, third_party_root, staging_root):
-  """Creates a symlink tree of mods_root overlaid on third_party_root.
+def _plan_symlink_tree(mods_root, third_party_root, staging_root, dirs, links):
+  """Plans a symlink tree of mods_root overlaid on third_party_root.
 
-  This method creates the symlink tree of mods_root directory (working as
-  same as recursive copy, but all files are symlinked instead of actual file
-  copy).
+  The planned tree works as same as recursive copy of mods_root directory, but
+  all files are symlinked instead of actual file copy. Directories to be
+  created are added to |dirs|, and each symlink to be created is added to
+  |links| as a map from its path to its (relative) link target. Nothing is
+  written to the file system.
 
   If third_party_root is given, each created directory is overlaid on the
   corresponding directory in third_party_root (if exists).
   For example:
   Suppose mods_root is "mods/", third_party_root is "third_party/" and
   staging_root is "out/staging/", then the symlink tree of mods/android/...
-  will be created at out/staging/android/..., with overlaying
+  will be planned at out/staging/android/..., with overlaying
   third_party/android/...
   """
-  staging_root_parent = os.path.dirname(staging_root)
-  file_util.makedirs_safely(staging_root_parent)
-
   if os.path.exists('mods/chromium-ppapi/base'):
-    # See comments in _create_overlay_base.
+    # See comments in _get_overlay_base_names.
     raise Exception('Putting headers in mods/chromium-ppapi/base will '
                     'cause code in chromium_org libbase implementation to '
                     'include headers from chromium-ppapi libbase and will '
                     'result in compilation errors or worse.')
 
-  for dirpath, dirs, fnames in os.walk(mods_root):
+  for dirpath, subdirs, fnames in os.walk(mods_root):
     # Do not track .git directory.
-    if _GIT_DIR in dirs:
-      dirs.remove(_GIT_DIR)
+    if _GIT_DIR in subdirs:
+      subdirs.remove(_GIT_DIR)
 
     relpath = os.path.relpath(dirpath, mods_root)
     dest_dir = os.path.normpath(os.path.join(staging_root, relpath))
-    if not os.path.exists(dest_dir):
-      os.mkdir(dest_dir)
+    dirs.add(dest_dir)
+    links.pop(dest_dir, None)
 
-    # Create symlinks for files.
+    # Compute the relative path from dest_dir once per directory, instead of
+    # calling os.path.relpath() for each file.
+    link_dir = os.path.relpath(dirpath, dest_dir)
     for name in fnames:
-      _create_symlink(os.path.join(dirpath, name), dest_dir)
+      links[os.path.join(dest_dir, name)] = os.path.join(link_dir, name)
 
     if third_party_root:
-      _create_overlay_base(
-          os.path.join(third_party_root, relpath), dirs + fnames, dest_dir)
+      base_dir = os.path.join(third_party_root, relpath)
+      base_link_dir = os.path.relpath(base_dir, dest_dir)
+      for name in _get_overlay_base_names(base_dir, subdirs + fnames):
+        links[os.path.join(dest_dir, name)] = os.path.join(base_link_dir, name)
 
 
-def _get_link_targets(root):
-  link_target_map = {}
-  for dirpath, dirs, fnames in os.walk(root):
-    for name in fnames:
-      link_path = os.path.join(dirpath, name)
-      # The target of the symbolic link may have been already removed,
-      # so we must not check os.path.isfile(link_path) here.
-      if os.path.islink(link_path):
-        link_target_map[link_path] = os.readlink(link_path)
-  return link_target_map
+def _scan_staging_tree(staging_root):
+  """Scans the existing staging tree without following symlinks.
+
+  Returns a tuple of (dirs, links, files), where |dirs| is a set of real
+  directories, |links| is a map from a symlink path to its link target, and
+  |files| is a set of any other entries (which staging never creates).
+  """
+  dirs = set()
+  links = {}
+  files = set()
+  if not os.path.isdir(staging_root) or os.path.islink(staging_root):
+    if os.path.lexists(staging_root):
+      files.add(staging_root)
+    return dirs, links, files
+
+  pending = [staging_root]
+  while pending:
+    dirpath = pending.pop()
+    dirs.add(dirpath)
+    for name in os.listdir(dirpath):
+      path = os.path.join(dirpath, name)
+      mode = os.lstat(path).st_mode
+      if stat.S_ISLNK(mode):
+        links[path] = os.readlink(path)
+      elif stat.S_ISDIR(mode):
+        pending.append(path)
+      else:
+        files.add(path)
+  return dirs, links, files
 
 
-def create_staging():
-  timer = build_common.SimpleTimer()
-  timer.start('Staging source files', True)
+def _sync_symlink_tree(old_tree, dirs, links):
+  """Updates the staging tree scanned as |old_tree| to the planned tree.
 
-  staging_root = build_common.get_staging_root()
+  Only the entries which differ between |old_tree| and the planned |dirs| and
+  |links| are removed, created, or retargeted. Returns a set of symlink paths
+  which were removed, created or retargeted.
+  """
+  old_dirs, old_links, old_files = old_tree
+  changed_links = set()
+
+  for path in old_files:
+    os.unlink(path)
+  for path, target in old_links.iteritems():
+    if links.get(path) != target:
+      os.unlink(path)
+      changed_links.add(path)
+  # Sorting makes sure a parent directory is removed before its children, so
+  # that the children can be skipped.
+  for path in sorted(old_dirs - dirs):
+    if os.path.lexists(path):
+      file_util.rmtree(path)
+
+  for path in sorted(dirs - old_dirs):
+    os.mkdir(path)
+  for path, target in links.iteritems():
+    if old_links.get(path) != target:
+      os.symlink(target, path)
+      changed_links.add(path)
+  return changed_links
+
+
+def _resolve_staged_path(path, links):
+  """Returns the path which |path| refers to through symlinks in |links|.
+
+  Returns None if neither |path| nor its ancestors are in |links|.
+  """
+  for ancestor in file_util.walk_ancestor(path):
+    target = links.get(ancestor)
+    if target is not None:
+      return os.path.normpath(os.path.join(
+          os.path.dirname(ancestor), target, os.path.relpath(path, ancestor)))
+  return None
 
-  # Store where all the old staging links pointed so we can compare after.
-  old_staging_links = _get_link_targets(staging_root)
 
-  if os.path.lexists(staging_root):
-    file_util.rmtree(staging_root)
+def _touch_retargeted_files(changed_links, old_links, new_links):
+  """Updates modification time of files whose resolved target changed.
 
-  _create_symlink_tree(_MODS_DIR, _THIRD_PARTY_DIR, staging_root)
+  This makes sure they are built even if the new target is older than the
+  previous build outputs.
+
+  Every file (not directory) under staging is in either one of following
+  two states:
+
+    F. The file itself is a symbolic link to a file under third_party or
+       mods.
+    D. Some ancestor directory is a symbolic link to a directory under
+       third_party. (It is important that we do not create symbolic links to
+       directories under mods)
+
+  For both states, the file which is actually referred to can be computed
+  from the link targets of the file or its closest linked ancestor. Only files
+  which were in state F before or after re-staging (i.e. |changed_links|) can
+  refer to a different file, so they are the only candidates to touch.
+  Note that |changed_links| may contain directory symbolic links, but
+  directory timestamps do not matter so they are skipped.
+
+  Nothing is touched if there were no |old_links|, i.e. on the first staging.
+  """
+  touched_count = 0
+  if not old_links:
+    return touched_count
+  for path in changed_links:
+    if (_resolve_staged_path(path, old_links) !=
+        _resolve_staged_path(path, new_links) and os.path.isfile(path)):
+      os.utime(path, None)
+      touched_count += 1
+  return touched_count
+
+
+def _plan_staging(staging_root):
+  """Plans the whole staging tree.
+
+  Returns a tuple of (dirs, links) as described in _plan_symlink_tree().
+  """
+  dirs = set()
+  links = {}
+  _plan_symlink_tree(_MODS_DIR, _THIRD_PARTY_DIR, staging_root, dirs, links)
 
   # internal/ is an optional checkout
   if build_options.OPTIONS.internal_apks_source_is_internal():
@@ -240,58 +328,93 @@ def create_staging():
       if os.path.exists(os.path.join(_THIRD_PARTY_DIR, name)):
         raise Exception('Name conflict between internal/third_party and '
                         'third_party: ' + name)
-    _create_symlink_tree(_INTERNAL_MODS_PATH, _INTERNAL_THIRD_PARTY_PATH,
-                         staging_root)
-    subprocess.check_call('internal/build/fix_staging.py')
+    _plan_symlink_tree(_INTERNAL_MODS_PATH, _INTERNAL_THIRD_PARTY_PATH,
+                       staging_root, dirs, links)
 
   # src/ is not overlaid on any directory.
-  _create_symlink_tree(_SRC_DIR, None, os.path.join(staging_root, 'src'))
+  _plan_symlink_tree(_SRC_DIR, None, os.path.join(staging_root, 'src'),
+                     dirs, links)
+  return dirs, links
+
+
+def create_staging(incremental=True):
+  """Creates or updates the staging directory.
+
+  If |incremental| is True, the existing staging tree is diffed against the
+  planned one, and only the symlinks which changed are added, removed or
+  retargeted. Otherwise, the staging tree is removed and created from scratch.
+  """
+  timer = build_common.SimpleTimer()
+  timer.start('Staging source files', True)
+
+  staging_root = os.path.normpath(build_common.get_staging_root())
+  file_util.makedirs_safely(os.path.dirname(staging_root))
+  dirs, links = _plan_staging(staging_root)
+
+  # Store where all the old staging links pointed so we can compare after.
+  old_tree = _scan_staging_tree(staging_root)
+  if incremental:
+    current_tree = old_tree
+  else:
+    if os.path.lexists(staging_root):
+      file_util.rmtree(staging_root)
+    current_tree = (set(), {}, set())
+  changed_links = _sync_symlink_tree(current_tree, dirs, links)
+
+  if build_options.OPTIONS.internal_apks_source_is_internal():
+    subprocess.check_call('internal/build/fix_staging.py')
+    # fix_staging.py may replace some of the links. Reflect the links it
+    # restored, so that they are not treated as retargeted.
+    for path in changed_links:
+      if os.path.islink(path):
+        links[path] = os.readlink(path)
 
   # Update modification time for files that do not point to the same location
   # that they pointed to in the previous tree to make sure they are built.
-
-  if old_staging_links:
-    new_staging_links = _get_link_targets(staging_root)
-
-    # Every file (not directory) under staging is in either one of following
-    # two states:
-    #
-    #   F. The file itself is a symbolic link to a file under third_party or
-    #      mods.
-    #   D. Some ancestor directory is a symbolic link to a directory under
-    #      third_party. (It is important that we do not create symbolic links to
-    #      directories under mods)
-    #
-    # Let us say a file falls under "X-Y" case if it was in state X before
-    # re-staging and now in state Y. For all 4 possible cases, we can check if
-    # the actual destination of the file changed or not in the following way:
-    #
-    #   F-F: We can just compare the target of the link.
-    #   F-D, D-F: The target may have changed, but it needs some complicated
-    #        computation to check. We treat them as changed to be conservative.
-    #   D-D: We can leave it as-is since both point third_party.
-    #
-    # So we want to visit all files in state F either in old staging or new
-    # staging. For this purpose we can iterate through |*_staging_links| as
-    # they contain all files in state F.
-    #
-    # Note that |*_staging_links| may contain directory symbolic links, but
-    # it is okay to visit them too because directory timestamps do not matter.
-    # Actually excluding directory symbolic links from |old_staging_links| is
-    # difficult because link targets might be already removed.
-
-    for path in set(list(old_staging_links) + list(new_staging_links)):
-      if path in old_staging_links and path in new_staging_links:
-        should_touch = old_staging_links[path] != new_staging_links[path]
-      else:
-        should_touch = True
-      if should_touch and os.path.exists(path):
-        os.utime(path, None)
+  _touch_retargeted_files(changed_links, old_tree[1], links)
 
   timer.done()
   return True
 
 
-if __name__ == '__main__':
+def _run_benchmark():
+  """Measures the time to restage with no change and with one file change."""
+  staging_root = os.path.normpath(build_common.get_staging_root())
+  # Make sure the staging tree is up to date before measuring.
+  create_staging()
+
+  def measure(label, incremental):
+    start_time = time.time()
+    create_staging(incremental=incremental)
+    print '%s: %0.3fs' % (label, time.time() - start_time)
+
+  measure('Full restaging', False)
+  measure('Incremental restaging with no change', True)
+
+  # Emulate a change of one file by removing one of the staged symlinks, so
+  # that the next restaging needs to recreate it. No source file is modified.
+  link_path = next(path for path in sorted(_plan_staging(staging_root)[1])
+                   if os.path.isfile(path))
+  os.unlink(link_path)
+  measure('Incremental restaging with one file change', True)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--full', action='store_true',
+                      help='Remove the staging directory and recreate it '
+                      'from scratch, instead of updating it incrementally.')
+  parser.add_argument('--benchmark', action='store_true',
+                      help='Measure the time to restage with no change and '
+                      'with one file change.')
+  args = parser.parse_args()
+
   build_options.OPTIONS.parse_configure_file()
-  sys.exit(not create_staging())
+  if args.benchmark:
+    _run_benchmark()
+    return 0
+  return 0 if create_staging(incremental=not args.full) else 1
+
+
+if __name__ == '__main__':
+  sys.exit(main())
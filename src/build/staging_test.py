@@ -4,9 +4,25 @@
 
 """Tests for staging."""
 
+import os
+import tempfile
 import unittest
 
 from src.build import staging
+from src.build.util import file_util
+
+
+def _touch(path):
+  open(path, 'w').close()
+
+
+def _restage():
+  dirs = set()
+  links = {}
+  staging._plan_symlink_tree('mods', 'third_party', 'out/staging', dirs, links)
+  old_tree = staging._scan_staging_tree('out/staging')
+  changed_links = staging._sync_symlink_tree(old_tree, dirs, links)
+  return staging._touch_retargeted_files(changed_links, old_tree[1], links)
 
 
 class StagingTest(unittest.TestCase):
@@ -67,5 +83,74 @@ class StagingTest(unittest.TestCase):
     self.assertEquals('mods/foo/bar', mods)
 
 
+class IncrementalStagingTest(unittest.TestCase):
+  def setUp(self):
+    self._original_cwd = os.getcwd()
+    self._tmpdir = tempfile.mkdtemp()
+    os.chdir(self._tmpdir)
+
+    os.makedirs('out')
+    os.makedirs('mods/foo/bar')
+    os.makedirs('third_party/foo/bar')
+    os.makedirs('third_party/foo/baz')
+    _touch('mods/foo/bar/a.cc')
+    _touch('third_party/foo/bar/a.cc')
+    _touch('third_party/foo/bar/b.cc')
+    _touch('third_party/foo/baz/c.cc')
+
+  def tearDown(self):
+    os.chdir(self._original_cwd)
+    file_util.rmtree(self._tmpdir, ignore_errors=True)
+
+  def _get_resolved_path(self, path):
+    return os.path.relpath(os.path.realpath(path), os.path.realpath('.'))
+
+  def test_initial_staging(self):
+    self.assertEquals(0, _restage())
+    self.assertEquals('mods/foo/bar/a.cc',
+                      self._get_resolved_path('out/staging/foo/bar/a.cc'))
+    self.assertEquals('third_party/foo/bar/b.cc',
+                      self._get_resolved_path('out/staging/foo/bar/b.cc'))
+    self.assertTrue(os.path.islink('out/staging/foo/baz'))
+
+  def test_no_change(self):
+    _restage()
+    self.assertEquals(0, _restage())
+
+  def test_retarget(self):
+    _restage()
+    # Removing a file in mods retargets it to third_party.
+    os.remove('mods/foo/bar/a.cc')
+    self.assertEquals(1, _restage())
+    self.assertEquals('third_party/foo/bar/a.cc',
+                      self._get_resolved_path('out/staging/foo/bar/a.cc'))
+
+    # Adding a file in mods under the directory linked to third_party replaces
+    # the directory link with a real directory. Only the overlaid file is
+    # touched.
+    os.makedirs('mods/foo/baz')
+    _touch('mods/foo/baz/c.cc')
+    _touch('third_party/foo/baz/d.cc')
+    self.assertEquals(1, _restage())
+    self.assertFalse(os.path.islink('out/staging/foo/baz'))
+    self.assertEquals('mods/foo/baz/c.cc',
+                      self._get_resolved_path('out/staging/foo/baz/c.cc'))
+    self.assertEquals('third_party/foo/baz/d.cc',
+                      self._get_resolved_path('out/staging/foo/baz/d.cc'))
+
+    # Removing the directory in mods links the directory to third_party again.
+    file_util.rmtree('mods/foo/baz')
+    self.assertEquals(1, _restage())
+    self.assertTrue(os.path.islink('out/staging/foo/baz'))
+
+  def test_remove_stale_files(self):
+    _restage()
+    _touch('out/staging/foo/bar/stale.cc')
+    os.remove('third_party/foo/bar/b.cc')
+    _restage()
+    self.assertFalse(os.path.lexists('out/staging/foo/bar/stale.cc'))
+    self.assertFalse(os.path.lexists('out/staging/foo/bar/b.cc'))
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -23,11 +23,26 @@ $ ./src/build/symbol_tool --verify input.list disallowed.list
 """
 
 import argparse
-import subprocess
 import sys
 
-from src.build import toolchain
-from src.build.build_options import OPTIONS
+from src.build.util import elf_symbols
+
+
+def _print_sorted_lines(lines):
+  # Sort in the byte order, as 'LC_ALL=C sort' does.
+  for line in sorted(lines):
+    print line
+
+
+def _read_symbol_names(path, predicate):
+  return set(symbol.name
+             for symbol in elf_symbols.read_symbols(path)
+             if predicate(symbol))
+
+
+def _read_symbols_file(path):
+  with open(path) as f:
+    return f.read().splitlines()
 
 
 def main():
@@ -49,37 +64,32 @@ def main():
 
   args = parser.parse_args()
 
-  OPTIONS.parse_configure_file()
-  nm = toolchain.get_tool(OPTIONS.target(), 'nm')
-
+  # The symbols are read in process instead of running nm, as these commands
+  # run for every object file in the build.
   if args.dump_defined:
-    command = (nm + ' --defined-only --extern-only --format=posix %s | '
-               'sed -n \'s/^\(.*\) [A-Za-z].*$/\\1/p\' | '
-               'LC_ALL=C sort -u' % args.args[0])
-    return subprocess.check_call(command, shell=True)
+    _print_sorted_lines(_read_symbol_names(
+        args.args[0],
+        lambda symbol: symbol.is_defined() and symbol.is_external()))
+    return 0
 
   elif args.dump_undefined:
-    command = (nm + ' --undefined-only --format=posix %s | '
-               'sed -n \'s/^\(.*\) U.*$/\\1/p\' | '
-               'LC_ALL=C sort -u' % args.args[0])
-    return subprocess.check_call(command, shell=True)
+    # Weak undefined symbols are not dumped, as they need not be defined.
+    _print_sorted_lines(_read_symbol_names(
+        args.args[0], lambda symbol: symbol.type == 'U'))
+    return 0
 
   elif args.clean:
-    command = ('egrep -ve "^#" %s | LC_ALL=C sort' % args.args[0])
-    return subprocess.check_call(command, shell=True)
+    _print_sorted_lines(line for line in _read_symbols_file(args.args[0])
+                        if not line.startswith('#'))
+    return 0
 
   elif args.verify:
-    command = ('LC_ALL=C comm -12 %s %s' % (args.args[0], args.args[1]))
-    try:
-      diff = subprocess.check_output(command, shell=True,
-                                     stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-      # This can happen if files are not sorted
-      print e.output.rstrip()
-      return 1
+    disallowed_symbols = set(_read_symbols_file(args.args[1]))
+    diff = sorted(disallowed_symbols.intersection(
+        _read_symbols_file(args.args[0])))
     if diff:
       print '%s has disallowed symbols: ' % (args.args[0])
-      print diff.rstrip()
+      print '\n'.join(diff)
       return 1
     return 0
 
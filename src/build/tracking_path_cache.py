@@ -0,0 +1,136 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Memoizes the upstream tracking path of each source file.
+
+NinjaGenerator.add_notice_sources() looks for the tracking path of every input
+of every build rule, which needs to open the file and scan its header for a
+tracking tag (see analyze_diffs.compute_tracking_path()). The same sources and
+headers are scanned by many generators, so the result is memoized here with
+the stat of the file, and persisted in the config cache directory.
+
+The cache is loaded in the main process before the worker processes of
+ninja_generator_runner are forked, so the workers share the loaded entries.
+The entries computed in a worker are sent back to the main process with
+take_updates() and merge_updates(), to be saved for the next run.
+"""
+
+import errno
+import marshal
+import os
+
+from src.build import analyze_diffs
+from src.build.util import file_util
+
+
+_CACHE_FILE_VERSION = 0
+
+
+class TrackingPathCache(object):
+  """Holds the tracking path of each source file.
+
+  |entries| is a dict from a path to a tuple of the mtime, the size and the
+  inode number of the file, and the tracking path computed without checking if
+  it exists. Whether the tracking path exists is checked on each lookup, as the
+  upstream file can be added or removed without touching the source file.
+  """
+
+  def __init__(self, entries=None):
+    self._entries = entries or {}
+    self._updates = {}
+    self.hit_count = 0
+    self.miss_count = 0
+    # True if there are entries not saved to the file yet.
+    self._is_dirty = False
+
+  def get_tracking_path(self, path):
+    """Returns the tracking path of |path|, or None if it has no upstream.
+
+    None is also returned if |path| does not exist.
+    """
+    try:
+      stat = os.stat(path)
+    except OSError as e:
+      if e.errno in (errno.ENOENT, errno.ENOTDIR):
+        return None
+      raise
+    key = (stat.st_mtime, stat.st_size, stat.st_ino)
+    entry = self._entries.get(path)
+    if entry is not None and entry[:3] == key:
+      self.hit_count += 1
+    else:
+      self.miss_count += 1
+      with open(path) as f:
+        entry = key + (analyze_diffs.compute_tracking_path(
+            None, path, f, check_exist=False),)
+      self._entries[path] = entry
+      self._updates[path] = entry
+      self._is_dirty = True
+    tracking_path = entry[3]
+    if not tracking_path or not os.path.exists(tracking_path):
+      return None
+    return tracking_path
+
+  def take_updates(self):
+    """Returns the entries computed and the counts since the last call.
+
+    The returned value is passed to merge_updates() of the cache in another
+    process.
+    """
+    updates = (self._updates, self.hit_count, self.miss_count)
+    self._updates = {}
+    self.hit_count = 0
+    self.miss_count = 0
+    return updates
+
+  def merge_updates(self, updates):
+    if updates is None:
+      return
+    entries, hit_count, miss_count = updates
+    self.hit_count += hit_count
+    self.miss_count += miss_count
+    if entries:
+      self._entries.update(entries)
+      self._is_dirty = True
+
+  def to_dict(self):
+    return {'version': _CACHE_FILE_VERSION, 'entries': self._entries}
+
+  def save_to_file(self, path):
+    if not self._is_dirty:
+      return
+    file_util.makedirs_safely(os.path.dirname(path))
+    file_util.generate_file_atomically(
+        path, lambda f: marshal.dump(self.to_dict(), f))
+    self._is_dirty = False
+
+
+def _load_entries(path):
+  try:
+    with open(path) as f:
+      data = marshal.load(f)
+  except (EOFError, ValueError, TypeError):
+    return None
+  except IOError as e:
+    if e.errno == errno.ENOENT:
+      return None
+    raise
+  if not data or data.get('version') != _CACHE_FILE_VERSION:
+    return None
+  return data['entries']
+
+
+# The cache used in this process.
+_cache = TrackingPathCache()
+
+
+def get_cache():
+  return _cache
+
+
+def load_from_file(path):
+  """Replaces the cache used in this process with the one saved in |path|."""
+  global _cache
+  _cache = TrackingPathCache(_load_entries(path))
+  return _cache
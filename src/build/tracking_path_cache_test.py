@@ -0,0 +1,82 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unittest for tracking_path_cache.py."""
+
+import os
+import tempfile
+import unittest
+
+from src.build import tracking_path_cache
+from src.build.util import file_util
+
+
+def _write_file(path, content):
+  file_util.makedirs_safely(os.path.dirname(path))
+  with open(path, 'w') as f:
+    f.write(content)
+
+
+class TrackingPathCacheTest(unittest.TestCase):
+  def setUp(self):
+    self._original_cwd = os.getcwd()
+    self._root = tempfile.mkdtemp()
+    os.chdir(self._root)
+    _write_file('mods/foo.cc', '')
+    _write_file('third_party/foo.cc', '')
+    _write_file('third_party/bar.cc', '')
+
+  def tearDown(self):
+    os.chdir(self._original_cwd)
+    tracking_path_cache._cache = tracking_path_cache.TrackingPathCache()
+    file_util.rmtree(self._root, ignore_errors=True)
+
+  def test_get_tracking_path(self):
+    cache = tracking_path_cache.TrackingPathCache()
+    self.assertEquals('third_party/foo.cc',
+                      cache.get_tracking_path('mods/foo.cc'))
+    self.assertEquals('third_party/foo.cc',
+                      cache.get_tracking_path('mods/foo.cc'))
+    self.assertEquals((1, 1), (cache.hit_count, cache.miss_count))
+    self.assertIsNone(cache.get_tracking_path('mods/nonexistent.cc'))
+
+    # Modifying the file invalidates the entry.
+    _write_file('mods/foo.cc', '// ARC MOD TRACK "third_party/bar.cc"\n')
+    os.utime('mods/foo.cc', (0, 0))
+    self.assertEquals('third_party/bar.cc',
+                      cache.get_tracking_path('mods/foo.cc'))
+    self.assertEquals((1, 2), (cache.hit_count, cache.miss_count))
+
+    # The existence of the tracking path is checked on each lookup.
+    os.remove('third_party/bar.cc')
+    self.assertIsNone(cache.get_tracking_path('mods/foo.cc'))
+    self.assertEquals((2, 2), (cache.hit_count, cache.miss_count))
+
+  def test_save_and_load(self):
+    cache = tracking_path_cache.TrackingPathCache()
+    cache.get_tracking_path('mods/foo.cc')
+    cache.save_to_file('cache/tracking_paths')
+
+    cache = tracking_path_cache.load_from_file('cache/tracking_paths')
+    self.assertIs(cache, tracking_path_cache.get_cache())
+    self.assertEquals('third_party/foo.cc',
+                      cache.get_tracking_path('mods/foo.cc'))
+    self.assertEquals((1, 0), (cache.hit_count, cache.miss_count))
+
+  def test_merge_updates(self):
+    worker_cache = tracking_path_cache.TrackingPathCache()
+    worker_cache.get_tracking_path('mods/foo.cc')
+    updates = worker_cache.take_updates()
+    self.assertEquals((0, 0), (worker_cache.hit_count, worker_cache.miss_count))
+
+    cache = tracking_path_cache.TrackingPathCache()
+    cache.merge_updates(updates)
+    self.assertEquals((0, 1), (cache.hit_count, cache.miss_count))
+    self.assertEquals('third_party/foo.cc',
+                      cache.get_tracking_path('mods/foo.cc'))
+    self.assertEquals((1, 1), (cache.hit_count, cache.miss_count))
+
+
+if __name__ == '__main__':
+  unittest.main()
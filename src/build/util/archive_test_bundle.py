@@ -11,17 +11,28 @@ and test jar files, for run_integration_tests.
 """
 
 import argparse
+import copy
 import logging
 import os
 import re
+import stat
+import struct
+import tempfile
+import time
 import zipfile
+import zlib
 
 from src.build import build_common
 from src.build import run_integration_tests
 from src.build import toolchain
 from src.build.build_options import OPTIONS
+from src.build.util import concurrent
+from src.build.util import file_util
 from src.build.util import remote_executor_util
 
+_EXCLUDED_FILE_RE = re.compile(r'.*\.(pyc|ncval)')
+_COPY_CHUNK_SIZE = 1024 * 1024
+
 
 def _collect_descendants(paths):
    """Returns the set of descendant files of the directories in |paths|.
@@ -30,12 +41,29 @@ def _collect_descendants(paths):
    set. Unnecessary files for running integration tests such as temporary files
    created by editor, .pyc, and .ncval files are excluded from the returned set.
    """
-   files = [path for path in paths if os.path.isfile(path)]
-   dirs = [path for path in paths if os.path.isdir(path)]
-   files += build_common.find_all_files(dirs, include_tests=True,
+   files = []
+   dirs = []
+   for path in paths:
+     try:
+       mode = os.stat(path).st_mode
+     except OSError:
+       continue
+     if stat.S_ISREG(mode):
+       files.append(path)
+     elif stat.S_ISDIR(mode):
+       dirs.append(path)
+   # Drop the directories under another one in |dirs|, so that they are not
+   # walked twice. Sorting by the path components puts a directory right
+   # before its descendants.
+   top_dirs = []
+   for path in sorted(dirs, key=lambda path: os.path.normpath(path).split('/')):
+     if top_dirs and os.path.normpath(path).startswith(
+         os.path.normpath(top_dirs[-1]) + '/'):
+       continue
+     top_dirs.append(path)
+   files += build_common.find_all_files(top_dirs, include_tests=True,
                                         use_staging=False)
-   files = [f for f in files if not re.match(r'.*\.(pyc|ncval)', f)]
-   return set(files)
+   return set(f for f in files if not _EXCLUDED_FILE_RE.match(f))
 
 
 def _get_archived_file_paths():
@@ -48,21 +76,140 @@ def _get_archived_file_paths():
   return paths
 
 
-def _zip_files(filename, paths):
-  """Creates a zip file that contains the specified files."""
-  # Set allowZip64=True so that large zip files can be handled.
-  with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_DEFLATED,
+def _get_arcname(path):
+  if path.startswith(build_common.get_stripped_dir()):
+    # When archiving a stripped file, use the path of the corresponding
+    # unstripped file as archive name
+    return os.path.join(
+        build_common.get_build_dir(),
+        os.path.relpath(path, build_common.get_stripped_dir()))
+  return path
+
+
+def _get_crc32(path):
+  crc = 0
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(_COPY_CHUNK_SIZE), ''):
+      crc = zlib.crc32(chunk, crc)
+  return crc & 0xffffffff
+
+
+def _get_zip_date_time(mtime):
+  """Returns |mtime| as the date_time read back from a zip entry.
+
+  ZipFile.write() records the local time, which is stored in the DOS format
+  with a resolution of 2 seconds.
+  """
+  date_time = time.localtime(mtime)[:6]
+  return date_time[:5] + (date_time[5] // 2 * 2,)
+
+
+def _find_reusable_entry(base_zip, path, arcname):
+  """Returns the entry of |base_zip| which can be reused for |path|.
+
+  The entry is reused only when its size, mtime and CRC-32 all match the
+  file's. The CRC-32 is computed only for the files which look unchanged.
+  """
+  if base_zip is None:
+    return None
+  try:
+    zinfo = base_zip.getinfo(arcname)
+  except KeyError:
+    return None
+  st = os.stat(path)
+  if (zinfo.compress_type != zipfile.ZIP_DEFLATED or
+      zinfo.file_size != st.st_size or
+      zinfo.date_time != _get_zip_date_time(st.st_mtime) or
+      zinfo.CRC != _get_crc32(path)):
+    return None
+  return zinfo
+
+
+def _copy_compressed_entry(src_zip, zinfo, dest_zip):
+  """Copies an entry from |src_zip| to |dest_zip| without recompressing it."""
+  src_fp = src_zip.fp
+  src_fp.seek(zinfo.header_offset)
+  header = struct.unpack(zipfile.structFileHeader,
+                         src_fp.read(zipfile.sizeFileHeader))
+  src_fp.seek(header[zipfile._FH_FILENAME_LENGTH] +
+              header[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+
+  new_zinfo = copy.copy(zinfo)
+  # The sizes and the CRC are written in the local header below, so a data
+  # descriptor is not needed. FileHeader() adds the zip64 extra field back if
+  # necessary.
+  new_zinfo.flag_bits &= ~0x08
+  new_zinfo.extra = ''
+  new_zinfo.header_offset = dest_zip.fp.tell()
+  dest_zip.fp.write(new_zinfo.FileHeader())
+  remaining = zinfo.compress_size
+  while remaining:
+    chunk = src_fp.read(min(remaining, _COPY_CHUNK_SIZE))
+    dest_zip.fp.write(chunk)
+    remaining -= len(chunk)
+  dest_zip.filelist.append(new_zinfo)
+  dest_zip.NameToInfo[new_zinfo.filename] = new_zinfo
+  dest_zip._didModify = True
+
+
+def _compress_file(path, arcname, output):
+  """Creates a zip file |output| which contains only |path|.
+
+  This runs in a worker process. The compressed entry is copied to the bundle
+  by the main process afterwards.
+  """
+  with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED,
                        allowZip64=True) as f:
-    for path in set(paths):
-      if path.startswith(build_common.get_stripped_dir()):
-        # When archiving a stripped file, use the path of the corresponding
-        # unstripped file as archive name
-        arcname = os.path.join(
-            build_common.get_build_dir(),
-            os.path.relpath(path, build_common.get_stripped_dir()))
-        f.write(path, arcname=arcname)
-      else:
-        f.write(path)
+    f.write(path, arcname=arcname)
+
+
+def _zip_files(filename, paths, base_filename=None):
+  """Creates a zip file that contains the specified files.
+
+  If |base_filename| is given, the compressed entries of the unchanged files
+  are copied from it. The other files are compressed in parallel in worker
+  processes.
+  """
+  base_zip = None
+  if base_filename and os.path.exists(base_filename):
+    base_zip = zipfile.ZipFile(base_filename, 'r', allowZip64=True)
+  tmpdir = tempfile.mkdtemp(prefix='archive_test_bundle-',
+                            dir=os.path.dirname(os.path.abspath(filename)))
+  try:
+    with concurrent.ProcessPoolExecutor() as executor:
+      entries = []
+      for index, path in enumerate(sorted(set(paths))):
+        arcname = _get_arcname(path)
+        zinfo = _find_reusable_entry(base_zip, path, arcname)
+        if zinfo:
+          entries.append((base_zip, zinfo))
+          continue
+        output = os.path.join(tmpdir, '%d.zip' % index)
+        entries.append((output, executor.submit(
+            _compress_file, path, arcname, output)))
+
+      # Write to a temporary file, as |filename| may be |base_filename|.
+      tmp_filename = os.path.join(tmpdir, 'bundle.zip')
+      # Set allowZip64=True so that large zip files can be handled.
+      with zipfile.ZipFile(tmp_filename, 'w',
+                           compression=zipfile.ZIP_DEFLATED,
+                           allowZip64=True) as f:
+        for source, entry in entries:
+          if source is base_zip:
+            _copy_compressed_entry(base_zip, entry, f)
+            continue
+          entry.result()
+          with zipfile.ZipFile(source, 'r', allowZip64=True) as src_zip:
+            _copy_compressed_entry(src_zip, src_zip.infolist()[0], f)
+          os.remove(source)
+    logging.info('Reused %d of %d files',
+                 sum(1 for source, _ in entries if source is base_zip),
+                 len(entries))
+    os.rename(tmp_filename, filename)
+  finally:
+    if base_zip:
+      base_zip.close()
+    file_util.rmtree(tmpdir)
 
 
 def _get_integration_tests_args(jobs):
@@ -100,6 +247,9 @@ def _parse_args():
   parser.add_argument('-o', '--output',
                       default=build_common.get_test_bundle_name(),
                       help=('The name of the test bundle to be created.'))
+  parser.add_argument('--incremental', action='store_true',
+                      help=('Reuse the compressed files in the existing test '
+                            'bundle if they are unchanged.'))
   return parser.parse_args()
 
 
@@ -126,5 +276,7 @@ if __name__ == '__main__':
   if OPTIONS.is_debug_info_enabled():
     paths = _convert_to_stripped_paths(paths)
   print 'Creating %s' % parsed_args.output
-  _zip_files(parsed_args.output, paths)
+  _zip_files(parsed_args.output, paths,
+             base_filename=(parsed_args.output if parsed_args.incremental
+                            else None))
   print 'Done'
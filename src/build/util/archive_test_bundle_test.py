@@ -0,0 +1,85 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unittest for archive_test_bundle.py."""
+
+import os
+import tempfile
+import unittest
+import zipfile
+
+from src.build.build_options import OPTIONS
+from src.build.util import archive_test_bundle
+from src.build.util import file_util
+
+# An mtime with odd seconds, which the DOS timestamps in zip files cannot
+# represent exactly.
+_ODD_MTIME = 1420070411
+
+
+def _write_file(path, content, mtime=_ODD_MTIME):
+  file_util.makedirs_safely(os.path.dirname(path) or '.')
+  with open(path, 'wb') as f:
+    f.write(content)
+  os.utime(path, (mtime, mtime))
+
+
+class ArchiveTestBundleTest(unittest.TestCase):
+  def setUp(self):
+    OPTIONS.parse([])
+    self._original_cwd = os.getcwd()
+    self._root = tempfile.mkdtemp()
+    os.chdir(self._root)
+    _write_file('foo.txt', 'foo')
+    _write_file('dir/bar.bin', os.urandom(100000))
+    _write_file('dir/baz.txt', 'baz' * 1000)
+
+  def tearDown(self):
+    os.chdir(self._original_cwd)
+    file_util.rmtree(self._root, ignore_errors=True)
+
+  def _check_bundle(self, paths):
+    with zipfile.ZipFile('bundle.zip') as bundle:
+      self.assertIsNone(bundle.testzip())
+      self.assertEquals(sorted(paths), sorted(bundle.namelist()))
+      for path in paths:
+        with open(path, 'rb') as f:
+          self.assertEquals(f.read(), bundle.read(path))
+
+  def test_find_reusable_entry(self):
+    archive_test_bundle._zip_files('bundle.zip', ['foo.txt'])
+    with zipfile.ZipFile('bundle.zip') as bundle:
+      self.assertIsNotNone(archive_test_bundle._find_reusable_entry(
+          bundle, 'foo.txt', 'foo.txt'))
+
+      _write_file('foo.txt', 'bar')
+      self.assertIsNone(archive_test_bundle._find_reusable_entry(
+          bundle, 'foo.txt', 'foo.txt'))
+
+      _write_file('foo.txt', 'foo', mtime=_ODD_MTIME + 2)
+      self.assertIsNone(archive_test_bundle._find_reusable_entry(
+          bundle, 'foo.txt', 'foo.txt'))
+
+  def test_zip_files_incremental(self):
+    paths = ['foo.txt', 'dir/bar.bin', 'dir/baz.txt']
+    archive_test_bundle._zip_files('bundle.zip', paths,
+                                   base_filename='bundle.zip')
+    self._check_bundle(paths)
+
+    # The unchanged entries are copied from the previous bundle.
+    _write_file('dir/baz.txt', 'qux')
+    paths.append('qux.txt')
+    _write_file('qux.txt', 'qux' * 1000)
+    archive_test_bundle._zip_files('bundle.zip', paths,
+                                   base_filename='bundle.zip')
+    self._check_bundle(paths)
+
+    paths.remove('foo.txt')
+    archive_test_bundle._zip_files('bundle.zip', paths,
+                                   base_filename='bundle.zip')
+    self._check_bundle(paths)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -2,8 +2,12 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
-import io
+import collections
+import errno
+import heapq
+import itertools
 import logging
+import os
 import re
 import select
 import signal
@@ -50,30 +54,299 @@ class _XvfbPopen(subprocess.Popen):
     _signal_xvfb_children(self.pid, signal.SIGKILL)
 
 
-def _maybe_create_line_reader(reader):
-  if reader is None:
-    return None
-  return nonblocking_io.LineReader(reader)
+# The size of data to read from a pipe at once.
+_READ_SIZE = 65536
 
+# The interval to call OutputHandler.is_done() while no line is output.
+_IS_DONE_CHECK_INTERVAL_SECONDS = 5
 
-def _handle_output(reader, handler):
-  """Reads lines from |reader| and invoke handler for each line.
+# A marker in _OutputQueue to wake up handle_output().
+_WAKE_UP = (None, None)
 
-  At EOF, this closes the |reader|, and returns True.
-  Otherwise, returns False.
+
+class _ReactorTimer(object):
+  """A timer registered to _Reactor, which can be cancel()ed."""
+
+  def __init__(self, callback):
+    self.callback = callback
+    self.cancelled = False
+
+  def cancel(self):
+    self.cancelled = True
+
+
+class _PipeReader(object):
+  """Reads lines from a pipe on the reactor thread, and queues them."""
+
+  def __init__(self, stream, line_callback, output_queue):
+    nonblocking_io.set_nonblocking(stream.fileno())
+    self.stream = stream
+    # Kept, as the stream may be closed before the reader is removed.
+    self.fd = stream.fileno()
+    self._line_callback = line_callback
+    self._output_queue = output_queue
+    self._buffer = nonblocking_io.LineBuffer()
+
+  def read(self):
+    """Reads the available data, and returns True at EOF.
+
+    At EOF, (line_callback, None) is queued after the last line.
+    """
+    try:
+      data = os.read(self.fd, _READ_SIZE)
+    except EnvironmentError as e:
+      if e.errno != errno.EAGAIN:
+        raise
+      return False
+    lines = self._buffer.feed(data) if data else self._buffer.flush()
+    items = [(self._line_callback, line) for line in lines]
+    if not data:
+      items.append((self._line_callback, None))
+    self._output_queue.put(items)
+    return not data
+
+  def abort(self):
+    """Queues EOF, so that handle_output() stops waiting for the pipe."""
+    self._output_queue.put([(self._line_callback, None)])
+
+
+class _OutputQueue(object):
+  """Passes the lines read on the reactor thread to handle_output().
+
+  The consumer blocks in os.read() on a pipe, instead of waiting on a
+  threading.Condition with timeout, which polls periodically in Python 2.
+  This also keeps the waiting thread interruptible by signals.
   """
-  if reader is None:
-    return False
 
-  try:
-    for line in reader:
-      handler(line)
-  except io.BlockingIOError:
-    # All available lines are read. No more line is available for now.
-    return False
-  else:
-    reader.close()  # EOF is found.
-    return True
+  def __init__(self):
+    self._items = collections.deque()
+    self._read_fd, self._write_fd = os.pipe()
+    nonblocking_io.set_nonblocking(self._write_fd)
+
+  def put(self, items):
+    """Queues |items|, which is a list of (line_callback, line)."""
+    self._items.extend(items)
+    try:
+      os.write(self._write_fd, 'x')
+    except EnvironmentError as e:
+      # If the pipe is full, the consumer is going to be woken up anyway.
+      if e.errno != errno.EAGAIN:
+        raise
+
+  def get_all(self):
+    """Waits for items to be queued, and returns all the queued items."""
+    if not self._items:
+      try:
+        os.read(self._read_fd, _READ_SIZE)
+      except EnvironmentError as e:
+        if e.errno != errno.EINTR:
+          raise
+    items = []
+    while self._items:
+      items.append(self._items.popleft())
+    return items
+
+  def close(self):
+    os.close(self._read_fd)
+    os.close(self._write_fd)
+
+
+class _WakeUpTimer(object):
+  """Puts _WAKE_UP to an _OutputQueue periodically on the reactor thread.
+
+  close() must be called before closing the queue. After it returns, nothing
+  is put to the queue, even if the timer is firing concurrently.
+  """
+
+  def __init__(self, reactor, output_queue):
+    self._reactor = reactor
+    self._output_queue = output_queue
+    self._lock = threading.Lock()
+    self._closed = False
+    self._timer = reactor.call_later(_IS_DONE_CHECK_INTERVAL_SECONDS,
+                                     self._fire)
+
+  def _fire(self):
+    with self._lock:
+      if self._closed:
+        return
+      self._output_queue.put([_WAKE_UP])
+      self._timer = self._reactor.call_later(_IS_DONE_CHECK_INTERVAL_SECONDS,
+                                             self._fire)
+
+  def close(self):
+    with self._lock:
+      self._closed = True
+      self._timer.cancel()
+
+
+class _Reactor(object):
+  """Multiplexes the subprocess outputs and the timers on a single thread.
+
+  This uses epoll where it is available, and select otherwise. Lines read
+  from each pipe are passed to the thread in Popen.handle_output() via
+  _OutputQueue, so the OutputHandler is still invoked on that thread. Timer
+  callbacks are invoked on the reactor thread.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._readers = {}
+    self._timers = []
+    self._timer_sequence = itertools.count()
+    self._wake_up_read_fd, self._wake_up_write_fd = os.pipe()
+    nonblocking_io.set_nonblocking(self._wake_up_read_fd)
+    nonblocking_io.set_nonblocking(self._wake_up_write_fd)
+    self._epoll = select.epoll() if hasattr(select, 'epoll') else None
+    if self._epoll:
+      self._epoll.register(self._wake_up_read_fd, select.EPOLLIN)
+    thread = threading.Thread(target=self._run,
+                              name='concurrent_subprocess reactor')
+    thread.daemon = True
+    thread.start()
+
+  def _wake_up(self):
+    try:
+      os.write(self._wake_up_write_fd, 'x')
+    except EnvironmentError as e:
+      # If the pipe is full, the reactor is going to be woken up anyway.
+      if e.errno != errno.EAGAIN:
+        raise
+
+  def add_reader(self, reader):
+    with self._lock:
+      self._readers[reader.fd] = reader
+      if self._epoll:
+        self._epoll.register(reader.fd, select.EPOLLIN)
+    self._wake_up()
+
+  def remove_reader(self, reader):
+    """Unregisters |reader|. After this returns, |reader| is never read."""
+    with self._lock:
+      self._remove_reader_locked(reader)
+
+  def _remove_reader_locked(self, reader):
+    fd = reader.fd
+    if self._readers.get(fd) is not reader:
+      return
+    del self._readers[fd]
+    if self._epoll:
+      try:
+        self._epoll.unregister(fd)
+      except EnvironmentError:
+        # Closing the fd unregisters it.
+        logging.warning('Failed to unregister fd %d', fd, exc_info=True)
+
+  def _read_locked(self, fd):
+    """Reads from the reader of |fd|, and removes it at EOF.
+
+    An error is reported as EOF to the reader's handle_output(), so that a
+    broken pipe does not stop serving the other subprocesses.
+    """
+    reader = self._readers.get(fd)
+    if not reader:
+      return
+    try:
+      is_eof = reader.read()
+    except Exception:
+      logging.exception('Failed to read the output of a subprocess')
+      reader.abort()
+      is_eof = True
+    if is_eof:
+      self._remove_reader_locked(reader)
+
+  def call_later(self, interval, callback):
+    """Invokes |callback| on the reactor thread |interval| secs later.
+
+    Returns a timer, whose cancel() cancels the invocation.
+    """
+    timer = _ReactorTimer(callback)
+    with self._lock:
+      heapq.heappush(self._timers, (time.time() + interval,
+                                    next(self._timer_sequence), timer))
+    self._wake_up()
+    return timer
+
+  def _get_timeout_locked(self):
+    """Returns secs until the next timer, or None if there is no timer."""
+    while self._timers and self._timers[0][2].cancelled:
+      heapq.heappop(self._timers)
+    if not self._timers:
+      return None
+    return max(0, self._timers[0][0] - time.time())
+
+  def _wait_for_ready_fds(self, timeout):
+    try:
+      if self._epoll:
+        return [fd for fd, _ in self._epoll.poll(
+            -1 if timeout is None else timeout)]
+      with self._lock:
+        fds = self._readers.keys() + [self._wake_up_read_fd]
+      # Note that this does not notice the readers added while waiting, but
+      # add_reader() wakes this up.
+      return select.select(fds, [], [], timeout)[0]
+    except (IOError, select.error) as e:
+      if e.args[0] == errno.EBADF and not self._epoll:
+        # Some fd is closed without removing its reader. Try reading all of
+        # them, so that the broken one is found and removed.
+        return fds
+      # Interrupted by a signal.
+      if e.args[0] != errno.EINTR:
+        raise
+      return []
+
+  def _run(self):
+    while True:
+      try:
+        self._run_once()
+      except Exception:
+        # The thread is shared by all the subprocesses in this process, so it
+        # must not die. Wait a bit not to spin if the error persists.
+        logging.exception('Unexpected error in the reactor')
+        time.sleep(0.1)
+
+  def _run_once(self):
+    with self._lock:
+      timeout = self._get_timeout_locked()
+    for fd in self._wait_for_ready_fds(timeout):
+      if fd == self._wake_up_read_fd:
+        try:
+          os.read(fd, _READ_SIZE)
+        except EnvironmentError as e:
+          if e.errno != errno.EAGAIN:
+            raise
+        continue
+      with self._lock:
+        self._read_locked(fd)
+
+    now = time.time()
+    expired_timers = []
+    with self._lock:
+      while self._timers and self._timers[0][0] <= now:
+        expired_timers.append(heapq.heappop(self._timers)[2])
+    for timer in expired_timers:
+      if timer.cancelled:
+        continue
+      try:
+        timer.callback()
+      except Exception:
+        logging.exception('Timer callback failed')
+
+
+_reactor = None
+_reactor_pid = None
+_reactor_lock = threading.Lock()
+
+
+def _get_reactor():
+  """Returns the reactor for this process, starting it on first use."""
+  global _reactor, _reactor_pid
+  with _reactor_lock:
+    # The reactor thread does not exist in a forked child.
+    if _reactor_pid != os.getpid():
+      _reactor = _Reactor()
+      _reactor_pid = os.getpid()
+    return _reactor
 
 
 class Popen(object):
@@ -120,8 +393,10 @@ class Popen(object):
     self._handle_output_invoked = False
     # Set when kill() is called.
     self._kill_event = threading.Event()
+    # _OutputQueue while handle_output() is running.
+    self._output_queue = None
 
-    # threading.Timer instances for timeout or terminate_later.
+    # Timers for timeout or terminate_later.
     # When the subprocess is poll()ed, all timers will be cancelled and
     # _timers will be set to None. See _poll_locked() for more details.
     self._timers = []
@@ -149,9 +424,9 @@ class Popen(object):
   def _start_timer_locked(self, interval, callback):
     """Starts the timer.
 
-    threading.Timer is based on threading.Thread. Each Timer invocation creates
-    a thread. We set it as daemon, so that even if there is pending timeout
-    we can terminate the main scripts.
+    The timers of all the subprocesses run on the single reactor thread, which
+    is a daemon, so that even if there is pending timeout we can terminate the
+    main scripts.
     For thread safety, any method that is called by a callback should acquire
     |self._lock|, and call |self._poll_locked()| to ensure the process still
     exists. If it does, it should continue performing its functionality while
@@ -159,10 +434,7 @@ class Popen(object):
     """
     assert self._timers is not None, (
         '_start_timer_locked() must be called while the subprocess is alive.')
-    timer = threading.Timer(interval, callback)
-    timer.daemon = True
-    timer.start()
-    self._timers.append(timer)
+    self._timers.append(_get_reactor().call_later(interval, callback))
 
   @property
   def pid(self):
@@ -203,6 +475,8 @@ class Popen(object):
         self._process.kill()
         signal_util.kill_recursively(self._process.pid)
         self._kill_event.set()
+        if self._output_queue:
+          self._output_queue.put([_WAKE_UP])
 
   def poll(self):
     with self._lock:
@@ -255,13 +529,27 @@ class Popen(object):
     Returns the status code.
     This method must be called at most once per instance.
     """
+    output_queue = _OutputQueue()
     with self._lock:
       assert not self._handle_output_invoked, (
           'handle_output() must be called at most once.')
       self._handle_output_invoked = True
-
-    stdout = _maybe_create_line_reader(self._process.stdout)
-    stderr = _maybe_create_line_reader(self._process.stderr)
+      self._output_queue = output_queue
+
+    # The pipes are read on the reactor thread, shared by all the subprocesses,
+    # and the lines are passed back to this thread.
+    reactor = _get_reactor()
+    readers = []
+    for stream, line_callback in (
+        (self._process.stdout, output_handler.handle_stdout),
+        (self._process.stderr, output_handler.handle_stderr)):
+      if stream is not None:
+        reader = _PipeReader(stream, line_callback, output_queue)
+        readers.append(reader)
+        reactor.add_reader(reader)
+
+    # is_done() is checked periodically even if nothing is output.
+    wake_up_timer = _WakeUpTimer(reactor, output_queue)
 
     # Note: Exit from the loop, whenever kill() is invoked.
     # In most cases, when kill() is called, all the descendant processes should
@@ -272,36 +560,34 @@ class Popen(object):
     # To avoid such a situation, even if either stdout or stderr is still
     # available, exit from the loop. It should be ok to ignore the
     # remaining stdout and stderr, because nothing valuable should be output
-    # in such cases.
-    # Note that it is *not* necessary to exit from select() immediately,
-    # because it is timed out on every 5 seconds, and it is ok to rely on
-    # that fact, as this is last-resort.
+    # in such cases. kill() wakes up this loop via |output_queue|.
     # Note that it does not exit from the loop on terminate(), because
     # graceful shutdown is expected for the terminate().
+    num_open_readers = len(readers)
     done = False
-    while (stdout or stderr) and not self._kill_event.is_set():
-      # We do not take care about subprocess termination here, because
-      # on the subprocess termination, write-side of stdout and stderr are
-      # closed, so that select() should return at the time. Then,
-      # stdout and stderr will reach to EOF and those are closed, so that
-      # we exit from the loop.
-      # Also note that, on Windows, select for non-socket FDs are not supported.
-      # For such a case, we time out the loop by 5 seconds at most.
-      select.select(filter(None, [stdout, stderr]), [], [], 5)
-      if _handle_output(stdout, output_handler.handle_stdout):
-        stdout = None
-      if _handle_output(stderr, output_handler.handle_stderr):
-        stderr = None
-      if not done and output_handler.is_done():
-        done = True
-        self.terminate()
-
-    # In case of kill() termination, stdout and stderr may be kept opened.
-    # Here, close() them if necessary.
-    if stdout:
-      stdout.close()
-    if stderr:
-      stderr.close()
+    try:
+      while num_open_readers and not self._kill_event.is_set():
+        # We do not take care about subprocess termination here, because
+        # on the subprocess termination, write-side of stdout and stderr are
+        # closed, so that the reactor finds EOF on them.
+        for line_callback, line in output_queue.get_all():
+          if line is not None:
+            line_callback(line)
+          elif line_callback is not None:
+            num_open_readers -= 1  # EOF is found.
+        if not done and output_handler.is_done():
+          done = True
+          self.terminate()
+    finally:
+      wake_up_timer.close()
+      with self._lock:
+        self._output_queue = None
+      # In case of kill() termination, stdout and stderr may be kept opened.
+      # Here, close() them if necessary.
+      for reader in readers:
+        reactor.remove_reader(reader)
+        reader.stream.close()
+      output_queue.close()
 
     # Wait for the subprocess terminate.
     returncode = self.wait()
@@ -5,9 +5,12 @@
 
 """ Unit test for concurrent_subprocess."""
 
+import errno
 import os
+import select
 import signal
 import threading
+import time
 import unittest
 
 from src.build.util import concurrent_subprocess
@@ -294,6 +297,114 @@ class FakePopenTest(unittest.TestCase):
     # Even timer should not be created.
     self.assertEquals([], popen.created_timer_list)
 
+  def test_concurrent_handle_output(self):
+    # The outputs of multiple subprocesses are read on the shared reactor
+    # thread, and dispatched to each handler.
+    fake_list = [FakePopen() for _ in xrange(8)]
+    handler_list = [SimpleOutputHandler() for _ in fake_list]
+    thread_list = [
+        threading.Thread(target=TestPopen(p, ['cmd']).handle_output,
+                         args=(handler,))
+        for p, handler in zip(fake_list, handler_list)]
+    for thread in thread_list:
+      thread.start()
+    for i, p in enumerate(fake_list):
+      p.write_stdout('out%d\n' % i)
+      p.write_stderr('err%d\n' % i)
+      p.close_child_stdout()
+      p.close_child_stderr()
+      p.returncode = 0
+    for thread in thread_list:
+      thread.join()
+    for i, (p, handler) in enumerate(zip(fake_list, handler_list)):
+      p.__exit__(None, None, None)
+      self.assertEquals('out%d\n' % i, handler.stdout)
+      self.assertEquals('err%d\n' % i, handler.stderr)
+
+
+class ReactorTest(unittest.TestCase):
+  def test_call_later(self):
+    reactor = concurrent_subprocess._get_reactor()
+    fired = threading.Event()
+    cancelled = threading.Event()
+    reactor.call_later(0.2, cancelled.set).cancel()
+    reactor.call_later(0.1, fired.set)
+    fired.wait(5)
+    self.assertTrue(fired.is_set())
+    time.sleep(0.2)
+    self.assertFalse(cancelled.is_set())
+
+  def test_failing_reader(self):
+    class FailingReader(concurrent_subprocess._PipeReader):
+      def read(self):
+        raise OSError(errno.EIO, 'Injected error')
+
+    read_fd, write_fd = os.pipe()
+    output_queue = concurrent_subprocess._OutputQueue()
+    reader = FailingReader(os.fdopen(read_fd), 'callback', output_queue)
+    reactor = concurrent_subprocess._get_reactor()
+    try:
+      reactor.add_reader(reader)
+      os.write(write_fd, 'data\n')
+      # The error is reported as EOF.
+      self.assertTrue(select.select([output_queue._read_fd], [], [], 5)[0])
+      self.assertEquals([('callback', None)], output_queue.get_all())
+
+      # The reactor thread still serves the other subprocesses.
+      p = concurrent_subprocess.Popen(['python', '-c', 'print "abc"'])
+      output_handler = SimpleOutputHandler()
+      self.assertEquals(0, p.handle_output(output_handler))
+      self.assertEquals('abc\n', output_handler.stdout)
+    finally:
+      reactor.remove_reader(reader)
+      reader.stream.close()
+      os.close(write_fd)
+      output_queue.close()
+
+
+class FakeReactorTimer(object):
+  def __init__(self, callback):
+    self.callback = callback
+    self.cancelled = False
+
+  def cancel(self):
+    self.cancelled = True
+
+
+class FakeReactor(object):
+  def __init__(self):
+    self.timer_list = []
+
+  def call_later(self, interval, callback):
+    timer = FakeReactorTimer(callback)
+    self.timer_list.append(timer)
+    return timer
+
+
+class FakeOutputQueue(object):
+  def __init__(self):
+    self.items = []
+
+  def put(self, items):
+    self.items.extend(items)
+
+
+class WakeUpTimerTest(unittest.TestCase):
+  def test_close(self):
+    reactor = FakeReactor()
+    output_queue = FakeOutputQueue()
+    timer = concurrent_subprocess._WakeUpTimer(reactor, output_queue)
+    reactor.timer_list[0].callback()
+    self.assertEquals([concurrent_subprocess._WAKE_UP], output_queue.items)
+    self.assertEquals(2, len(reactor.timer_list))
+
+    timer.close()
+    self.assertTrue(reactor.timer_list[1].cancelled)
+    # The timer which fired concurrently with close() does nothing.
+    reactor.timer_list[1].callback()
+    self.assertEquals([concurrent_subprocess._WAKE_UP], output_queue.items)
+    self.assertEquals(2, len(reactor.timer_list))
+
 
 class PopenTest(unittest.TestCase):
   # For sanity check, we run real Popen.
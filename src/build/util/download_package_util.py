@@ -8,6 +8,7 @@ import contextlib
 import hashlib
 import json
 import logging
+import multiprocessing
 import os
 import shutil
 import stat
@@ -15,28 +16,67 @@ import subprocess
 import tempfile
 import time
 import urllib
+import zipfile
 
 from src.build import build_common
+from src.build.util import concurrent
 from src.build.util import file_util
 
 
 _DEFAULT_CACHE_BASE_PATH = os.path.join(build_common.get_arc_root(), 'cache')
 _DEFAULT_CACHE_HISTORY_SIZE = 3
+# The total size of the cached versions of a package is also limited to this.
+# The most recently used version is kept regardless of its size.
+_DEFAULT_CACHE_MAX_SIZE = 16 * 1024 * 1024 * 1024
+_STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def _get_tree_size(path):
+  """Returns the total size of the files under |path|."""
+  total_size = 0
+  for dirpath, dirnames, filenames in os.walk(path):
+    for filename in filenames:
+      try:
+        total_size += os.lstat(os.path.join(dirpath, filename)).st_size
+      except OSError:
+        pass
+  return total_size
 
 
 class CacheHistory(object):
   """Interface for the working with the history of a particular package."""
 
-  def __init__(self, name, base_path, history_size, contents):
+  def __init__(self, name, base_path, history_size, contents, max_size=None,
+               sizes=None):
     self._name = name
     self._base_path = base_path
     self._history_size = history_size
     self._contents = contents
+    self._max_size = max_size
+    # The sizes of the entries, recorded so that the cached trees do not need
+    # to be walked on every check.
+    self._sizes = sizes if sizes is not None else {}
+
+  def _get_size(self, path):
+    if path not in self._sizes:
+      self._sizes[path] = _get_tree_size(path)
+    return self._sizes[path]
+
+  def _get_total_size(self):
+    return sum(self._get_size(path) for path in self._contents)
+
+  def _is_over_limit(self):
+    if len(self._contents) > self._history_size:
+      return True
+    # Keep the most recent entry, which is the one in use.
+    return (self._max_size is not None and len(self._contents) > 1 and
+            self._get_total_size() > self._max_size)
 
   def clean_old(self):
     """Cleans out the least-recently used entries, deleting cache paths."""
-    while len(self._contents) > self._history_size:
+    while self._is_over_limit():
       path = self._contents.pop(0)
+      self._sizes.pop(path, None)
       assert path.startswith(self._base_path)
       logging.info('%s: Cleaning old cache entry %s', self._name,
                    os.path.basename(path))
@@ -48,9 +88,13 @@ class CacheHistory(object):
       self._contents.remove(path)
     self._contents.append(path)
 
+  def invalidate_size(self, path):
+    """Forgets the recorded size of |path|, e.g. after it is updated."""
+    self._sizes.pop(path, None)
+
 
 @contextlib.contextmanager
-def _persisted_cache_history(name, base_path, history_size):
+def _persisted_cache_history(name, base_path, history_size, max_size=None):
   """Persists the cache history using a context."""
 
   # Ensure we have a cache directory
@@ -70,7 +114,9 @@ def _persisted_cache_history(name, base_path, history_size):
   # caller.
   history = CacheHistory(
       name, base_path, history_size,
-      cache_contents.setdefault('cache', {}).setdefault(name, []))
+      cache_contents.setdefault('cache', {}).setdefault(name, []),
+      max_size=max_size,
+      sizes=cache_contents.setdefault('sizes', {}))
 
   # If the user of this contextmanager generates an exception, this yield
   # will effectively reraise the exception, and the rest of this function will
@@ -104,10 +150,25 @@ def execute_subprocess(cmd, cwd=None):
     raise
 
 
+def _open_url(url):
+  stream = urllib.urlopen(url)
+  code = stream.getcode()
+  if code is not None and code != 200:
+    stream.close()
+    raise IOError('Failed to download %s: HTTP status %d' % (url, code))
+  return stream
+
+
 def default_download_url():
-  """Creates a closure for downloading a file given a standard URL for it."""
+  """Creates a closure for downloading a file given a standard URL for it.
+
+  The closure also has |open_stream| attribute, a function which takes a URL
+  and returns a file-like object to read the contents. It lets a streaming
+  unpack method read the download without writing it to a file.
+  """
   def _download(url, destination_path):
     urllib.urlretrieve(url, destination_path)
+  _download.open_stream = _open_url
   return _download
 
 
@@ -124,26 +185,114 @@ def gsutil_download_url():
   return _download
 
 
+def _extract_zip_members(archive_path, names, destination_path):
+  """Extracts |names| in the zip file. This runs in a worker process."""
+  with zipfile.ZipFile(archive_path) as archive:
+    for name in names:
+      info = archive.getinfo(name)
+      mode = info.external_attr >> 16
+      path = os.path.join(destination_path, name)
+      if name.endswith('/'):
+        # The directories are created by the main process, as
+        # ZipFile.extract() fails with EEXIST if another worker creates the
+        # same directory between its check and mkdir.
+        continue
+      if stat.S_ISLNK(mode):
+        # ZipFile.extract() would write the link target as a regular file.
+        os.symlink(archive.read(info), path)
+        continue
+      archive.extract(info, destination_path)
+      # ZipFile.extract() does not restore the permissions, but the packages
+      # contain executables.
+      if stat.S_IMODE(mode):
+        os.chmod(path, stat.S_IMODE(mode))
+
+
+def _partition_zip_members(infolist, num_groups):
+  """Splits the zip members into groups of similar total compressed size."""
+  groups = [[] for _ in xrange(num_groups)]
+  sizes = [0] * num_groups
+  for info in sorted(infolist, key=lambda info: info.compress_size,
+                     reverse=True):
+    index = sizes.index(min(sizes))
+    groups[index].append(info.filename)
+    sizes[index] += info.compress_size
+  return [group for group in groups if group]
+
+
 def unpack_zip_archive(extra_args=None):
-  """Creates a closure which performs a simple unzip of an archive file."""
+  """Creates a closure which performs a simple unzip of an archive file.
+
+  The members are extracted in parallel worker processes, unless |extra_args|
+  for the unzip command are given.
+  """
   def _unpack(archive_path, destination_path):
-    args = ['unzip']
     if extra_args:
-      args.extend(extra_args)
-    args.extend(['-d', destination_path, archive_path])
-    execute_subprocess(args)
+      execute_subprocess(['unzip'] + extra_args +
+                         ['-d', destination_path, archive_path])
+      return
+    with zipfile.ZipFile(archive_path) as archive:
+      infolist = archive.infolist()
+    # Reject the members which would be extracted outside of the destination.
+    for info in infolist:
+      normpath = os.path.normpath(info.filename)
+      assert not (normpath.startswith('/') or normpath == '..' or
+                  normpath.startswith('../')), (
+          'Bad path in %s: %s' % (archive_path, info.filename))
+    # Create the directories before starting the workers, as the members in a
+    # directory are spread across them, and would race on creating it.
+    # os.path.dirname() of a directory member is the directory itself.
+    for dirname in set(os.path.dirname(info.filename) for info in infolist):
+      file_util.makedirs_safely(os.path.join(destination_path, dirname))
+    with concurrent.CheckedExecutor(concurrent.ProcessPoolExecutor()) as (
+        executor):
+      for names in _partition_zip_members(
+          infolist, multiprocessing.cpu_count()):
+        executor.submit(_extract_zip_members, archive_path, names,
+                        destination_path)
   return _unpack
 
 
 def unpack_tar_archive(compression_program=None):
-  """Creates a closure which performs a simple untar of an archive file."""
-  def _unpack(archive_path, destination_path):
+  """Creates a closure which performs a simple untar of an archive file.
+
+  The closure also has |unpack_stream| attribute, a function which takes a
+  file-like object instead of the archive path, to unpack the archive while it
+  is being downloaded.
+  """
+  def _get_command(destination_path, archive_path):
     cmd = ['tar', '--extract']
     if compression_program:
       cmd.append('--use-compress-program=' + compression_program)
     cmd.extend(['--directory=' + destination_path, '--strip-components=1',
                 '--file=' + archive_path])
-    execute_subprocess(cmd)
+    return cmd
+
+  def _unpack(archive_path, destination_path):
+    execute_subprocess(_get_command(destination_path, archive_path))
+
+  def _unpack_stream(stream, destination_path):
+    cmd = _get_command(destination_path, '-')
+    with tempfile.TemporaryFile() as output:
+      p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=output,
+                           stderr=subprocess.STDOUT)
+      try:
+        shutil.copyfileobj(stream, p.stdin, _STREAM_CHUNK_SIZE)
+      finally:
+        p.stdin.close()
+        returncode = p.wait()
+      output.seek(0)
+      lines = output.read().splitlines()
+    # Log the output in the same way as execute_subprocess().
+    if returncode:
+      logging.error('While running %s', cmd)
+      if lines:
+        logging.error('\n'.join(lines))
+      raise subprocess.CalledProcessError(returncode, cmd)
+    for line in lines:
+      logging.info(line)
+
+  _unpack.unpack_stream = _unpack_stream
   return _unpack
 
 
@@ -160,7 +309,8 @@ class BasicCachedPackage(object):
 
   def __init__(self, deps_file_path, unpacked_final_path, url=None,
                link_subdir=None, download_method=None, unpack_method=None,
-               cache_base_path=None, cache_history_size=None):
+               cache_base_path=None, cache_history_size=None,
+               cache_max_size=None):
     """Sets up the basic configuration for this package.
 
     |deps_file_path| is the relative path to the DEPS.XXXX file to use for this
@@ -181,6 +331,9 @@ class BasicCachedPackage(object):
     explicitly, but is really only meant for the unittest.
     |cache_history_size| allows a derived class to choose the cache history
     size, but it is really only meant for the unittest.
+    |cache_max_size| allows a derived class to choose the maximum total size
+    in bytes of the cached versions, but it is really only meant for the
+    unittest.
     """
     if cache_base_path:
       cache_base_path = os.path.abspath(cache_base_path)
@@ -188,6 +341,7 @@ class BasicCachedPackage(object):
     self._name = os.path.basename(unpacked_final_path)
     self._cache_base_path = cache_base_path or _DEFAULT_CACHE_BASE_PATH
     self._cache_history_size = cache_history_size or _DEFAULT_CACHE_HISTORY_SIZE
+    self._cache_max_size = cache_max_size or _DEFAULT_CACHE_MAX_SIZE
     self._deps_file_path = os.path.join(
         build_common.get_arc_root(), deps_file_path)
     self._unpacked_final_path = os.path.join(
@@ -242,15 +396,40 @@ class BasicCachedPackage(object):
   def _download_package_with_retries(self, url, download_package_path):
     self._download_method(url, download_package_path)
 
+  @build_common.with_retry_on_exception
+  def _download_and_unpack_stream_with_retries(self, open_stream,
+                                               unpack_stream):
+    # Clean out what a previous try unpacked partially.
+    file_util.rmtree(self._unpacked_cache_path, ignore_errors=True)
+    file_util.makedirs_safely(self._unpacked_cache_path)
+    stream = open_stream(self._url)
+    try:
+      unpack_stream(stream, self._unpacked_cache_path)
+    finally:
+      stream.close()
+
   def _fetch_and_cache_package(self):
     """Downloads an update file to a temp directory, and manages replacing the
-    final directory with the stage directory contents."""
+    final directory with the stage directory contents.
+
+    If both the download method and the unpack method support streaming, the
+    download is unpacked as it arrives, without being written to a file.
+    """
     try:
       # Clean out the cache unpack location.
       logging.info('%s: Cleaning %s', self._name, self._unpacked_cache_path)
       file_util.rmtree(self._unpacked_cache_path, ignore_errors=True)
       file_util.makedirs_safely(self._unpacked_cache_path)
 
+      open_stream = getattr(self._download_method, 'open_stream', None)
+      unpack_stream = getattr(self._unpack_method, 'unpack_stream', None)
+      if open_stream and unpack_stream:
+        logging.info('%s: Downloading and unpacking %s to %s', self._name,
+                     self._url, self._unpacked_cache_path)
+        self._download_and_unpack_stream_with_retries(open_stream,
+                                                      unpack_stream)
+        return
+
       # Setup the temporary location for the download.
       tmp_dir = tempfile.mkdtemp()
       try:
@@ -275,10 +454,19 @@ class BasicCachedPackage(object):
   def touch_all_files_in_cache(self):
     logging.info('%s: Touching all files in cache %s', self._name,
                  self.unpacked_linked_cache_path)
-    cache_path = self.unpacked_linked_cache_path
-    for dirpath, dirnames, filenames in os.walk(cache_path):
+    # Set the same time to all the files in a single pass. Unlike
+    # file_util.touch(), this does not open each file.
+    now = time.time()
+    for dirpath, dirnames, filenames in os.walk(
+        self.unpacked_linked_cache_path):
       for filename in filenames:
-        file_util.touch(os.path.join(cache_path, dirpath, filename))
+        path = os.path.join(dirpath, filename)
+        try:
+          os.utime(path, (now, now))
+        except OSError:
+          # E.g. a dangling symbolic link.
+          if os.path.exists(path):
+            raise
 
   def populate_final_directory(self):
     """Sets up the final location for the download from the cache."""
@@ -330,7 +518,8 @@ class BasicCachedPackage(object):
     start = time.time()
 
     with _persisted_cache_history(self._name, self._cache_base_path,
-                                  self._cache_history_size) as history:
+                                  self._cache_history_size,
+                                  self._cache_max_size) as history:
       # Maintain a recent used history of entries for this path.
       history.ensure_recent(self._unpacked_cache_path)
 
@@ -367,6 +556,9 @@ class BasicCachedPackage(object):
         # Write out the updated stamp file
         cached_stamp_file.update()
 
+        # The size of the entry is recomputed when it is next needed.
+        history.invalidate_size(self._unpacked_cache_path)
+
       # Reset the mtime on all the entries in the cache.
       self.touch_all_files_in_cache()
 
@@ -5,10 +5,13 @@
 """Tests for download_package_util."""
 
 import logging
+import multiprocessing
 import os
 import shutil
+import stat
 import tempfile
 import unittest
+import zipfile
 
 from src.build.util import download_package_util
 
@@ -242,5 +245,113 @@ class DownloadPackageUtilTest(unittest.TestCase):
     self.assertTrue(self._check_cache('v5'))
     self.assertTrue(self._check_final('v5'))
 
+
+class UnpackTest(unittest.TestCase):
+  def setUp(self):
+    self._tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+  def test_unpack_zip_archive(self):
+    archive_path = os.path.join(self._tmpdir, 'test.zip')
+    with zipfile.ZipFile(archive_path, 'w') as archive:
+      for i in xrange(20):
+        archive.writestr('dir/file%d' % i, 'content%d' % i)
+      info = zipfile.ZipInfo('dir/run.sh')
+      info.external_attr = (stat.S_IFREG | 0755) << 16
+      archive.writestr(info, '#!/bin/sh\n')
+      info = zipfile.ZipInfo('link')
+      info.external_attr = (stat.S_IFLNK | 0777) << 16
+      archive.writestr(info, 'dir/file0')
+
+    destination_path = os.path.join(self._tmpdir, 'out')
+    os.mkdir(destination_path)
+    download_package_util.unpack_zip_archive()(archive_path, destination_path)
+
+    for i in xrange(20):
+      with open(os.path.join(destination_path, 'dir', 'file%d' % i)) as f:
+        self.assertEqual('content%d' % i, f.read())
+    self.assertTrue(
+        os.access(os.path.join(destination_path, 'dir', 'run.sh'), os.X_OK))
+    self.assertEqual('dir/file0',
+                     os.readlink(os.path.join(destination_path, 'link')))
+
+  def test_unpack_zip_archive_in_many_workers(self):
+    # Members in the same directories are extracted in different workers,
+    # which must not fail on creating the directories concurrently.
+    archive_path = os.path.join(self._tmpdir, 'test.zip')
+    names = ['a/b/c/d%d/f%d' % (i, j) for i in xrange(8) for j in xrange(8)]
+    with zipfile.ZipFile(archive_path, 'w') as archive:
+      archive.writestr('a/b/empty/', '')
+      for name in names:
+        archive.writestr(name, name)
+
+    original_cpu_count = multiprocessing.cpu_count
+    multiprocessing.cpu_count = lambda: 16
+    try:
+      for i in xrange(5):
+        destination_path = os.path.join(self._tmpdir, 'out%d' % i)
+        os.mkdir(destination_path)
+        download_package_util.unpack_zip_archive()(
+            archive_path, destination_path)
+        for name in names:
+          with open(os.path.join(destination_path, name)) as f:
+            self.assertEqual(name, f.read())
+        self.assertTrue(
+            os.path.isdir(os.path.join(destination_path, 'a/b/empty')))
+    finally:
+      multiprocessing.cpu_count = original_cpu_count
+
+  def test_unpack_tar_stream(self):
+    source_path = os.path.join(self._tmpdir, 'pkg')
+    os.makedirs(os.path.join(source_path, 'dir'))
+    with open(os.path.join(source_path, 'dir', 'file'), 'w') as f:
+      f.write('content')
+    archive_path = os.path.join(self._tmpdir, 'test.tar')
+    download_package_util.execute_subprocess(
+        ['tar', '--create', '--file=' + archive_path, '--directory=' +
+         self._tmpdir, 'pkg'])
+
+    destination_path = os.path.join(self._tmpdir, 'out')
+    os.mkdir(destination_path)
+    unpack = download_package_util.unpack_tar_archive()
+    with open(archive_path) as stream:
+      unpack.unpack_stream(stream, destination_path)
+    with open(os.path.join(destination_path, 'dir', 'file')) as f:
+      self.assertEqual('content', f.read())
+
+
+class CacheHistoryTest(unittest.TestCase):
+  def setUp(self):
+    self._base_path = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self._base_path, ignore_errors=True)
+
+  def _create_entry(self, name, size):
+    path = os.path.join(self._base_path, name)
+    os.mkdir(path)
+    with open(os.path.join(path, 'data'), 'w') as f:
+      f.write('x' * size)
+    return path
+
+  def test_clean_old_by_size(self):
+    contents = []
+    history = download_package_util.CacheHistory(
+        'test', self._base_path, 3, contents, max_size=250)
+    for name in ('v1', 'v2', 'v3'):
+      history.ensure_recent(self._create_entry(name, 100))
+    history.clean_old()
+    self.assertEqual(['v2', 'v3'], [os.path.basename(path)
+                                    for path in contents])
+    self.assertFalse(os.path.exists(os.path.join(self._base_path, 'v1')))
+
+    # The most recent entry is kept even if it alone exceeds the limit.
+    history.ensure_recent(self._create_entry('v4', 300))
+    history.clean_old()
+    self.assertEqual(['v4'], [os.path.basename(path) for path in contents])
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,377 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Reads the symbol tables of ELF files without running nm.
+
+The symbol checks in the build run for every object file, and forking nm (and
+sed and sort to process its output) for each of them took a large share of an
+incremental build. This module reads .symtab or .dynsym directly with mmap.
+32-bit and 64-bit ELF files of either endianness are supported, as well as ar
+archives of them, including thin archives.
+
+Each symbol is represented with its name and the type letter nm shows for it,
+so that the callers can filter the symbols in the same way as they did with
+the output of nm. Note that the version names of the dynamic symbols, which
+recent versions of nm append to the names, are not read.
+"""
+
+import collections
+import errno
+import hashlib
+import marshal
+import mmap
+import operator
+import os
+import struct
+
+from src.build.util import file_util
+
+_CACHE_VERSION = 0
+
+# The SHA-1 of the source of this module. See _get_code_hash().
+_code_hash = None
+
+# build_common is not imported to compute the ARC root, as this module is
+# imported by the scripts run for each object file, and build_common takes
+# longer to import than reading the symbols.
+_ARC_ROOT = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), '..', '..', '..'))
+
+_ELF_MAGIC = '\x7fELF'
+_ELFCLASS32 = 1
+_ELFCLASS64 = 2
+_ELFDATA2LSB = 1
+_ELFDATA2MSB = 2
+
+_SHT_SYMTAB = 2
+_SHT_NOBITS = 8
+_SHT_DYNSYM = 11
+_SHT_SYMTAB_SHNDX = 18
+
+_SHF_WRITE = 0x1
+_SHF_ALLOC = 0x2
+_SHF_EXECINSTR = 0x4
+
+_SHN_UNDEF = 0
+_SHN_ABS = 0xfff1
+_SHN_COMMON = 0xfff2
+_SHN_XINDEX = 0xffff
+
+_STB_LOCAL = 0
+_STB_WEAK = 2
+_STB_GNU_UNIQUE = 10
+
+_STT_OBJECT = 1
+_STT_SECTION = 3
+_STT_FILE = 4
+_STT_GNU_IFUNC = 10
+
+_AR_MAGIC = '!<arch>\n'
+_AR_THIN_MAGIC = '!<thin>\n'
+_AR_HEADER = struct.Struct('16s12s6s6s8s10s2s')
+
+
+class ElfError(Exception):
+  pass
+
+
+class Symbol(collections.namedtuple('Symbol', ['name', 'type', 'binding'])):
+  """A symbol with the type letter nm shows, such as 'T' or 'U'.
+
+  |binding| is the STB_* value of the symbol.
+  """
+
+  def is_defined(self):
+    return self.type not in 'Uvw'
+
+  def is_external(self):
+    """Returns True if nm shows the symbol with --extern-only."""
+    # The type letter is not enough, as nm shows 'i' for both local and global
+    # indirect functions.
+    return self.binding != _STB_LOCAL
+
+
+class _ElfFormat(object):
+  """Holds the structures of an ELF file of a class and an endianness."""
+
+  def __init__(self, elf_class, data):
+    endian = '<' if data == _ELFDATA2LSB else '>'
+    if elf_class == _ELFCLASS32:
+      self.header = struct.Struct(endian + '16xHHIIIIIHHHHHH')
+      self.section_header = struct.Struct(endian + 'IIIIIIIIII')
+      self.symbol = struct.Struct(endian + 'IIIBBH')
+      # The indices of st_name, st_info and st_shndx.
+      self.symbol_fields = operator.itemgetter(0, 3, 5)
+    else:
+      self.header = struct.Struct(endian + '16xHHIQQQIHHHHHH')
+      self.section_header = struct.Struct(endian + 'IIQQQQIIQQ')
+      self.symbol = struct.Struct(endian + 'IBBHQQ')
+      self.symbol_fields = operator.itemgetter(0, 1, 3)
+    self.word = struct.Struct(endian + 'I')
+
+
+_Section = collections.namedtuple(
+    '_Section', ['type', 'flags', 'offset', 'size', 'link'])
+
+
+def _get_type_letter(binding, symbol_type, shndx, sections):
+  """Returns the type letter of a symbol in the same way as nm."""
+  if shndx == _SHN_COMMON:
+    return 'C'
+  if shndx == _SHN_UNDEF:
+    if binding == _STB_WEAK:
+      return 'v' if symbol_type == _STT_OBJECT else 'w'
+    return 'U'
+  if symbol_type == _STT_GNU_IFUNC:
+    return 'i'
+  if binding == _STB_WEAK:
+    return 'V' if symbol_type == _STT_OBJECT else 'W'
+  if binding == _STB_GNU_UNIQUE:
+    return 'u'
+  if shndx == _SHN_ABS:
+    letter = 'A'
+  elif shndx >= len(sections):
+    letter = '?'
+  else:
+    section = sections[shndx]
+    if section.flags & _SHF_EXECINSTR:
+      letter = 'T'
+    elif not section.flags & _SHF_ALLOC:
+      letter = 'N'
+    elif section.type == _SHT_NOBITS:
+      letter = 'B'
+    elif section.flags & _SHF_WRITE:
+      letter = 'D'
+    else:
+      letter = 'R'
+  return letter.lower() if binding == _STB_LOCAL else letter
+
+
+def _read_elf_symbols(data, offset, dynamic):
+  """Reads the symbols of the ELF file at |offset| of |data|."""
+  if data[offset:offset + 4] != _ELF_MAGIC:
+    raise ElfError('Not an ELF file')
+  elf_class = ord(data[offset + 4])
+  elf_data = ord(data[offset + 5])
+  if (elf_class not in (_ELFCLASS32, _ELFCLASS64) or
+      elf_data not in (_ELFDATA2LSB, _ELFDATA2MSB)):
+    raise ElfError('Unknown ELF class or data encoding')
+  elf_format = _ElfFormat(elf_class, elf_data)
+
+  try:
+    header = elf_format.header.unpack_from(data, offset)
+    shoff, shentsize, shnum = header[5], header[10], header[11]
+    if not shoff:
+      return []
+    sections = []
+    for i in xrange(shnum or 1):
+      fields = elf_format.section_header.unpack_from(
+          data, offset + shoff + i * shentsize)
+      sections.append(_Section(fields[1], fields[2], fields[4], fields[5],
+                               fields[6]))
+    if not shnum:
+      # The number of the sections does not fit in the header, and is stored in
+      # the first section header instead.
+      for i in xrange(1, sections[0].size):
+        fields = elf_format.section_header.unpack_from(
+            data, offset + shoff + i * shentsize)
+        sections.append(_Section(fields[1], fields[2], fields[4], fields[5],
+                                 fields[6]))
+  except struct.error:
+    raise ElfError('Truncated ELF file')
+  return _read_symbol_table(data, offset, elf_format, sections,
+                            _SHT_DYNSYM if dynamic else _SHT_SYMTAB)
+
+
+def _read_symbol_table(data, offset, elf_format, sections, section_type):
+  symtab_index = next((i for i, section in enumerate(sections)
+                       if section.type == section_type), None)
+  if symtab_index is None:
+    return []
+  symtab = sections[symtab_index]
+  if symtab.link >= len(sections):
+    raise ElfError('Invalid string table index')
+  strtab_offset = offset + sections[symtab.link].offset
+  shndx_table = next((section for section in sections
+                      if section.type == _SHT_SYMTAB_SHNDX and
+                      section.link == symtab_index), None)
+
+  symbol_struct = elf_format.symbol
+  symbol_fields = elf_format.symbol_fields
+  symbols = []
+  try:
+    # The first entry is the null symbol.
+    for i in xrange(1, symtab.size / symbol_struct.size):
+      name_offset, info, shndx = symbol_fields(symbol_struct.unpack_from(
+          data, offset + symtab.offset + i * symbol_struct.size))
+      binding, symbol_type = info >> 4, info & 0xf
+      if symbol_type in (_STT_SECTION, _STT_FILE):
+        # nm shows them only with --debug-syms.
+        continue
+      if shndx == _SHN_XINDEX and shndx_table:
+        shndx = elf_format.word.unpack_from(
+            data, offset + shndx_table.offset + i * 4)[0]
+      start = strtab_offset + name_offset
+      name = data[start:data.find('\0', start)]
+      if not name:
+        continue
+      symbols.append(Symbol(
+          name, _get_type_letter(binding, symbol_type, shndx, sections),
+          binding))
+  except struct.error:
+    raise ElfError('Truncated symbol table')
+  return symbols
+
+
+def _read_archive_symbols(path, data, dynamic, read_paths):
+  """Reads the symbols of the members of an ar archive."""
+  is_thin = data[:len(_AR_THIN_MAGIC)] == _AR_THIN_MAGIC
+  long_names = ''
+  symbols = []
+  offset = len(_AR_MAGIC)
+  while offset + _AR_HEADER.size <= len(data):
+    name, _, _, _, _, size, _ = _AR_HEADER.unpack_from(data, offset)
+    offset += _AR_HEADER.size
+    size = int(size)
+    name = name.rstrip()
+    # The symbol index and the table of long names are stored in the archive
+    # even if it is thin.
+    if name in ('/', '/SYM64/'):
+      pass
+    elif name == '//':
+      long_names = data[offset:offset + size]
+    else:
+      if name.startswith('/'):
+        start = int(name[1:])
+        name = long_names[start:long_names.index('/\n', start)]
+      else:
+        name = name.rstrip('/')
+      if is_thin:
+        member_path = os.path.join(os.path.dirname(path), name)
+        symbols.extend(_read_file_symbols(member_path, dynamic, read_paths))
+        continue
+      symbols.extend(_read_elf_symbols(data, offset, dynamic))
+    # Members are aligned to even offsets.
+    offset += size + (size & 1)
+  return symbols
+
+
+def _read_file_symbols(path, dynamic, read_paths):
+  read_paths.append(path)
+  with open(path, 'rb') as f:
+    if not os.fstat(f.fileno()).st_size:
+      raise ElfError('Empty file: %s' % path)
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  try:
+    if data[:len(_AR_MAGIC)] in (_AR_MAGIC, _AR_THIN_MAGIC):
+      return _read_archive_symbols(path, data, dynamic, read_paths)
+    try:
+      return _read_elf_symbols(data, 0, dynamic)
+    except ElfError as e:
+      raise ElfError('%s: %s' % (path, e))
+  finally:
+    data.close()
+
+
+def _get_file_stat(path):
+  stat = os.stat(path)
+  return (stat.st_size, stat.st_mtime, stat.st_ino)
+
+
+def _get_code_hash():
+  """Returns the hash of this module, so that a change in how the symbols are
+  read invalidates the cache.
+  """
+  global _code_hash
+  if _code_hash is None:
+    with open(os.path.splitext(__file__)[0] + '.py', 'rb') as f:
+      _code_hash = hashlib.sha1(f.read()).hexdigest()
+  return _code_hash
+
+
+def _get_cache_base_dir():
+  return os.path.join(_ARC_ROOT, 'out', 'elf_symbols')
+
+
+def _get_cache_dir():
+  return os.path.join(_get_cache_base_dir(), _get_code_hash())
+
+
+def _get_cache_path(path, dynamic):
+  key = hashlib.sha1('%s\0%d' % (os.path.abspath(path), dynamic)).hexdigest()
+  return os.path.join(_get_cache_dir(), key[:2], key)
+
+
+def _remove_stale_caches():
+  """Removes the caches written by the other versions of this module."""
+  base_dir = _get_cache_base_dir()
+  try:
+    names = os.listdir(base_dir)
+  except OSError as e:
+    if e.errno == errno.ENOENT:
+      return
+    raise
+  for name in names:
+    if name != _get_code_hash():
+      file_util.rmtree(os.path.join(base_dir, name), ignore_errors=True)
+
+
+def _load_cache(cache_path):
+  """Returns the symbols in |cache_path| if the files they are read from are
+  unchanged. Otherwise returns None.
+  """
+  try:
+    with open(cache_path, 'rb') as f:
+      data = marshal.load(f)
+  except (EOFError, ValueError, TypeError):
+    return None
+  except IOError as e:
+    if e.errno == errno.ENOENT:
+      return None
+    raise
+  if not data or data.get('version') != _CACHE_VERSION:
+    return None
+  try:
+    if any(_get_file_stat(path) != tuple(stat)
+           for path, stat in data['files']):
+      return None
+  except OSError:
+    return None
+  return [Symbol(*symbol) for symbol in data['symbols']]
+
+
+def read_symbols(path, dynamic=False, use_cache=False):
+  """Returns the list of the symbols in an ELF file, or an archive of them.
+
+  The symbols are read from .dynsym if |dynamic| is True, or from .symtab
+  otherwise, like 'nm -D' and 'nm' respectively. The symbols are listed in the
+  order of the symbol table. Raises ElfError if |path| is not an ELF file.
+
+  If |use_cache| is True, the symbols are cached in out/elf_symbols, and
+  reused while the files they are read from have the same size, mtime and
+  inode number, and this module is unchanged.
+  """
+  if not use_cache:
+    return _read_file_symbols(path, dynamic, [])
+
+  cache_path = _get_cache_path(path, dynamic)
+  symbols = _load_cache(cache_path)
+  if symbols is not None:
+    return symbols
+  read_paths = []
+  # Take the stats before reading, so that a file modified while reading is
+  # read again next time.
+  stats = [(path, _get_file_stat(path))]
+  symbols = _read_file_symbols(path, dynamic, read_paths)
+  stats.extend((member_path, _get_file_stat(member_path))
+               for member_path in read_paths[1:])
+  data = {'version': _CACHE_VERSION, 'files': stats,
+          'symbols': [tuple(symbol) for symbol in symbols]}
+  if not os.path.isdir(_get_cache_dir()):
+    # This is the first write since this module was changed.
+    _remove_stale_caches()
+  file_util.makedirs_safely(os.path.dirname(cache_path))
+  file_util.generate_file_atomically(
+      cache_path, lambda f: marshal.dump(data, f))
+  return symbols
@@ -0,0 +1,233 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unittest for elf_symbols.py."""
+
+import marshal
+import os
+import struct
+import tempfile
+import unittest
+
+from src.build.util import elf_symbols
+from src.build.util import file_util
+
+# The sections of the ELF files made by _make_elf(), after the null section:
+# (sh_type, sh_flags)
+_SECTIONS = [
+    (1, 0x6),  # .text
+    (1, 0x3),  # .data
+    (8, 0x3),  # .bss
+    (1, 0x2),  # .rodata
+]
+_TEXT, _DATA, _BSS, _RODATA = range(1, 5)
+_SYMTAB_INDEX = 5
+
+
+def _pack_symbol(elf_class, symbol_struct, name, info, shndx):
+  """Packs a symbol in the order of the fields for |elf_class|."""
+  if elf_class == 1:
+    return symbol_struct.pack(name, 0, 0, info, 0, shndx)
+  return symbol_struct.pack(name, info, 0, shndx, 0, 0)
+
+
+def _make_elf(elf_class, endian, symbols, dynamic=False):
+  """Returns the content of an ELF file which has |symbols|.
+
+  |symbols| is a list of (name, binding, type, shndx).
+  """
+  if elf_class == 1:
+    symbol_struct = struct.Struct(endian + 'IIIBBH')
+    header = struct.Struct(endian + '16sHHIIIIIHHHHHH')
+    section_header = struct.Struct(endian + 'IIIIIIIIII')
+  else:
+    symbol_struct = struct.Struct(endian + 'IBBHQQ')
+    header = struct.Struct(endian + '16sHHIQQQIHHHHHH')
+    section_header = struct.Struct(endian + 'IIQQQQIIQQ')
+
+  strtab = '\0'
+  symtab = _pack_symbol(elf_class, symbol_struct, 0, 0, 0)
+  for name, binding, symbol_type, shndx in symbols:
+    symtab += _pack_symbol(elf_class, symbol_struct, len(strtab),
+                           binding << 4 | symbol_type, shndx)
+    strtab += name + '\0'
+
+  strtab_offset = header.size
+  symtab_offset = strtab_offset + len(strtab)
+  shoff = symtab_offset + len(symtab)
+  sections = [(0, 0, 0, 0, 0)] + [
+      (sh_type, sh_flags, 0, 0, 0) for sh_type, sh_flags in _SECTIONS] + [
+      (11 if dynamic else 2, 0, symtab_offset, len(symtab), _SYMTAB_INDEX + 1),
+      (3, 0, strtab_offset, len(strtab), 0)]
+  ident = '\x7fELF' + chr(elf_class) + chr(1 if endian == '<' else 2) + '\1'
+  content = header.pack(ident, 1, 0, 1, 0, 0, shoff, 0, header.size, 0, 0,
+                        section_header.size, len(sections), 0)
+  content += strtab + symtab
+  for sh_type, sh_flags, offset, size, link in sections:
+    content += section_header.pack(0, sh_type, sh_flags, 0, offset, size,
+                                   link, 0, 0, 0)
+  return content
+
+
+def _make_ar_member(name, content, size=None):
+  """Returns a member of an ar archive, padded to an even size.
+
+  |size| is stored in the header instead of the size of |content| if given,
+  for the members of thin archives.
+  """
+  if size is None:
+    size = len(content)
+  header = '%-16s%-12d%-6d%-6d%-8o%-10d`\n' % (name, 0, 0, 0, 0644, size)
+  return header + content + '\n' * (len(content) & 1)
+
+
+def _read_symbols(path, **kwargs):
+  """Returns the pairs of the name and the type of the symbols in |path|."""
+  return [symbol[:2] for symbol in elf_symbols.read_symbols(path, **kwargs)]
+
+
+_SYMBOLS = [
+    ('local_func', 0, 2, _TEXT),
+    ('global_func', 1, 2, _TEXT),
+    ('weak_func', 2, 2, _TEXT),
+    ('global_data', 1, 1, _DATA),
+    ('weak_data', 2, 1, _DATA),
+    ('global_bss', 1, 1, _BSS),
+    ('local_rodata', 0, 1, _RODATA),
+    ('common', 1, 1, 0xfff2),
+    ('absolute', 1, 0, 0xfff1),
+    ('ifunc', 1, 10, _TEXT),
+    ('undefined', 1, 0, 0),
+    ('weak_undefined', 2, 0, 0),
+    ('weak_undefined_object', 2, 1, 0),
+    ('section', 0, 3, _TEXT),
+    ('file.c', 0, 4, 0xfff1),
+]
+
+_EXPECTED_SYMBOLS = [
+    ('local_func', 't'),
+    ('global_func', 'T'),
+    ('weak_func', 'W'),
+    ('global_data', 'D'),
+    ('weak_data', 'V'),
+    ('global_bss', 'B'),
+    ('local_rodata', 'r'),
+    ('common', 'C'),
+    ('absolute', 'A'),
+    ('ifunc', 'i'),
+    ('undefined', 'U'),
+    ('weak_undefined', 'w'),
+    ('weak_undefined_object', 'v'),
+]
+
+
+class ElfSymbolsTest(unittest.TestCase):
+  def setUp(self):
+    self._root = tempfile.mkdtemp()
+
+  def tearDown(self):
+    file_util.rmtree(self._root, ignore_errors=True)
+
+  def _write_file(self, name, content):
+    path = os.path.join(self._root, name)
+    with open(path, 'wb') as f:
+      f.write(content)
+    return path
+
+  def test_read_symbols(self):
+    for elf_class in (1, 2):
+      for endian in ('<', '>'):
+        path = self._write_file('foo.o', _make_elf(elf_class, endian, _SYMBOLS))
+        self.assertEquals(_EXPECTED_SYMBOLS, _read_symbols(path))
+        # The object has no .dynsym.
+        self.assertEquals([], _read_symbols(path, dynamic=True))
+
+  def test_read_dynamic_symbols(self):
+    path = self._write_file(
+        'foo.so', _make_elf(2, '<', _SYMBOLS[:2], dynamic=True))
+    self.assertEquals([('local_func', 't'), ('global_func', 'T')],
+                      _read_symbols(path, dynamic=True))
+    self.assertEquals([], _read_symbols(path))
+
+  def test_symbol(self):
+    defined = [symbol.name
+               for symbol in elf_symbols.read_symbols(
+                   self._write_file('foo.o', _make_elf(2, '<', _SYMBOLS)))
+               if symbol.is_defined() and symbol.is_external()]
+    self.assertEquals(['global_func', 'weak_func', 'global_data', 'weak_data',
+                       'global_bss', 'common', 'absolute', 'ifunc'], defined)
+
+  def test_read_archive(self):
+    foo = _make_elf(2, '<', [('foo', 1, 2, _TEXT)])
+    bar = _make_elf(1, '<', [('bar', 1, 0, 0)])
+    long_name = 'a_long_name_of_object.o'
+    long_names = long_name + '/\n'
+    path = self._write_file('libfoo.a', ''.join([
+        '!<arch>\n',
+        _make_ar_member('/', '\0\0\0\0'),
+        _make_ar_member('//', long_names),
+        _make_ar_member('/0', foo),
+        _make_ar_member('bar.o/', bar)]))
+    self.assertEquals([('foo', 'T'), ('bar', 'U')], _read_symbols(path))
+
+  def test_read_thin_archive(self):
+    self._write_file('foo.o', _make_elf(2, '<', [('foo', 1, 2, _TEXT)]))
+    long_names = 'foo.o/\n'
+    path = self._write_file('libfoo.a', ''.join([
+        '!<thin>\n',
+        _make_ar_member('//', long_names),
+        _make_ar_member('/0', '', size=100)]))
+    self.assertEquals([('foo', 'T')], _read_symbols(path))
+
+  def test_cache(self):
+    original_arc_root = elf_symbols._ARC_ROOT
+    elf_symbols._ARC_ROOT = self._root
+    try:
+      path = self._write_file(
+          'foo.o', _make_elf(2, '<', [('foo', 1, 2, _TEXT)]))
+      self.assertEquals([('foo', 'T')], _read_symbols(path, use_cache=True))
+      self.assertTrue(os.path.exists(elf_symbols._get_cache_path(path, False)))
+      self.assertEquals([('foo', 'T')], _read_symbols(path, use_cache=True))
+
+      # Rewriting the file invalidates the cache.
+      os.remove(path)
+      path = self._write_file(
+          'foo.o', _make_elf(2, '<', [('foobar', 1, 2, _TEXT)]))
+      self.assertEquals([('foobar', 'T')], _read_symbols(path, use_cache=True))
+    finally:
+      elf_symbols._ARC_ROOT = original_arc_root
+
+  def test_cache_invalidated_by_code_change(self):
+    original_arc_root = elf_symbols._ARC_ROOT
+    original_code_hash = elf_symbols._code_hash
+    elf_symbols._ARC_ROOT = self._root
+    try:
+      path = self._write_file(
+          'foo.o', _make_elf(2, '<', [('foo', 1, 2, _TEXT)]))
+      _read_symbols(path, use_cache=True)
+      # Make the cache look like it was written by an older version of the
+      # reader, which read the symbols differently.
+      cache_path = elf_symbols._get_cache_path(path, False)
+      with open(cache_path, 'rb') as f:
+        data = marshal.load(f)
+      data['symbols'] = [('foo', 'D', 1)]
+      with open(cache_path, 'wb') as f:
+        marshal.dump(data, f)
+      self.assertEquals([('foo', 'D')], _read_symbols(path, use_cache=True))
+
+      elf_symbols._code_hash = 'new'
+      self.assertEquals([('foo', 'T')], _read_symbols(path, use_cache=True))
+      # The caches of the older version are removed.
+      self.assertFalse(os.path.exists(cache_path))
+    finally:
+      elf_symbols._ARC_ROOT = original_arc_root
+      elf_symbols._code_hash = original_code_hash
+
+  def test_not_elf(self):
+    path = self._write_file('foo.txt', 'foo')
+    self.assertRaises(elf_symbols.ElfError, elf_symbols.read_symbols, path)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -110,6 +110,27 @@ def write_atomically(filepath, content):
   generate_file_atomically(filepath, lambda f: f.write(content))
 
 
+def write_atomically_if_changed(filepath, content):
+  """Writes content to a file atomically, unless the file has the same content.
+
+  Leaving the unchanged file as is keeps its mtime, so that the tools checking
+  the file, such as ninja, do not treat it as modified. Returns True if the
+  file is written.
+  """
+  try:
+    with open(filepath, 'rb') as f:
+      # Check the size first to avoid reading the file most of the times it is
+      # changed.
+      if (os.fstat(f.fileno()).st_size == len(content) and
+          f.read() == content):
+        return False
+  except IOError as e:
+    if e.errno != errno.ENOENT:
+      raise
+  write_atomically(filepath, content)
+  return True
+
+
 def generate_file_atomically(filepath, generator):
   """Generate a file atomically.
 
@@ -10,6 +10,7 @@ read on Windows is more complicated, so we rely on fcntl for now to keep the
 implementation simpler.
 """
 
+import collections
 import errno
 import fcntl
 import io
@@ -18,7 +19,7 @@ import os
 _READ_DATA_SIZE = 4096
 
 
-def _set_nonblocking(fd):
+def set_nonblocking(fd):
   """Set non-blocking flag to the given file descriptor."""
   flags = fcntl.fcntl(fd, fcntl.F_GETFL)
   fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
@@ -54,6 +55,43 @@ def _read_available_data(fd):
   return ''.join(result), eof
 
 
+class LineBuffer(object):
+  """Splits data read from a stream into lines incrementally.
+
+  Data which does not end with os.linesep is kept as pending chunks, and is
+  joined only once the line is completed. So a long line read in many small
+  chunks does not need to be copied on each read.
+  """
+
+  def __init__(self):
+    self._pending = []
+
+  def feed(self, data):
+    """Returns a list of the lines completed by |data|.
+
+    Each line keeps its trailing EOL character.
+    """
+    if not data:
+      return []
+    self._pending.append(data)
+    if os.linesep not in data:
+      return []
+    read_data = ''.join(self._pending)
+    split_lines = read_data.splitlines(True)  # Keep trailing EOL character.
+    if read_data.endswith(os.linesep):
+      self._pending = []
+    else:
+      # More data will be followed for the last line. Keep it as pending.
+      self._pending = [split_lines.pop()]
+    return split_lines
+
+  def flush(self):
+    """Returns a list of the pending lines, for the stream reached to EOF."""
+    split_lines = ''.join(self._pending).splitlines(True)
+    self._pending = []
+    return split_lines
+
+
 class LineReader(object):
   """ Wraps a file-like object to allow non-blocking reads of its lines.
 
@@ -83,13 +121,13 @@ class LineReader(object):
     """
     assert stream
     self._stream = stream
-    _set_nonblocking(stream.fileno())
-    self._pending = ''
-    self._lines = []
+    set_nonblocking(stream.fileno())
+    self._buffer = LineBuffer()
+    self._lines = collections.deque()
 
   def close(self):
     # Clear pending data.
-    self._pending = None
+    self._buffer = None
     self._lines = None
     return self._stream.close()
 
@@ -136,24 +174,16 @@ class LineReader(object):
       raise ValueError('I/O operation on closed file')
 
     if self._lines:
-      return self._lines.pop(0)
+      return self._lines.popleft()
 
     # Read available data from the file descriptor as much as possible.
     read_data, eof = _read_available_data(self._stream.fileno())
-    if self._pending:
-      read_data = self._pending + read_data
-    split_lines = read_data.splitlines(True)  # Keep trailing EOL character.
+    self._lines.extend(self._buffer.feed(read_data))
+    if eof:
+      self._lines.extend(self._buffer.flush())
 
-    if not eof and read_data and not read_data.endswith(os.linesep):
-      # More data will be followed for the last line. Keep it as pending.
-      self._pending = split_lines.pop()
-    else:
-      self._pending = ''
-
-    if not split_lines:
+    if not self._lines:
       if not eof:
         raise io.BlockingIOError(errno.EAGAIN, LineReader._EAGAIN_MESSAGE)
       return ''
-
-    self._lines = split_lines[1:]
-    return split_lines[0]
+    return self._lines.popleft()
@@ -124,5 +124,18 @@ class TestNonBlockingLineReader(unittest.TestCase):
     self.assertTrue(eof)
 
 
+class TestLineBuffer(unittest.TestCase):
+  def test_feed(self):
+    buf = nonblocking_io.LineBuffer()
+    self.assertListEqual([], buf.feed(''))
+    self.assertListEqual([], buf.feed('ab'))
+    self.assertListEqual([], buf.feed('cd'))
+    self.assertListEqual(['abcde\n', '123\n'], buf.feed('e\n123\n'))
+    self.assertListEqual(['456\n'], buf.feed('456\nvw'))
+    self.assertListEqual([], buf.feed('xyz'))
+    self.assertListEqual(['vwxyz'], buf.flush())
+    self.assertListEqual([], buf.flush())
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -4,12 +4,193 @@
 
 """Identify Python code dependencies."""
 
+import errno
+import hashlib
+import imp
+import marshal
 import modulefinder
 import os
 import sys
 
 from src.build import build_common
 from src.build import dependency_inspection
+from src.build.build_options import OPTIONS
+from src.build.util import file_util
+
+_IMPORT_GRAPH_CACHE_VERSION = 0
+
+
+class _ImportGraph(object):
+  """Caches the modules each Python module imports directly.
+
+  A node of the graph is a pair of the fully qualified module name and the
+  absolute path of the module file, as the implicit relative imports of Python
+  2 are resolved differently depending on the package of the importer. Only
+  the modules in the project are recorded.
+
+  An entry is fresh if the module file has the same mtime, and all the files it
+  imports still exist. Note that an entry is not invalidated by a new module
+  which would shadow one of its imports.
+
+  If |cache_dir| is given, each entry is also saved to a file in it, so that it
+  is shared with other processes.
+  """
+
+  def __init__(self, search_path, cache_dir=None):
+    self._search_path_key = '\0'.join(search_path)
+    self._cache_dir = cache_dir
+    self._entries = {}
+    # The nodes checked to be fresh in this process. The source files are not
+    # expected to be modified while running configure.
+    self._fresh_nodes = set()
+
+  def _get_cache_path(self, node):
+    key = hashlib.sha1('\0'.join(
+        [str(_IMPORT_GRAPH_CACHE_VERSION), self._search_path_key] +
+        list(node))).hexdigest()
+    return os.path.join(self._cache_dir, key[:2], key)
+
+  def _load_entry(self, node):
+    if not self._cache_dir:
+      return None
+    try:
+      with open(self._get_cache_path(node), 'rb') as f:
+        return marshal.load(f)
+    except (EOFError, ValueError, TypeError):
+      return None
+    except IOError as e:
+      if e.errno == errno.ENOENT:
+        return None
+      raise
+
+  def get_imports(self, node):
+    """Returns the list of nodes |node| imports, or None if not fresh."""
+    if node in self._fresh_nodes:
+      return self._entries[node][1]
+    entry = self._entries.get(node)
+    if entry is None:
+      entry = self._load_entry(node)
+    if entry is None:
+      return None
+    mtime, imports = entry
+    try:
+      if os.stat(node[1]).st_mtime != mtime:
+        return None
+    except OSError:
+      return None
+    if not all(os.path.exists(path) for _, path in imports):
+      return None
+    self._entries[node] = entry
+    self._fresh_nodes.add(node)
+    return imports
+
+  def set_imports(self, node, mtime, imports):
+    entry = (mtime, sorted(imports))
+    self._entries[node] = entry
+    self._fresh_nodes.add(node)
+    if self._cache_dir:
+      cache_path = self._get_cache_path(node)
+      file_util.makedirs_safely(os.path.dirname(cache_path))
+      file_util.generate_file_atomically(
+          cache_path, lambda f: marshal.dump(entry, f))
+
+
+class _CachedModuleFinder(modulefinder.ModuleFinder):
+  """ModuleFinder which skips parsing modules cached in |import_graph|.
+
+  Instead of parsing a cached module, the modules it imports are loaded from
+  the cache recursively. Modules outside of the project are not parsed at all,
+  as they never import modules in the project.
+  """
+
+  def __init__(self, search_path, import_graph):
+    modulefinder.ModuleFinder.__init__(self, search_path)
+    self._import_graph = import_graph
+    # The stack of the sets of the nodes imported by the modules being parsed.
+    self._imports_stack = []
+
+  def _add_import(self, module):
+    if module is not None and module.__file__ and self._imports_stack:
+      path = os.path.abspath(module.__file__)
+      if build_common.is_abs_path_in_project(path):
+        self._imports_stack[-1].add((module.__name__, path))
+
+  def import_module(self, partname, fqname, parent):
+    module = modulefinder.ModuleFinder.import_module(
+        self, partname, fqname, parent)
+    self._add_import(module)
+    return module
+
+  def ensure_fromlist(self, module, fromlist, recursive=0):
+    modulefinder.ModuleFinder.ensure_fromlist(
+        self, module, fromlist, recursive)
+    # ModuleFinder does not call import_module() for a submodule already
+    # imported by another module, so record it here.
+    for name in fromlist:
+      self._add_import(self.modules.get(module.__name__ + '.' + name))
+
+  def load_module(self, fqname, fp, pathname, file_info):
+    if pathname is None or file_info[2] == imp.PKG_DIRECTORY:
+      # A builtin module, or a package, whose __init__.py is loaded via
+      # load_package().
+      return modulefinder.ModuleFinder.load_module(
+          self, fqname, fp, pathname, file_info)
+
+    path = os.path.abspath(pathname)
+    if not build_common.is_abs_path_in_project(path):
+      module = self.add_module(fqname)
+      module.__file__ = pathname
+      return module
+
+    node = (fqname, path)
+    imports = self._import_graph.get_imports(node)
+    if imports is not None:
+      module = self.add_module(fqname)
+      module.__file__ = pathname
+      for import_node in imports:
+        self._load_cached_node(*import_node)
+      return module
+
+    mtime = os.stat(path).st_mtime
+    self._imports_stack.append(set())
+    try:
+      module = modulefinder.ModuleFinder.load_module(
+          self, fqname, fp, pathname, file_info)
+    finally:
+      imports = self._imports_stack.pop()
+    imports.discard(node)
+    self._import_graph.set_imports(node, mtime, imports)
+    return module
+
+  def _load_cached_node(self, fqname, path):
+    if fqname in self.modules:
+      return
+    if os.path.basename(path) == '__init__.py':
+      self.load_package(fqname, os.path.dirname(path))
+    elif path.endswith('.py'):
+      with open(path, 'U') as fp:
+        self.load_module(fqname, fp, path, ('.py', 'U', imp.PY_SOURCE))
+    else:
+      # Compiled modules are not parsed by ModuleFinder either.
+      self.add_module(fqname).__file__ = path
+
+
+# The import graphs for each search path, shared by find_deps() calls in this
+# process.
+_import_graph_map = {}
+
+
+def _get_import_graph(search_path):
+  key = tuple(search_path)
+  import_graph = _import_graph_map.get(key)
+  if import_graph is None:
+    cache_dir = None
+    if OPTIONS.parsed and OPTIONS.enable_config_cache():
+      cache_dir = os.path.join(build_common.get_config_cache_dir(),
+                               'python_deps')
+    import_graph = _ImportGraph(search_path, cache_dir)
+    _import_graph_map[key] = import_graph
+  return import_graph
 
 
 def find_deps(source_path, python_path=None):
@@ -29,9 +210,13 @@ def find_deps(source_path, python_path=None):
 
   If this function is called while a config.py is running, it records the output
   dependencies as dependencies of the config.py.
+
+  The imports of each module are parsed only once, and cached in an import
+  graph shared by the calls with the same |python_path|. If the config cache
+  is enabled, the graph is also persisted under the config cache directory.
   """
   python_path = build_common.as_list(python_path) + sys.path
-  finder = modulefinder.ModuleFinder(python_path)
+  finder = _CachedModuleFinder(python_path, _get_import_graph(python_path))
   finder.run_script(source_path)
 
   # Examine the paths of all the modules that were loaded. Some of the paths we
@@ -2,8 +2,12 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import os
+import sys
+import tempfile
 import unittest
 
+from src.build.util import file_util
 from src.build.util import python_deps
 
 
@@ -26,6 +30,27 @@ class TestPythonDeps(unittest.TestCase):
     for path in deps:
       self.assertNotRegexpMatches(path, r'\Wunittest\W')
 
+  def test_persisted_import_graph(self):
+    cache_dir = tempfile.mkdtemp()
+    try:
+      python_deps._import_graph_map[tuple(sys.path)] = (
+          python_deps._ImportGraph(sys.path, cache_dir))
+      deps = python_deps.find_deps('src/build/util/python_deps_test.py')
+
+      # A new graph, e.g. in another process, reads the saved imports.
+      import_graph = python_deps._ImportGraph(sys.path, cache_dir)
+      imports = import_graph.get_imports(
+          ('__main__', os.path.abspath('src/build/util/python_deps_test.py')))
+      self.assertIn(('src.build.util.python_deps',
+                     os.path.abspath('src/build/util/python_deps.py')),
+                    imports)
+      python_deps._import_graph_map[tuple(sys.path)] = import_graph
+      self.assertEquals(
+          deps, python_deps.find_deps('src/build/util/python_deps_test.py'))
+    finally:
+      python_deps._import_graph_map.clear()
+      file_util.rmtree(cache_dir)
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -9,13 +9,17 @@ Chrome OS, Windows (Cygwin), and Mac.
 """
 
 import atexit
+import fnmatch
+import hashlib
 import itertools
+import json
 import logging
 import os
 import pipes
 import shutil
 import subprocess
 import tempfile
+import uuid
 
 from src.build import build_common
 from src.build import toolchain
@@ -136,6 +140,13 @@ _TEMP_KNOWN_HOSTS = 'temp_arc_known_hosts'
 _TEMP_SSH_CONTROL_PATH = 'ssh-%r@%h:%p'
 _TEMP_REMOTE_BINARIES_DIR = 'remote_bin'
 
+# The directory to store the manifests of the files sent by
+# RemoteExecutor.rsync(), for each remote host and destination directory.
+_RSYNC_MANIFEST_DIR = 'out/rsync_manifest'
+# The file in the remote destination directory which holds the ID of the
+# manifest it is in sync with.
+_RSYNC_MANIFEST_ID_FILE = '.arc_rsync_manifest_id'
+
 
 def _get_temp_dir():
   global _TEMP_DIR
@@ -168,6 +179,81 @@ def get_remote_binaries_dir():
   return path
 
 
+def _get_file_hash(path):
+  sha1 = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1024 * 1024), ''):
+      sha1.update(chunk)
+  return sha1.hexdigest()
+
+
+class _RsyncManifest(object):
+  """Records the files sent to a remote directory by RemoteExecutor.rsync().
+
+  Each entry maps the path relative to the remote directory to the local
+  path, size, mtime and content hash of the sent file. |sync_id| is also
+  written to the remote directory, so that the manifest is used only while
+  the remote directory is known to be in sync with it.
+  """
+
+  def __init__(self, path):
+    self._path = path
+    self.sync_id = None
+    self._entries = {}
+
+  def load(self):
+    """Loads the manifest. Returns False if it is not available."""
+    try:
+      with open(self._path) as f:
+        manifest = json.load(f)
+    except (IOError, ValueError):
+      return False
+    self.sync_id = manifest['id']
+    self._entries = manifest['entries']
+    return True
+
+  def reset(self):
+    """Forgets all the entries, and assigns a new ID."""
+    self.sync_id = uuid.uuid4().hex
+    self._entries = {}
+
+  def update(self, file_map):
+    """Updates the entries to |file_map|.
+
+    Args:
+        file_map: a dict from remote relative paths to local paths.
+
+    Returns: a tuple of the sorted lists of the remote relative paths which
+        need to be sent, and which need to be removed.
+    """
+    entries = {}
+    changed_paths = []
+    for remote_path, local_path in sorted(file_map.iteritems()):
+      try:
+        st = os.stat(local_path)
+      except OSError:
+        # E.g. a dangling symbolic link, which rsync does not send either.
+        continue
+      entry = self._entries.get(remote_path)
+      if entry and entry[:3] == [local_path, st.st_size, st.st_mtime]:
+        entries[remote_path] = entry
+        continue
+      # The hash is computed only for files whose stat is changed, so a file
+      # which is just touched is not sent again.
+      content_hash = _get_file_hash(local_path)
+      if not entry or entry[1] != st.st_size or entry[3] != content_hash:
+        changed_paths.append(remote_path)
+      entries[remote_path] = [local_path, st.st_size, st.st_mtime, content_hash]
+    removed_paths = sorted(set(self._entries) - set(entries))
+    self._entries = entries
+    return changed_paths, removed_paths
+
+  def save(self):
+    file_util.makedirs_safely(os.path.dirname(self._path))
+    file_util.write_atomically(self._path, json.dumps({
+        'id': self.sync_id, 'entries': self._entries}))
+
+
 class RemoteExecutor(object):
   def __init__(self, user, remote, remote_env=None, ssh_key=None,
                enable_pseudo_tty=False, attach_nacl_gdb_type=None,
@@ -262,6 +348,12 @@ class RemoteExecutor(object):
     - Files newly created in the remote machine will be deleted. Specifically,
       if a file in the host machine is deleted, the corresponding file in the
       remote machine is also deleted after the rsync.
+    - The sent files are recorded in a manifest under out/rsync_manifest.
+      While the remote directory is in sync with the manifest, only the files
+      changed since the last rsync are sent, and only the files removed since
+      then are deleted. Files created or modified in the remote machine are
+      left as they are in that case. Remove the manifest to force a full
+      rsync.
 
     Args:
         source_paths: a list of paths to be sent. Each path can be a file or
@@ -273,42 +365,34 @@ class RemoteExecutor(object):
             sending path list. Similar to |source_paths|, if a path is
             directory, all paths under the directory will be excluded.
     """
-    filter_list = (
-        self._build_rsync_filter_list(source_paths, exclude_paths or []))
-    rsync_options = [
-        # The remote files need to be writable and executable by chronos. This
-        # option sets read, write, and execute permissions to all users.
-        '--chmod=a=rwx',
-        '--compress',
-        '--copy-links',
+    exclude_paths = exclude_paths or []
+    dest = '%s@%s:%s' % (self._user, self._remote, remote_dest_root)
+    file_map = self._build_rsync_file_map(source_paths, exclude_paths)
+    manifest = _RsyncManifest(
+        self._get_rsync_manifest_path(remote_dest_root))
+    if (manifest.load() and
+        manifest.sync_id == self._read_rsync_manifest_id(remote_dest_root)):
+      changed_paths, removed_paths = manifest.update(file_map)
+      self._rsync_files(file_map, changed_paths, dest)
+      self._remove_remote_files(removed_paths, remote_dest_root)
+      manifest.save()
+      return
+
+    # There is no manifest the remote directory is known to be in sync with.
+    # Send the whole tree.
+    manifest.reset()
+    filter_list = self._build_rsync_filter_list(source_paths, exclude_paths)
+    # Keep the manifest ID file, which is written below.
+    filter_list = ['--filter', 'P /' + _RSYNC_MANIFEST_ID_FILE] + filter_list
+    rsync_options = self._build_rsync_options() + [
         '--delete',
         '--delete-excluded',
-        '--inplace',
-        '--perms',
-        '--progress',
         '--recursive',
-        '--rsh=' + ' '.join(['ssh'] + self._build_shared_ssh_command_options()),
-        '--times',
     ]
-    dest = '%s@%s:%s' % (self._user, self._remote, remote_dest_root)
-    # Checks both whether to enable debug info and the existence of the stripped
-    # directory because build bots using test bundle may use the configure
-    # option with debug info enabled but binaries are not available in the
-    # stripped directory.
-    unstripped_paths = None
-    if (OPTIONS.is_debug_info_enabled() and
-        os.path.exists(build_common.get_stripped_dir())):
-      # When debug info is enabled, copy the corresponding stripped binaries if
-      # available to save the disk space on ChromeOS.
-      list_output = _run_command(
-          subprocess.check_output,
-          ['rsync'] + filter_list + ['.', dest] + rsync_options +
-          ['--list-only'])
-      paths = [
-          line.rsplit(' ', 1)[-1] for line in list_output.splitlines()[1:]]
-      unstripped_paths = [
-          path for path in paths if self._has_stripped_binary(path)]
-
+    unstripped_paths = sorted(
+        remote_path for remote_path, local_path in file_map.iteritems()
+        if remote_path != local_path)
+    if unstripped_paths:
       # here, prepend filter rules to "protect" and "exclude" the files which
       # have the corresponding stripped binary.
       # Note: the stripped binraies will be sync'ed by the second rsync
@@ -339,6 +423,121 @@ class RemoteExecutor(object):
                     dest_build] + rsync_options,
                    input='\n'.join(stripped_binary_relative_paths))
 
+    manifest.update(file_map)
+    self.run('echo %s > %s' % (manifest.sync_id, _RSYNC_MANIFEST_ID_FILE),
+             cwd=pipes.quote(remote_dest_root))
+    manifest.save()
+
+  def _build_rsync_options(self):
+    """Returns the rsync options shared by all rsync commands."""
+    return [
+        # The remote files need to be writable and executable by chronos. This
+        # option sets read, write, and execute permissions to all users.
+        '--chmod=a=rwx',
+        '--compress',
+        '--copy-links',
+        '--inplace',
+        '--perms',
+        '--progress',
+        '--rsh=' + ' '.join(['ssh'] + self._build_shared_ssh_command_options()),
+        '--times',
+    ]
+
+  def _build_rsync_file_map(self, source_paths, exclude_paths):
+    """Lists the files rsync() sends.
+
+    This follows the rules built by _build_rsync_filter_list(), except that
+    the protected files on the remote host are not listed.
+
+    Returns: a dict from the paths relative to the destination directory to
+        the local paths of the files to be sent. They are different only for
+        the binaries whose stripped version is sent instead.
+    """
+    exclude_paths = set(os.path.normpath(path) for path in exclude_paths)
+    exclude_patterns = build_common.COMMON_EDITOR_TMP_FILE_PATTERNS + ['*.pyc']
+
+    def is_excluded(path):
+      name = os.path.basename(path)
+      return (any(fnmatch.fnmatch(name, pattern)
+                  for pattern in exclude_patterns) or
+              any(dirpath in exclude_paths
+                  for dirpath in file_util.walk_ancestor(path)))
+
+    paths = set()
+    for source_path in source_paths:
+      source_path = os.path.normpath(source_path)
+      if is_excluded(source_path) or not os.path.exists(source_path):
+        continue
+      if not os.path.isdir(source_path):
+        paths.add(source_path)
+        continue
+      # Directory symbolic links are followed, as rsync is run with
+      # --copy-links.
+      for root, dirs, files in os.walk(source_path, followlinks=True):
+        dirs[:] = [name for name in dirs
+                   if not is_excluded(os.path.join(root, name))]
+        paths.update(os.path.join(root, name) for name in files
+                     if not is_excluded(os.path.join(root, name)))
+
+    # Checks both whether to enable debug info and the existence of the stripped
+    # directory because build bots using test bundle may use the configure
+    # option with debug info enabled but binaries are not available in the
+    # stripped directory.
+    use_stripped = (OPTIONS.is_debug_info_enabled() and
+                    os.path.exists(build_common.get_stripped_dir()))
+    file_map = {}
+    for path in paths:
+      # When debug info is enabled, copy the corresponding stripped binaries if
+      # available to save the disk space on ChromeOS.
+      stripped_path = use_stripped and self._get_stripped_binary(path)
+      file_map[path] = stripped_path or path
+    return file_map
+
+  def _get_rsync_manifest_path(self, remote_dest_root):
+    key = '%s@%s:%s:%s' % (
+        self._user, self._remote, self._port, remote_dest_root)
+    return os.path.join(_RSYNC_MANIFEST_DIR,
+                        hashlib.sha1(key).hexdigest() + '.json')
+
+  def _read_rsync_manifest_id(self, remote_dest_root):
+    """Returns the manifest ID in the remote directory, or None."""
+    path = os.path.join(remote_dest_root, _RSYNC_MANIFEST_ID_FILE)
+    return self.run_command_for_output(
+        'cat %s 2>/dev/null || true' % pipes.quote(path)).strip() or None
+
+  def _rsync_files(self, file_map, remote_paths, dest):
+    """Sends the files at |remote_paths| in |file_map| by a single rsync."""
+    if not remote_paths:
+      return
+    # A stripped binary needs to be sent to the path of its unstripped
+    # binary. To send everything at once, build a tree of symbolic links to
+    # the files, which rsync follows because of --copy-links.
+    link_root = tempfile.mkdtemp(prefix='rsync-', dir=_get_temp_dir())
+    try:
+      for remote_path in remote_paths:
+        link_path = os.path.join(link_root, remote_path)
+        file_util.makedirs_safely(os.path.dirname(link_path))
+        os.symlink(os.path.abspath(file_map[remote_path]), link_path)
+      _run_command(_check_call_with_input,
+                   ['rsync', '--files-from=-', link_root, dest] +
+                   self._build_rsync_options(),
+                   input='\n'.join(remote_paths))
+    finally:
+      file_util.rmtree(link_root)
+
+  def _remove_remote_files(self, remote_paths, remote_dest_root):
+    """Removes the files at |remote_paths| under |remote_dest_root|."""
+    if not remote_paths:
+      return
+    logging.debug('rsync removed files: %s', ', '.join(remote_paths))
+    # Always use -T, as the paths are sent via stdin.
+    ssh_cmd = (['ssh', '%s@%s' % (self._user, self._remote)] +
+               self._build_shared_command_options() +
+               ['-T', '--', 'cd %s && xargs -0 rm -f --' %
+                pipes.quote(remote_dest_root)])
+    _run_command(_check_call_with_input, ssh_cmd,
+                 input='\0'.join(remote_paths))
+
   def _build_rsync_filter_list(self, source_paths, exclude_paths):
     """Builds rsync's filter options to send |source_paths|.
 
@@ -431,16 +630,15 @@ class RemoteExecutor(object):
 
     return result
 
-  def _has_stripped_binary(self, path):
-    """Returns True if a stripped binary corresponding to |path| is found."""
+  def _get_stripped_binary(self, path):
+    """Returns the path of the stripped binary for |path|, or None."""
     relpath = os.path.relpath(path, build_common.get_build_dir())
     if relpath.startswith('../'):
       # The given file is not under build directory.
-      return False
+      return None
 
-    # Returns True if there is a stripped file corresponding to the |path|.
-    return os.path.isfile(
-        os.path.join(build_common.get_stripped_dir(), relpath))
+    stripped_path = os.path.join(build_common.get_stripped_dir(), relpath)
+    return stripped_path if os.path.isfile(stripped_path) else None
 
   def port_forward(self, port):
     """Uses ssh to forward a remote port to local port so that remote service
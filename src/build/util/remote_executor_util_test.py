@@ -0,0 +1,65 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unittests for remote_executor_util.py."""
+
+import os
+import tempfile
+import unittest
+
+from src.build.util import file_util
+from src.build.util import remote_executor_util
+
+
+class RsyncManifestTest(unittest.TestCase):
+  def setUp(self):
+    self._tmpdir = tempfile.mkdtemp()
+    self._manifest_path = os.path.join(self._tmpdir, 'manifest', 'a.json')
+
+  def tearDown(self):
+    file_util.rmtree(self._tmpdir)
+
+  def _write(self, name, content, mtime=None):
+    path = os.path.join(self._tmpdir, name)
+    with open(path, 'w') as f:
+      f.write(content)
+    if mtime is not None:
+      os.utime(path, (mtime, mtime))
+    return path
+
+  def testUpdate(self):
+    a = self._write('a', 'a')
+    b = self._write('b', 'b')
+    b_stripped = self._write('b.stripped', 'B')
+    manifest = remote_executor_util._RsyncManifest(self._manifest_path)
+    self.assertFalse(manifest.load())
+    manifest.reset()
+    self.assertEquals((['a', 'b'], []),
+                      manifest.update({'a': a, 'b': b}))
+    manifest.save()
+
+    manifest = remote_executor_util._RsyncManifest(self._manifest_path)
+    self.assertTrue(manifest.load())
+    # Touching a file does not make it sent again.
+    self._write('a', 'a', mtime=1234567)
+    self.assertEquals(([], []), manifest.update({'a': a, 'b': b}))
+    self._write('a', 'aa')
+    self.assertEquals((['a'], []), manifest.update({'a': a, 'b': b}))
+    # The stripped binary is sent instead.
+    self.assertEquals((['b'], []), manifest.update({'a': a, 'b': b_stripped}))
+    self.assertEquals(([], ['b']), manifest.update({'a': a}))
+
+  def testReset(self):
+    manifest = remote_executor_util._RsyncManifest(self._manifest_path)
+    manifest.reset()
+    sync_id = manifest.sync_id
+    manifest.update({'a': self._write('a', 'a')})
+    manifest.reset()
+    self.assertNotEquals(sync_id, manifest.sync_id)
+    self.assertEquals((['a'], []),
+                      manifest.update({'a': os.path.join(self._tmpdir, 'a')}))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -159,32 +159,54 @@ class ArtTestRunner(suite_runner.SuiteRunnerBase):
     prep_launch_chrome.prepare_crx_with_raw_args(args)
 
   def run(self, test_methods_to_run, scoreboard):
-    for case_name in test_methods_to_run:
-      output = None
-      with system_mode.SystemMode(self) as arc:
-        self._push_test_files(arc)
+    # Booting ARC takes much longer than running a case, so the cases run back
+    # to back in one ARC instance. ARC is rebooted only after a case crashed
+    # it, or failed to get its output.
+    arc = None
+    try:
+      for case_name in test_methods_to_run:
+        if arc is None:
+          arc = self._start_system_mode()
         begin_time = time.time()
         output = self._run_test(arc, case_name)
         elapsed_time = time.time() - begin_time
+        if output is None or arc.has_error():
+          self._logger.write('Rebooting ARC after %s\n' % case_name)
+          arc.__exit__(None, None, None)
+          arc = None
+        scoreboard.update([self._get_result(case_name, output, elapsed_time)])
+    finally:
+      if arc is not None:
+        arc.__exit__(None, None, None)
+
+  def _start_system_mode(self):
+    """Boots ARC, and pushes the test files shared by all the cases."""
+    arc = system_mode.SystemMode(self)
+    arc.__enter__()
+    try:
+      self._push_test_files(arc)
+    except Exception:
+      arc.__exit__(None, None, None)
+      raise
+    return arc
+
+  def _get_result(self, case_name, output, elapsed_time):
+    """Returns a TestMethodResult for the output of the case."""
+    # Output can be None when the adb command failed without raising an
+    # exception.
+    if output is None:
+      # In this case, arc.run_adb() should have recorded some logs
+      # which will be retrieved by arc.get_log() later.
+      return test_method_result.TestMethodResult(
+          case_name, test_method_result.TestMethodResult.FAIL)
 
-      # At this point, output can be None because evil SystemMode.__exit__()
-      # quietly suppress an exception raised from SystemMode.run_adb()!
-      if output is None:
-        # In this case, arc.run_adb() should have recorded some logs
-        # which will be retrieved by arc.get_log() later.
-        result = test_method_result.TestMethodResult(
-            case_name, test_method_result.TestMethodResult.FAIL)
-
-      elif self._is_benchmark:
-        self._logger.write(
-            'Benchmark %s: %d ms\n' % (case_name, elapsed_time * 1000))
-        result = test_method_result.TestMethodResult(
-            case_name, test_method_result.TestMethodResult.PASS)
-
-      else:
-        result = self._check_output(case_name, output)
+    if self._is_benchmark:
+      self._logger.write(
+          'Benchmark %s: %d ms\n' % (case_name, elapsed_time * 1000))
+      return test_method_result.TestMethodResult(
+          case_name, test_method_result.TestMethodResult.PASS)
 
-      scoreboard.update([result])
+    return self._check_output(case_name, output)
 
   def _push_test_files(self, arc):
     """Pushes test files via ADB.
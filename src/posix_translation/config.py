@@ -245,6 +245,14 @@ def generate_test_ninjas():
   all_files = ['src/posix_translation/test_util/mock_virtual_file_system.cc']
   n.build_default(all_files).archive()
 
+  # The tests import the scripts as local modules, which are not found as their
+  # dependencies automatically.
+  ninja_generator.generate_python_test_ninjas_for_path(
+      'src/posix_translation/scripts',
+      implicit_map={
+          'src/posix_translation/scripts/create_readonly_fs_image_test.py':
+          _CREATE_READONLY_FS_IMAGE_SCRIPT})
+
 
 def generate_binaries_depending_ninjas(root_dir_install_all_targets):
   n = ninja_generator.NinjaGenerator('readonly_fs_image')
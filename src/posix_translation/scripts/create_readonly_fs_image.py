@@ -46,16 +46,25 @@ EOF
 """
 
 import argparse
-import array
+import errno
+import marshal
+import multiprocessing.pool
 import os
 import re
 import struct
 import sys
+import tempfile
 import time
 
 
 _PAGE_SIZE = 64 * 1024  # NaCl uses 64k page.
 
+# The size of a chunk to copy the content of a file to the image.
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+# The version of the state saved with the image for --incremental.
+_STATE_VERSION = 0
+
 # File type constants, which should be consistent with ones in
 # readonly_fs_reader.h.
 _REGULAR_FILE = 0
@@ -71,42 +80,147 @@ def _normalize_path(input_filename):
   return input_filename
 
 
-def _update_metadata(metadata, content, filename, file_size, file_mtime,
-                     file_type, link_target):
-  """Adds name, size, and offset of the |filename| to |metadata|."""
-  # |content| is all the content up to this point.
-  padded_content_size = content.buffer_info()[1]
-  _pad_array(metadata, 4)
-  metadata.fromstring(struct.pack('>iiii',
-                                  padded_content_size,
-                                  file_size,
-                                  file_mtime,
-                                  file_type)
-                      + _normalize_path(filename).encode('utf_8')
-                      + '\0')
+def _pack_metadata(offset, filename, file_size, file_mtime, file_type,
+                   link_target):
+  """Returns name, size, and offset of the |filename| packed for the image."""
+  # |offset| is the padded size of all the content up to this point.
+  metadata = (struct.pack('>iiii', offset, file_size, file_mtime, file_type) +
+              _normalize_path(filename).encode('utf_8') + '\0')
   if link_target:
-    metadata.fromstring(link_target.encode('utf_8') + '\0')
-
-
-def _update_content(content, filename, size):
-  """Adds the content of the |filename| to |content|."""
-  with open(filename, 'r') as f:
-    content.fromfile(f, size)
-
-
-def _pad_array(array, boundary):
-  """Adds padding to the array so the array size aligns to a next boundary."""
-  size = array.buffer_info()[1]
-  pad_bytes = boundary - (size % boundary)
-  if pad_bytes == boundary:
-    return
-  for _ in xrange(pad_bytes):
-    array.append(0)
-
-
-def _write_image(image, output_filename):
-  with open(output_filename, 'w') as f:
-    image.tofile(f)
+    metadata += link_target.encode('utf_8') + '\0'
+  return metadata
+
+
+def _align(size, boundary):
+  """Rounds up the size to a next boundary."""
+  return (size + boundary - 1) & ~(boundary - 1)
+
+
+def _copy_stream(source, image, size, name):
+  """Copies the next |size| bytes of |source| to |image|."""
+  while size > 0:
+    chunk = source.read(min(size, _COPY_CHUNK_SIZE))
+    if not chunk:
+      raise EOFError('%s is shorter than expected' % name)
+    image.write(chunk)
+    size -= len(chunk)
+
+
+def _copy_content(image, filename, size):
+  """Copies the first |size| bytes of the |filename| to |image|."""
+  with open(filename, 'rb') as f:
+    _copy_stream(f, image, size, filename)
+
+
+def _get_stat_key(st):
+  """Returns the values of |st| which tell if the file is changed.
+
+  st_ctime is included, as it is updated on every write, even if the mtime is
+  set back to the previous value afterwards.
+  """
+  return (st.st_size, st.st_mtime, st.st_ctime, st.st_ino)
+
+
+def _get_state_path(image_filename):
+  return image_filename + '.state'
+
+
+def _load_previous_state(image_filename):
+  """Returns the state saved with the image previously generated at
+  |image_filename|, or None if it is not available.
+
+  The state is a dict, whose 'files' is a dict from each input filename to a
+  tuple of the offset, the size and the stat key of its content in the image.
+  """
+  try:
+    with open(_get_state_path(image_filename), 'rb') as f:
+      state = marshal.load(f)
+    image_stat = _get_stat_key(os.stat(image_filename))
+  except (IOError, OSError, EOFError, ValueError, TypeError):
+    return None
+  if (not isinstance(state, dict) or
+      state.get('version') != _STATE_VERSION or
+      tuple(state.get('image', ())) != image_stat):
+    # The image is modified after the state was saved.
+    return None
+  return state
+
+
+def _save_state(image_filename, metadata_size, files):
+  state_path = _get_state_path(image_filename)
+  state = {'version': _STATE_VERSION,
+           'image': _get_stat_key(os.stat(image_filename)),
+           'metadata_size': metadata_size,
+           'files': files}
+  with open(state_path + '.tmp', 'wb') as f:
+    marshal.dump(state, f)
+  os.rename(state_path + '.tmp', state_path)
+
+
+def _remove_state(image_filename):
+  try:
+    os.remove(_get_state_path(image_filename))
+  except OSError as e:
+    if e.errno != errno.ENOENT:
+      raise
+
+
+def _write_image(metadata, content_list, content_size, output_filename,
+                 incremental=False):
+  """Writes the image, streaming the content of each file to its offset.
+
+  |content_list| is a list of (filename, offset, size, stat_key) of the files
+  which have content. The padding between the contents is left as a hole of a
+  sparse file, so the image is written without holding the contents in memory.
+
+  The image is written to a temporary file, and renamed to |output_filename|
+  when it is complete. If |incremental| is True, the offset and the stat of
+  each file are saved next to the image, and the content of a file whose stat
+  is unchanged since the previous image is copied from that image.
+  """
+  previous_state = None
+  if incremental:
+    previous_state = _load_previous_state(output_filename)
+  # Remove the state first, so that it never describes another image.
+  _remove_state(output_filename)
+
+  output_dir = os.path.dirname(os.path.abspath(output_filename))
+  fd, tmp_filename = tempfile.mkstemp(
+      prefix=os.path.basename(output_filename) + '.', dir=output_dir)
+  previous_image = None
+  try:
+    if previous_state:
+      previous_image = open(output_filename, 'rb')
+    with os.fdopen(fd, 'wb') as image:
+      image.write(metadata)
+      for filename, offset, size, stat_key in content_list:
+        image.seek(len(metadata) + offset)
+        previous_entry = (previous_state and
+                          previous_state['files'].get(filename))
+        if previous_entry and tuple(previous_entry[1:]) == (size, stat_key):
+          previous_image.seek(
+              previous_state['metadata_size'] + previous_entry[0])
+          _copy_stream(previous_image, image, size, output_filename)
+        else:
+          _copy_content(image, filename, size)
+      # The padding after the last content is not written by the loop above.
+      image.truncate(len(metadata) + content_size)
+    # mkstemp() creates the file only readable by the owner.
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmp_filename, 0666 & ~umask)
+    os.rename(tmp_filename, output_filename)
+  except:
+    os.remove(tmp_filename)
+    raise
+  finally:
+    if previous_image:
+      previous_image.close()
+
+  if incremental:
+    _save_state(output_filename, len(metadata), dict(
+        (filename, (offset, size, stat_key))
+        for filename, offset, size, stat_key in content_list))
 
 
 def _format_message(i, num_files, size, mtime, file_type, filename,
@@ -125,70 +239,117 @@ def _format_message(i, num_files, size, mtime, file_type, filename,
   return message
 
 
-def _get_metadata(filename, input_filenames, symlink_map, empty_dirs,
-                  empty_files):
-  if filename in symlink_map:
-    file_type = _SYMBOLIC_LINK
-    link_target = symlink_map[filename]
-    size = 0
-    mtime = time.time()  # Using the current time for a symlink.
-  elif filename in empty_dirs:
-    file_type = _EMPTY_DIRECTORY
-    children = filter(lambda x: x.startswith(filename + '/'),
-                      input_filenames)
-    if children:
+def _stat_file(filename):
+  try:
+    return os.stat(filename)
+  except OSError as e:
+    return e
+
+
+def _stat_files(filenames, jobs):
+  """Returns the os.stat() results of |filenames|, or OSError on failure."""
+  if jobs <= 1:
+    return map(_stat_file, filenames)
+  # os.stat() releases the GIL, so threads are enough to run it in parallel.
+  pool = multiprocessing.pool.ThreadPool(jobs)
+  try:
+    return pool.map(_stat_file, filenames)
+  finally:
+    pool.close()
+
+
+def _get_nonempty_dirs(filenames):
+  """Returns the set of all the ancestor directories of |filenames|."""
+  dirs = set()
+  for filename in filenames:
+    dirname = os.path.dirname(filename)
+    # The ancestors of a directory already in |dirs| are in it, too.
+    while dirname and dirname not in dirs:
+      dirs.add(dirname)
+      dirname = os.path.dirname(dirname)
+  return dirs
+
+
+def _plan_metadata(input_filenames, symlink_map, empty_dirs, empty_files,
+                   jobs):
+  """Returns a list of (file_type, link_target, size, mtime, stat_key) of each
+  file. |stat_key| is None unless the file has content to be copied.
+  """
+  for filename in input_filenames:
+    if filename.endswith('/'):
+      print '%s should not end with /' % filename
+      sys.exit(1)
+
+  nonempty_dirs = _get_nonempty_dirs(input_filenames)
+  for filename in empty_dirs:
+    if filename in nonempty_dirs:
       print '%s is not empty' % filename
       sys.exit(1)
-    link_target = None
-    size = 0
-    mtime = time.time()  # Using the current time for an empty directory.
-  elif filename in empty_files:
-    file_type = _REGULAR_FILE
-    link_target = None
-    size = 0
-    mtime = time.time()  # Using the current time for an empty file.
-  else:
-    file_type = _REGULAR_FILE
-    link_target = None
-    try:
-      size = os.stat(filename).st_size
-      mtime = os.stat(filename).st_mtime
-    except OSError, e:
-      sys.exit(e)
-  return file_type, link_target, size, mtime
 
+  symlink_map = dict(symlink_map)
+  empty_dirs = set(empty_dirs)
+  empty_files = set(empty_files)
+  regular_files = [filename for filename in input_filenames
+                   if filename not in symlink_map and
+                   filename not in empty_dirs and filename not in empty_files]
+  stat_map = dict(zip(regular_files, _stat_files(regular_files, jobs)))
+
+  now = time.time()
+  result = []
+  for filename in input_filenames:
+    if filename in symlink_map:
+      # Using the current time for a symlink.
+      result.append((_SYMBOLIC_LINK, symlink_map[filename], 0, now, None))
+    elif filename in empty_dirs:
+      # Using the current time for an empty directory.
+      result.append((_EMPTY_DIRECTORY, None, 0, now, None))
+    elif filename in empty_files:
+      # Using the current time for an empty file.
+      result.append((_REGULAR_FILE, None, 0, now, None))
+    else:
+      st = stat_map[filename]
+      if isinstance(st, OSError):
+        sys.exit(st)
+      result.append((_REGULAR_FILE, None, st.st_size, st.st_mtime,
+                     _get_stat_key(st)))
+  return result
 
-def _generate_readonly_image(input_filenames, symlink_map, empty_dirs,
-                             empty_files, verbose, output_filename):
-  metadata = array.array('B')
-  content = array.array('B')
 
+def _generate_readonly_image(input_filenames, symlink_map, empty_dirs,
+                             empty_files, verbose, output_filename, jobs=1,
+                             incremental=False):
   input_filenames.extend(symlink_map.keys())
   input_filenames.extend(empty_dirs)
   input_filenames.extend(empty_files)
+  metadata_list = _plan_metadata(input_filenames, symlink_map, empty_dirs,
+                                 empty_files, jobs)
 
+  # Lay out all the metadata first, so that the content of each file can be
+  # written directly to its page aligned offset in the image.
   num_files = len(input_filenames)
-  _pad_array(metadata, 4)
-  metadata.fromstring(struct.pack('>i', num_files))
+  metadata = [struct.pack('>i', num_files)]
+  metadata_size = len(metadata[0])
+  content_list = []
+  content_size = 0
   for i in xrange(num_files):
     filename = input_filenames[i]
-    if filename.endswith('/'):
-      print '%s should not end with /' % filename
-      sys.exit(1)
-    file_type, link_target, size, mtime = _get_metadata(
-        filename, input_filenames, symlink_map, empty_dirs, empty_files)
+    file_type, link_target, size, mtime, stat_key = metadata_list[i]
     if verbose:
       print _format_message(i, num_files, size, mtime, file_type, filename,
                             link_target)
-    _update_metadata(metadata, content, filename, size, mtime, file_type,
-                     link_target)
+    entry = _pack_metadata(content_size, filename, size, mtime, file_type,
+                           link_target)
+    padding_size = _align(metadata_size, 4) - metadata_size
+    metadata.append('\0' * padding_size + entry)
+    metadata_size += padding_size + len(entry)
     if file_type == _REGULAR_FILE and size > 0:
-      _update_content(content, filename, size)
+      content_list.append((filename, content_size, size, stat_key))
+      content_size += size
     if i < num_files - 1:
-      _pad_array(content, _PAGE_SIZE)
-  _pad_array(metadata, _PAGE_SIZE)
-  image = metadata + content
-  _write_image(image, output_filename)
+      content_size = _align(content_size, _PAGE_SIZE)
+  metadata.append('\0' * (_align(metadata_size, _PAGE_SIZE) - metadata_size))
+  _write_image(''.join(metadata), content_list, content_size, output_filename,
+               incremental)
 
 
 def main(args):
@@ -203,6 +364,11 @@ def main(args):
                       required=True, help='List of empty files.')
   parser.add_argument('-v', '--verbose', action='store_true',
                       help='Emit verbose output.')
+  parser.add_argument('-j', '--jobs', metavar='N', default=1, type=int,
+                      help='Stat N input files at once.')
+  parser.add_argument('--incremental', action='store_true',
+                      help=('Reuse the content of the unchanged files in the '
+                            'existing output.'))
   parser.add_argument(dest='input', metavar='INPUT', nargs='+',
                       help='Input file(s) to process.')
   args = parser.parse_args()
@@ -212,7 +378,8 @@ def main(args):
   symlink_map = dict([x.split(':') for x in args.symlink_map.split(',')])
 
   _generate_readonly_image(args.input, symlink_map, empty_dirs, empty_files,
-                           args.verbose, args.output)
+                           args.verbose, args.output, jobs=args.jobs,
+                           incremental=args.incremental)
   return 0
 
 
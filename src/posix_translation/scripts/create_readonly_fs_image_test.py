@@ -0,0 +1,91 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unittest for create_readonly_fs_image.py."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import create_readonly_fs_image
+
+# The header of the images in this test fits in the first page, and each
+# content is aligned to a page.
+_PAGE_SIZE = create_readonly_fs_image._PAGE_SIZE
+
+
+class CreateReadonlyFsImageTest(unittest.TestCase):
+  def setUp(self):
+    self._root = tempfile.mkdtemp()
+    self._foo = self._write_file('foo.txt', 'foo')
+    self._bar = self._write_file('bar.txt', 'bar')
+    self._image = os.path.join(self._root, 'readonly_fs_image.img')
+
+  def tearDown(self):
+    shutil.rmtree(self._root, ignore_errors=True)
+
+  def _write_file(self, name, content):
+    path = os.path.join(self._root, name)
+    with open(path, 'wb') as f:
+      f.write(content)
+    return path
+
+  def _generate_image(self):
+    create_readonly_fs_image._generate_readonly_image(
+        [self._foo, self._bar], {}, [], [], False, self._image,
+        incremental=True)
+
+  def _read_contents(self):
+    """Returns the contents of foo.txt and bar.txt in the image."""
+    with open(self._image, 'rb') as f:
+      image = f.read()
+    return (image[_PAGE_SIZE:_PAGE_SIZE + 3],
+            image[2 * _PAGE_SIZE:2 * _PAGE_SIZE + 3])
+
+  def _overwrite_image(self, offset, content):
+    with open(self._image, 'r+b') as f:
+      f.seek(offset)
+      f.write(content)
+
+  def test_incremental(self):
+    self._generate_image()
+    self.assertEquals(('foo', 'bar'), self._read_contents())
+
+    # The content of an unchanged file is copied from the previous image.
+    # Modify the image while keeping the saved state valid to see it.
+    state = create_readonly_fs_image._load_previous_state(self._image)
+    self._overwrite_image(2 * _PAGE_SIZE, 'BAR')
+    create_readonly_fs_image._save_state(
+        self._image, state['metadata_size'], state['files'])
+    self._generate_image()
+    self.assertEquals(('foo', 'BAR'), self._read_contents())
+
+    # A file changed without changing its size and mtime is not reused.
+    st = os.stat(self._foo)
+    self._write_file('foo.txt', 'qux')
+    os.utime(self._foo, (st.st_atime, st.st_mtime))
+    self._generate_image()
+    self.assertEquals(('qux', 'BAR'), self._read_contents())
+
+  def test_modified_image_is_not_reused(self):
+    self._generate_image()
+    # The image is modified without updating the saved state, as when the
+    # previous run is interrupted.
+    self._overwrite_image(_PAGE_SIZE, 'XXX')
+    self._generate_image()
+    self.assertEquals(('foo', 'bar'), self._read_contents())
+
+  def test_not_incremental(self):
+    self._generate_image()
+    create_readonly_fs_image._generate_readonly_image(
+        [self._foo, self._bar], {}, [], [], False, self._image)
+    self.assertEquals(('foo', 'bar'), self._read_contents())
+    # The state is removed, as it is not updated for the new image.
+    self.assertIsNone(create_readonly_fs_image._load_previous_state(
+        self._image))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -10,15 +10,22 @@ Usage:
 
 $ src/posix_translation/scripts/dump_readonly_fs_image.py \
     out/target/<target>/posix_translation_gen_sources/readonly_fs_image.img
+
+To extract all the files in the image to a directory:
+
+$ src/posix_translation/scripts/dump_readonly_fs_image.py \
+    --extract-all=<dir> \
+    out/target/<target>/posix_translation_gen_sources/readonly_fs_image.img
 """
 
 import argparse
-import array
+import bisect
+import collections
+import mmap
 import os
 import struct
 import sys
 import time
-import traceback
 
 
 _PAGE_SIZE = 64 * 1024  # NaCl 64bit uses 64k page.
@@ -29,30 +36,30 @@ _REGULAR_FILE = 0
 _SYMBOLIC_LINK = 1
 _EMPTY_DIRECTORY = 2
 
+# Offset, size, mtime and type of a file.
+_ENTRY_HEADER = struct.Struct('>iiii')
 
-def _read_integer(image, offset):
-  # Reads a 4-byte big endian integer from the next word boundary of
-  # image[offset] and return a tuple of the integer and new offset.
-  offset = _seek_to_next_boundary(image, offset, 4)
-  result = struct.unpack_from('>i', image, offset)[0]
-  return (result, offset + 4)
+_Entry = collections.namedtuple(
+    '_Entry', ['offset', 'size', 'mtime', 'filetype', 'filename',
+               'link_target'])
 
 
-def _read_string(image, offset):
-  # Reads a zero-terminated string from image[offset] and return a tuple of the
-  # string and new offset.
-  result = ''
-  while image[offset] != 0:
-    result += chr(image[offset])
-    offset += 1
-  return (result, offset + 1)
+class ImageError(Exception):
+  pass
 
 
-def _seek_to_next_boundary(image, offset, boundary):
+def _align(offset, boundary):
   # Rounds up the offset to a next boundary.
-  offset = (offset + boundary - 1) & ~(boundary - 1)
-  image[offset]  # validate offset
-  return offset
+  return (offset + boundary - 1) & ~(boundary - 1)
+
+
+def _read_string(image, offset):
+  # Reads a zero-terminated string from image[offset] and return a tuple of the
+  # string and new offset.
+  end = image.find('\0', offset)
+  if end < 0:
+    raise ImageError('Unterminated string at offset %d' % offset)
+  return (image[offset:end], end + 1)
 
 
 def _format_message(offset, size, mtime, filetype, filename, link_target):
@@ -70,85 +77,155 @@ def _format_message(offset, size, mtime, filetype, filename, link_target):
   return message
 
 
-def _find_file(image, num_files, index, dump_filename, verbose):
-  dump_offset = -1
-  dump_size = -1
-  dump_mtime = -1
-  for i in xrange(num_files):
-    if verbose:
-      print 'VERBOSE: Reading file #%d at file offset %d.' % (i, index)
-    (offset, index) = _read_integer(image, index)
-    (size, index) = _read_integer(image, index)
-    (mtime, index) = _read_integer(image, index)
-    (filetype, index) = _read_integer(image, index)
-    (filename, index) = _read_string(image, index)
-    link_target = None
-    if filetype == _SYMBOLIC_LINK:
-      (link_target, index) = _read_string(image, index)
-    if not dump_filename or verbose:
-      # ls mode or verbose mode.
-      print _format_message(offset, size, mtime, filetype, filename,
-                            link_target)
-    if dump_filename == filename:
-      dump_offset = offset
-      dump_size = size
-      dump_mtime = mtime
-      break
-
-  return dump_offset, dump_size, dump_mtime
-
-
-def _read_image(image_filename, dump_filename, verbose):
-  # Parses the metadata part of image_filename. If dump_filename is None, prints
-  # the metadata in human-readable form. If dump_filename is not None, prints
-  # the content of the dump_filename.
-  image = array.array('B')
-  with open(image_filename, "r") as f:
-    size = os.stat(image_filename).st_size
-    image.fromfile(f, size)
+class _ImageReader(object):
+  """Parses the metadata of an mmap'ed image."""
 
+  def __init__(self, image, verbose=False):
+    self._image = image
+    self._verbose = verbose
+    self._entries = []
+    self._index = None
+    try:
+      self._parse()
+    except struct.error as e:
+      raise ImageError('Broken image: %s' % e)
+
+  def _parse(self):
+    image = self._image
+    num_files = struct.unpack_from('>i', image, 0)[0]
+    if self._verbose:
+      print 'VERBOSE: Image contains %d files.' % num_files
+    index = 4
+    for i in xrange(num_files):
+      index = _align(index, 4)
+      if self._verbose:
+        print 'VERBOSE: Reading file #%d at file offset %d.' % (i, index)
+      offset, size, mtime, filetype = _ENTRY_HEADER.unpack_from(image, index)
+      filename, index = _read_string(image, index + _ENTRY_HEADER.size)
+      link_target = None
+      if filetype == _SYMBOLIC_LINK:
+        link_target, index = _read_string(image, index)
+      self._entries.append(
+          _Entry(offset, size, mtime, filetype, filename, link_target))
+    # The content of files starts at the page boundary after the metadata.
+    self._content_base = _align(index, _PAGE_SIZE)
+
+  @property
+  def entries(self):
+    return self._entries
+
+  def build_index(self):
+    """Builds a sorted name index, so that find() is a binary search."""
+    self._index = sorted((entry.filename, i)
+                         for i, entry in enumerate(self._entries))
+
+  def find(self, filename):
+    """Returns the entry of |filename|, or None if it is not in the image."""
+    if self._index is None:
+      for entry in self._entries:
+        if entry.filename == filename:
+          return entry
+      return None
+    i = bisect.bisect_left(self._index, (filename,))
+    if i < len(self._index) and self._index[i][0] == filename:
+      return self._entries[self._index[i][1]]
+    return None
+
+  def get_file_offset(self, entry):
+    """Returns the offset of the content of |entry| in the image file."""
+    return self._content_base + entry.offset
+
+  def get_content(self, entry):
+    """Returns a buffer of the content of |entry|, without copying it."""
+    start = self.get_file_offset(entry)
+    if start + entry.size > len(self._image):
+      raise ImageError('%s is out of the image' % entry.filename)
+    return buffer(self._image, start, entry.size)
+
+
+def _extract_all(reader, output_dir, verbose):
+  for entry in reader.entries:
+    relpath = os.path.normpath(entry.filename.lstrip('/'))
+    if relpath == '..' or relpath.startswith('../'):
+      raise ImageError('Bad filename: %s' % entry.filename)
+    path = os.path.join(output_dir, relpath)
+    if verbose:
+      print 'VERBOSE: Extracting %s to %s.' % (entry.filename, path)
+    if entry.filetype == _EMPTY_DIRECTORY:
+      if not os.path.isdir(path):
+        os.makedirs(path)
+      continue
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+      os.makedirs(dirname)
+    if entry.filetype == _SYMBOLIC_LINK:
+      os.symlink(entry.link_target, path)
+      continue
+    with open(path, 'wb') as f:
+      f.write(reader.get_content(entry))
+    os.utime(path, (entry.mtime, entry.mtime))
+
+
+def _read_image(image_filename, dump_filenames, extract_dir, verbose):
+  # Parses the metadata part of image_filename. If neither dump_filenames nor
+  # extract_dir is given, prints the metadata in human-readable form. If
+  # dump_filenames is given, prints the content of each of them. If extract_dir
+  # is given, extracts all the files to the directory.
+  with open(image_filename, 'rb') as f:
+    size = os.fstat(f.fileno()).st_size
+    image = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+  try:
     if verbose:
       print 'VERBOSE: Image %s opened (size=%d)' % (image_filename, size)
-
-    try:
-      index = 0
-      num_files, index = _read_integer(image, index)
-
-      if verbose:
-        print 'VERBOSE: Image contains %d files.' % num_files
-
-      dump_offset, dump_size, dump_mtime = _find_file(image, num_files, index,
-                                                      dump_filename, verbose)
-
-      if not dump_filename:
-        return
-
-      # dump mode.
-      if dump_offset == -1:
+    reader = _ImageReader(image, verbose)
+
+    if extract_dir:
+      _extract_all(reader, extract_dir, verbose)
+      return
+
+    if not dump_filenames:
+      # ls mode.
+      for entry in reader.entries:
+        print _format_message(entry.offset, entry.size, entry.mtime,
+                              entry.filetype, entry.filename,
+                              entry.link_target)
+      return
+
+    # dump mode.
+    if len(dump_filenames) > 1:
+      reader.build_index()
+    for dump_filename in dump_filenames:
+      entry = reader.find(dump_filename)
+      if entry is None:
         print '%s is not in image' % dump_filename
         sys.exit(-1)
-
-      index = _seek_to_next_boundary(image, index, _PAGE_SIZE)
-      dump_offset += index  # fix-up the offset
       if verbose:
-        print 'VERBOSE: Dumping %s at file offset %d.' % (dump_filename,
-                                                          dump_offset)
-      image[dump_offset:dump_offset + dump_size].tofile(sys.stdout)
-    except IndexError:
-      traceback.print_exc()
-      sys.exit(-1)
+        print _format_message(entry.offset, entry.size, entry.mtime,
+                              entry.filetype, entry.filename,
+                              entry.link_target)
+        print 'VERBOSE: Dumping %s at file offset %d.' % (
+            dump_filename, reader.get_file_offset(entry))
+      sys.stdout.write(reader.get_content(entry))
+  except ImageError as e:
+    print e
+    sys.exit(-1)
+  finally:
+    image.close()
 
 
 def main(args):
   parser = argparse.ArgumentParser()
   parser.add_argument('-v', '--verbose', action='store_true', help='Emit '
                       'verbose output.')
-  parser.add_argument('-d', '--dump', metavar='FILENAME', help='Instead of '
-                      'printing a list of files, dump the list to a file.')
+  parser.add_argument('-d', '--dump', metavar='FILENAME', action='append',
+                      help='Instead of printing a list of files, dump the '
+                      'content of the file. Can be specified multiple times.')
+  parser.add_argument('-x', '--extract-all', metavar='DIR',
+                      help='Extract all the files in the image to DIR.')
   parser.add_argument(dest='input', metavar=('INPUT'), help='Image file.')
   args = parser.parse_args()
 
-  _read_image(args.input, args.dump, args.verbose)
+  _read_image(args.input, args.dump, args.extract_all, args.verbose)
   return 0
 
 